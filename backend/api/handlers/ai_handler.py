@@ -10,26 +10,30 @@ import torch
 import base64
 import io
 from setup import Initializer
-from function import groq_llama_completion, compress_and_encode_image
-from api.handlers.ai_trend_geo_handler import get_trendy_store_locations_api
+from api.handlers.health_handler import require_models_ready
+from function import compress_and_encode_image
+from services.llm_gateway import get_llm_gateway
 from collections import defaultdict
 from models.image import ImagePayload
 from models.detection import DetectionInput
 from models.retrieval import RetrievalOutput
 from models.user import FashionAdvisorInput,UserQuery, UserProfile
-from fastapi import File, UploadFile
-from models.trend_geo import TrendGeoRequest
+from fastapi import File, Form, UploadFile
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from assets.prompt_template_setup import *
 import os
 from utils.utils import translate_url
+from controllers.ai import ai_controller, ai_trend_geo_controller
+from utils.response import standard_response
+from utils.sse import SSE_HEADERS, format_sse
 from schemas.product_schema import ProductMetadata
 import re
 from utils.jwt_util import *
 import logging
 
-router = APIRouter(prefix="/ai", tags=["Ai"])
-
-Initializer = Initializer.get_instance()
+# AI endpoints answer 503 until the models have loaded and warmed up (see setup.Initializer.load)
+router = APIRouter(prefix="/ai", tags=["Ai"], dependencies=[Depends(require_models_ready)])
 
 
 # -------------------------------
@@ -47,11 +51,67 @@ def read_root():
     return {"message": "Hello, FastAPI!"}
 
 
+@router.post("/images")
+def upload_image(payload: ImagePayload):
+    """
+    Purpose: Upload an image once and get a handle for the other /ai endpoints. The decoded image,
+    its detections and crop embeddings are cached under the handle, so follow-up calls skip that work.
+    Input: JSON body with a base64-encoded image (ImagePayload: { image_base64: str })
+    Output: JSON with the image_id (SHA-256 of the image bytes), its size and the idle expiry.
+    Example Response:
+        {"image_id": "9f2c...", "width": 768, "height": 1024, "expires_in_seconds": 900}
+    """
+    if not payload.image_base64:
+        raise HTTPException(status_code=422, detail="image_base64 is required")
+    artifacts = ai_controller.store_image(payload.image_base64)
+    width, height = artifacts.image.size
+    return {
+        "image_id": artifacts.image_id,
+        "width": width,
+        "height": height,
+        "expires_in_seconds": Initializer.get_instance().image_cache.ttl_seconds
+    }
+
+
+@router.get("/cache-stats")
+def cache_stats():
+    """
+    Purpose: Hit/miss counters of the image-handle cache, the perceptual-hash crop embedding cache
+    and the LLM response cache, and the bytes saved by prompt image compression.
+    Input: None
+    Output: JSON with the size and hit/miss counts of each cache.
+    """
+    initializer = Initializer.get_instance()
+    return standard_response(
+        code=200,
+        message="Cache statistics",
+        data={
+            "image_cache": initializer.image_cache.stats(),
+            "crop_embedding_cache": initializer.crop_embedding_cache.stats(),
+            "llm_response_cache": get_llm_gateway().cache.stats(),
+            "prompt_images": initializer.prompt_images.stats()
+        }
+    )
+
+
+@router.get("/llm-metrics")
+def llm_metrics():
+    """
+    Purpose: Prompt and completion token histograms of LLM calls, per task (endpoint / call site),
+    and the model route of every task class.
+    Input: None
+    Output: JSON with the routes and, per task, count, mean, p50/p95 (bucket upper bounds), max and bucket counts.
+    """
+    gateway = get_llm_gateway()
+    routes = {task_class: vars(route) for task_class, route in gateway.routes.items()}
+    return standard_response(code=200, message="LLM token usage", data={"routes": routes, "tasks": gateway.metrics.stats()})
+
+
 @router.post("/object-detector")
 def object_detector(payload: ImagePayload):
     """
     Purpose: Detects objects in a user-uploaded image using a YOLO model.
-    Input: JSON body with a base64-encoded image (ImagePayload: { image_base64: str })
+    Input: JSON body with a base64-encoded image or an uploaded image id (ImagePayload: { image_base64 | image_id })
     Output: JSON with detected object scores, labels, and bounding boxes.
     Example Response:
         {
@@ -60,109 +120,33 @@ def object_detector(payload: ImagePayload):
             "bboxes": [[x1, y1, x2, y2], ...]
         }
     """
-    # Decode base64 string to bytes
-    image_data = base64.b64decode(payload.image_base64.split(",")[-1])
-    # Load the image with PIL
-    image = Image.open(BytesIO(image_data)).convert("RGB")
-    # Object Detection
-    with torch.no_grad():
-        inputs = Initializer.yolo_image_processor(images=[image], return_tensors="pt")
-        outputs = Initializer.yolo_model(**inputs.to(Initializer.device))
-        target_sizes = torch.tensor([[image.size[1], image.size[0]]])
-        results = Initializer.yolo_image_processor.post_process_object_detection(
-            outputs, threshold=0.85, target_sizes=target_sizes)[0]
-
-        items = {"scores": [], "labels": [], "bboxes": []}
-        boxes = []
-        for score, label, box in zip(results["scores"], results["labels"], results["boxes"]):
-            score = score.item()
-            label = label.item()
-            box = [i.item() for i in box]
-            items["scores"].append(score)
-            items["labels"].append(Initializer.yolo_model.config.id2label[label])
-            items["bboxes"].append(box)
-    # Return Output
-    return items
+    context = ai_controller.create_context(payload.image_base64, payload.image_id)
+    return ai_controller.detect_original(context)
 
 
 @router.post("/image-retrieval")
 def image_retrieval(payload: DetectionInput, k: int = Query(5, description="Number of results per object")):
     """
     Purpose: Retrieves similar images from a vector database for each detected object in the input image.
-    Input: JSON body with base64-encoded image and detected items (DetectionInput), query parameter k (number of results per object).
-    Output: JSON with lists of retrieved image paths, detected labels, and similarity scores.
+    Input: JSON body with base64-encoded image (or image_id) and detected items (DetectionInput; items may be
+           omitted for an uploaded image id to reuse its detections), query parameter k (number of results per object).
+    Output: JSON with lists of retrieved image paths, detected labels, and similarity scores
+            (top-k for every detected object, in detection order), plus the same matches grouped per object.
     Example Response:
         {
             "retrieved_image_paths": ["/path/to/img1.jpg", ...],
             "detected_labels": ["top", ...],
-            "similarity_scores": [0.92, ...]
+            "similarity_scores": [0.92, ...],
+            "objects": [{"label": "top", "retrieved_image_paths": [...], "similarity_scores": [...]}, ...]
         }
     """
-    """ Load the image """
-    # Decode base64 string to bytes
-    image_data = base64.b64decode(payload.image_base64.split(",")[-1])
-    # Load the image with PIL
-    image = Image.open(BytesIO(image_data)).convert("RGB")
-
-    """ Object Cropping """
-    cropped_objects = []
-    # Cropping the objects of interest
-    for box in payload.items.bboxes:
-        a = image.crop(box)
-        cropped_objects.append(a)
-
-    """ Searching the image through vector database """
-    # Initialize
-    image_features = []
-    dists, indexes = [], []
-    # Perform image feature extraction
-    detected_labels = []
-    inputs = Initializer.feature_extractor(
-        images=cropped_objects, return_tensors="pt")
-    for i in range(inputs['pixel_values'].size(0)):
-        feature = inputs['pixel_values'][i].unsqueeze(0)
-        image_features = Initializer.clip_model.get_image_features(feature.to(Initializer.device))
-        # Normalize the features
-        image_features = image_features / \
-            image_features.norm(p=2, dim=-1, keepdim=True)
-        image_features = image_features.detach().cpu().numpy()
-        # Retrieve the similar image features through cosine similarity
-        D, I = Initializer.index.search(image_features, k)
-        # Getting the data of distance and index
-        dists += D.tolist()
-        indexes += I.tolist()
-        detected_labels += [payload.items.labels[i]]*k
-
-    """ Getting Image Paths and Scores """
-    retrieved_image_paths = []
-    scores = []
-    for index_, dist_ in zip(indexes, dists):
-        for i in range(len(index_)):
-            retrieved_image_paths.append(Initializer.image_paths[index_[i]])
-            scores.append(round(dist_[i], 4))
-
-    # Truncate each list to the first k elements
-    retrieved_image_paths = retrieved_image_paths[:k]
-    detected_labels = detected_labels[:k]
-    scores = scores[:k]
-
-    # Retrieve product metadata for each image path
-    products = []
-    for path in retrieved_image_paths:
-        db_path = translate_url(path)
-        response = Initializer.database.table("products").select("*").eq("image", db_path).execute()
-        if response.data and len(response.data) > 0:
-            products.append(response.data[0])
-        else:
-            products.append(None)  # or skip, depending on requirements
-
-    """ Return Output """
-    return {
-        "retrieved_image_paths": retrieved_image_paths,
-        "detected_labels": detected_labels,
-        "similarity_scores": scores,
-        "products": products
-    }
+    context = ai_controller.create_context(payload.image_base64, payload.image_id)
+    # Embed all cropped objects in one pass and search them in one index call
+    detections = None
+    if payload.items is not None:
+        detections = {"labels": payload.items.labels, "bboxes": payload.items.bboxes}
+    groups = ai_controller.retrieve(context, k, detections=detections)
+    return ai_controller.flatten_groups(groups)
 
 
 @router.post("/response-generation-fasion-advisor")  # embed feature session tracking here
@@ -177,102 +161,40 @@ def response_generation(
     """
     Purpose: Generates a natural language response as a fashion advisor, based on the user's image, retrieval results, and query.
     Input:
-        - image: JSON body with base64-encoded image (ImagePayload)
+        - image: JSON body with base64-encoded image or uploaded image id (ImagePayload)
         - data: RetrievalOutput (retrieved_image_paths, detected_labels, similarity_scores)
         - user_query: string (query parameter)
     Output: JSON with a generated response string from the AI model.
     Example Response:
         {"response": "Based on your outfit, I recommend..."}
     """
-    # Load the image
-    query_image = image.image_base64
-
-    # Preprocess the Retrieval Output
-    combined = list(zip(
-        data.retrieved_image_paths,
-        data.detected_labels,
-        data.similarity_scores
-    ))
-
-    # Define category priority
-    priority_order = ["top", "bottom", "shoes", "hat", "outer", "dress", "bag"]
-    best_items_by_label = defaultdict(lambda: (None, -1))  # label -> (item, score)
-
-    for path, label, score in combined:
-        if score > best_items_by_label[label][1]:
-            best_items_by_label[label] = ((path, label, score), score)
-
-    # Pick top N items based on priority order
-    selected_items = []
-    for label in priority_order:
-        if label in best_items_by_label:
-            selected_items.append(best_items_by_label[label][0])
-        if len(selected_items) == Initializer.max_selected_items_mllm:
-            break
-
-    if not selected_items:
-        raise HTTPException(status_code=404, detail="No matching items found")
-
-    retrieved_image_paths, detected_labels, similarity_scores = zip(*selected_items)
-
-    retrieval_result = {
-        "retrieved_image_paths": list(retrieved_image_paths),
-        "detected_labels": list(detected_labels),
-        "similarity_scores": list(similarity_scores)
-    }
+    image_url = ai_controller.prompt_image_url(image.image_base64, image.image_id)
+    # Products are re-resolved from the catalog rather than trusted from the request body
+    return ai_controller.generate_advice(
+        image_url, user_query,
+        data.retrieved_image_paths, data.detected_labels, data.similarity_scores,
+        [None] * len(data.retrieved_image_paths), k, user_profile_message
+    )
 
-    # Construct Prompt Message Payload
-    content = [{
-        "type": "text",
-        "text": f"USER's QUERY: {user_query}"
-    }]
-    if user_profile_message:
-        content.append(user_profile_message)
-    content += [{
-        "type": "text",
-        "text": "This is the user photo in his/her style wearing an outfit."
-    }, {
-        "type": "image_url",
-        "image_url": {"url": query_image}
-    }]
-
-    products = []  # Collect product metadata for response
-    i = 1
-    for path in retrieval_result["retrieved_image_paths"]:
-        path = translate_url(path)
-        response = Initializer.database.table("products").select("*").eq("image", path).execute()
-        if not response.data or len(response.data) == 0:
-            raise ValueError(f"No product found for image path: {path}")
-        product = response.data[0]
-        products.append(product)
-
-        extra_info = f"{i}. Extra Info on this image reference:\n"
-        for key, value in product.items():
-            extra_info += f"{key}: {value}\n"
-        content.append({"type": "text", "text": extra_info})
-
-        # Add public URL
-        if path.startswith(("http://", "https://")):
-            image_url = path
-        else:
-            SUPABASE_URL = Initializer.database.url if hasattr(Initializer.database, 'url') else os.getenv("SUPABASE_URL")
-            SUPABASE_BUCKET = "product-images"
-            image_url = f"{SUPABASE_URL}/storage/v1/object/public/{SUPABASE_BUCKET}/{path}"
-        content.append({"type": "image_url", "image_url": {"url": image_url}})
-        i += 1
-
-    messages = [
-        {"role": "system", "content": system_instruction_outfit_advisor},
-        {"role": "user", "content": content}
-    ]
-
-    # Generate response
-    ai_response = groq_llama_completion(messages, token=1024)
+def _user_profile_message(initializer, user_id):
+    """The user's profile description as a prompt message part, or None."""
+    if not user_id:
+        return None
+    profile_resp = initializer.database.table("user_profile").select("description").eq("user_id", user_id).single().execute()
+    if profile_resp.data and profile_resp.data.get("description"):
+        return {"type": "text", "text": f"USER PROFILE: {profile_resp.data['description']}"}
+    return None
 
-    return {
-        "response": ai_response,
-        "products": products[:k]
+
+def _track_session(initializer, user_id, query_text, image_path, recommendations):
+    session_data = {
+        "user_id": user_id,  # NULL if anonymous
+        "query_text": query_text,
+        "image_path": image_path,  # optionally upload to Supabase Storage
+        "recommendations": recommendations
     }
+    initializer.database.table("user_sessions").insert(session_data).execute()
+
 
 @router.post("/fashion-advisor-visual")
 def full_fashion_advisor(
@@ -282,101 +204,115 @@ def full_fashion_advisor(
     """
     Purpose: A full pipeline endpoint that performs object detection,
     image retrieval, and fashion response generation in a single call.
-    Input: Base64 image and user query
+    Input: Base64 image (or uploaded image id) and user query
     Output: Generated fashion advice response
     """
-    # Step 0: Fetch user profile description
-    user_profile_desc = None
-    if user_id:
-        profile_resp = Initializer.database.table("user_profile").select("description").eq("user_id", user_id).single().execute()
-        if profile_resp.data and "description" in profile_resp.data:
-            user_profile_desc = profile_resp.data["description"]
-
-    # Step 1: Object Detection
-    detection_payload = ImagePayload(image_base64=payload.image_base64)
-    detection_result = object_detector(detection_payload)
-
-    # Step 2: Image Retrieval
-    retrieval_payload = DetectionInput(
-        image_base64=payload.image_base64,
-        items=detection_result
-    )
+    initializer = Initializer.get_instance()
+    user_profile_message = _user_profile_message(initializer, user_id)
+
+    # Steps 1-3: detection, retrieval and response generation on a single decode of the image
     k = 3
-    retrieval_result = image_retrieval(retrieval_payload, k)
-
-    # Step 3: Response Generation
-    image_payload = ImagePayload(image_base64=payload.image_base64)
-    retrieval_output = RetrievalOutput(**retrieval_result)
-    # Prepare user profile message
-    user_profile_message = None
-    if user_profile_desc:
-        user_profile_message = {"type": "text", "text": f"USER PROFILE: {user_profile_desc}"}
-    # Pass user_profile_message to response_generation
-    advisor_response = response_generation(
-        image=image_payload,
-        data=retrieval_output,
-        user_query=payload.user_query,
-        k=k,
-        user_id=user_id,  # Pass user_id explicitly
-        user_profile_message=user_profile_message
-    )
+    advisor_response, retrieval_result, _ = ai_controller.run_visual_advisor(
+        payload.image_base64, payload.user_query, k, user_profile_message, image_id=payload.image_id)
 
     # ======= EMBED SESSION TRACKING =======
-    session_data = {
-        "user_id": user_id,  # NULL if anonymous
-        "query_text": payload.user_query,
-        "image_path": payload.image_base64,  # optionally upload to Supabase Storage
-        "recommendations": retrieval_result["retrieved_image_paths"]
-    }
     print(f"[DEBUG] full_fashion_advisor user_id: {user_id}")
-    Initializer.database.table("user_sessions").insert(session_data).execute()
+    _track_session(initializer, user_id, payload.user_query, payload.image_base64 or payload.image_id,
+                   retrieval_result["retrieved_image_paths"])
+
+    return advisor_response
+
+
+# -------------------------------
+# Binary (multipart) variants of the vision endpoints: the image is streamed to a spooled
+# temporary file instead of a base64 JSON string, and large JPEGs are decoded at reduced size
+# -------------------------------
+
+@router.post("/images/upload")
+def upload_image_file(file: UploadFile = File(...)):
+    """
+    Purpose: Multipart version of POST /ai/images.
+    Input: Multipart form with the image file (field "file")
+    Output: JSON with the image_id (SHA-256 of the image bytes plus the decode size, so it differs from the
+    JSON upload's handle), the decoded size, the original size (box coordinates refer to it) and the idle expiry.
+    Example Response:
+        {"image_id": "9f2c...-d512", "width": 1512, "height": 2016, "original_width": 3024, "original_height": 4032, "expires_in_seconds": 900}
+    """
+    artifacts = ai_controller.store_upload(file)
+    width, height = artifacts.image.size
+    original_width, original_height = artifacts.original_size
+    return {
+        "image_id": artifacts.image_id,
+        "width": width,
+        "height": height,
+        "original_width": original_width,
+        "original_height": original_height,
+        "expires_in_seconds": Initializer.get_instance().image_cache.ttl_seconds
+    }
+
+
+@router.post("/object-detector/upload")
+def object_detector_file(file: UploadFile = File(...)):
+    """
+    Purpose: Multipart version of /ai/object-detector.
+    Input: Multipart form with the image file (field "file")
+    Output: JSON with detected object scores, labels and bounding boxes (in original-image pixel coordinates,
+    also for JPEGs decoded at reduced size), plus the image_id.
+    """
+    context = ai_controller.create_context(file=file)
+    return {**ai_controller.detect_original(context), "image_id": context.image_id}
+
+
+@router.post("/image-retrieval/upload")
+def image_retrieval_file(file: UploadFile = File(...), k: int = Query(5, description="Number of results per object")):
+    """
+    Purpose: Multipart version of /ai/image-retrieval; objects are detected server-side.
+    Input: Multipart form with the image file (field "file"), query parameter k (number of results per object).
+    Output: Same as /ai/image-retrieval, plus the image_id.
+    """
+    context = ai_controller.create_context(file=file)
+    groups = ai_controller.retrieve(context, k)
+    return {**ai_controller.flatten_groups(groups), "image_id": context.image_id}
+
 
+@router.post("/fashion-advisor-visual/upload")
+def full_fashion_advisor_file(
+    file: UploadFile = File(...),
+    user_query: str = Form(...),
+    user_id: str = Depends(get_user_id)  # Inject user_id from token
+):
+    """
+    Purpose: Multipart version of /ai/fashion-advisor-visual.
+    Input: Multipart form with the image file (field "file") and user_query
+    Output: Generated fashion advice response
+    """
+    initializer = Initializer.get_instance()
+    user_profile_message = _user_profile_message(initializer, user_id)
+
+    k = 3
+    advisor_response, retrieval_result, image_id = ai_controller.run_visual_advisor(
+        None, user_query, k, user_profile_message, file=file)
+
+    _track_session(initializer, user_id, user_query, image_id, retrieval_result["retrieved_image_paths"])
     return advisor_response
 
 @router.post("/online-search-agent")
 async def online_agent(payload: UserQuery):
-    # Simplify Query
-    messages = [
-        {
-            "role": "system",
-            "content": system_instruction_simplify_prompt
-        },
-        {
-            "role": "user",
-            "content": [{
-                        "type": "text",
-                        "text": f"User Query: {payload.user_query}"
-                         }]  
-        }
-    ]
-    simplified_query = groq_llama_completion(messages, token=1024)
-    print(simplified_query)
-    # Make product description
-    messages = [
-        {
-            "role": "system",
-            "content": system_instruction_product_desc
-        },
-        {
-            "role": "user",
-            "content": [{
-                        "type": "text",
-                        "text": f"User Query: {payload.user_query}"
-                         }]  
-        }
-    ]
-    description  = groq_llama_completion(messages, token=1024)
-    print(description)
-    # Get trend score API
-    data = {
-            "product_metadata": {
-                "description":description
-            },
-            "user_style_description": simplified_query,
-            "user_location": "San Francisco, CA"
-        }
-    result = await get_trendy_store_locations_api(TrendGeoRequest(**data))
-    return {"response":result}
+    """
+    Purpose: Find nearby stores selling on-trend products matching the user's query.
+    Input: JSON body with user_query (UserQuery)
+    Output: JSON with the trendy store locations.
+    Example Response:
+        {"response": {"stores": [{"name": "Store A", "address": "...", "latitude": 37.7, "longitude": -122.4}]}}
+    """
+    # Independent steps (query simplification, product description -> trends, geocoding) run concurrently
+    try:
+        stores = await ai_trend_geo_controller.run_online_search_agent(payload.user_query)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"response": {"stores": stores}}
 
 @router.post("/fashion-advisor-text-only")
 def fashion_advisor_text_only(
@@ -385,82 +321,135 @@ def fashion_advisor_text_only(
     user_id: str = Depends(get_user_id)  # Get user_id from token if available
 ):
     """
-    Purpose: Generate a fashion recommendation/analysis based only on user_query and all products in the database.
+    Purpose: Generate a fashion recommendation/analysis based only on user_query and the catalog products
+    closest to it (BM25 over product text fused with CLIP text-to-image search).
     Input: user_query (string)
     Output: JSON with a generated response string and top k products.
     Example Response:
         {"response": "Based on your query, I recommend...", "products": [ ... ]}
     """
-    # Fetch user profile description
-    user_profile_desc = None
-    if user_id:
-        profile_resp = Initializer.database.table("user_profile").select("description").eq("user_id", user_id).single().execute()
-        if profile_resp.data and "description" in profile_resp.data:
-            user_profile_desc = profile_resp.data["description"]
-
-    # Fetch all products (no pagination for now)
-    response = Initializer.database.table("products").select("*").execute()
-    products = response.data if response.data else []
-
-    # Optionally, convert to ProductMetadata for consistency
-    product_objs = [ProductMetadata(**item).dict() for item in products]
-
-    # Use AI to select the top k most relevant products
-    # Prepare a string with all product info for the model
-    all_product_info = "\n".join([
-        f"{i+1}. {p['name']} - {p.get('description', '')} (Brand: {p.get('brand', '')}, Category: {p.get('category', '')})"
-        for i, p in enumerate(product_objs)
-    ])
-    selection_prompt = [
-        {"type": "text", "text": f"USER's QUERY: {user_query}"},
-        {"type": "text", "text": "Here are all available products in our store:"},
-        {"type": "text", "text": all_product_info},
-        {"type": "text", "text": f"Please select the top {k} products (by their number) that are most relevant to the user's query. Return ONLY a comma-separated list of numbers, no explanation."}
-    ]
-    selection_messages = [
-        {"role": "system", "content": system_instruction_basic_qna},
-        {"role": "user", "content": selection_prompt}
-    ]
-    selection_response = groq_llama_completion(selection_messages, token=128)
-    indices = [int(x.strip())-1 for x in re.findall(r'\d+', selection_response)][:k]
-    selected_products = [product_objs[i] for i in indices if 0 <= i < len(product_objs)]
-
-    # Prepare product info for the prompt (only top k)
-    product_info = "\n".join([
-        f"{i+1}. {p['name']} - {p.get('description', '')} (Brand: {p.get('brand', '')}, Category: {p.get('category', '')})"
-        for i, p in enumerate(selected_products)
-    ])
-
-    # Construct the prompt
-    content = [
-        {"type": "text", "text": f"USER's QUERY: {user_query}"},
-    ]
-    if user_profile_desc:
-        content.append({"type": "text", "text": f"USER PROFILE: {user_profile_desc}"})
-    content += [
-        {"type": "text", "text": "Here are some available products in our store:"},
-        {"type": "text", "text": product_info}
-    ]
-    messages = [
-        {"role": "system", "content": system_instruction_basic_qna},
-        {"role": "user", "content": content}
-    ]
-
-    # Generate the response
-    response_text = groq_llama_completion(messages, token=1024)
+    initializer = Initializer.get_instance()
+    user_profile_message = _user_profile_message(initializer, user_id)
+
+    # Candidate products by hybrid BM25 + CLIP text-to-image search instead of an LLM pass over the whole catalog
+    messages, selected_products = ai_controller.prepare_text_advice(user_query, k, user_profile_message)
+
+    # Generate the response (identical prompts - same query, products and profile - are served from the cache)
+    response_text = get_llm_gateway().complete(messages, "advice", cache=True, task="fashion_advisor_text_only")
 
     # ======= EMBED SESSION TRACKING =======
-    session_data = {
-        "user_id": user_id,  # NULL if anonymous
-        "query_text": user_query,
-        "image_path": None,  # No image in text-only flow
-        "recommendations": [p["name"] for p in selected_products]  # Save recommended product names
-    }
     print(f"[DEBUG] fashion_advisor_text_only user_id: {user_id}")
-    print(f"[DEBUG] fashion_advisor_text_only session_data: {session_data}")
-    Initializer.database.table("user_sessions").insert(session_data).execute()
+    _track_session(initializer, user_id, user_query, None, [p["name"] for p in selected_products])
 
     return {
         "response": response_text,
         "products": selected_products
     }
+
+
+# -------------------------------
+# Streaming (server-sent events) variants of the advisor endpoints. Products are sent as soon as
+# retrieval finishes, then the advice is forwarded token by token:
+#   event: products  data: {"products": [...], ...}
+#   event: token     data: {"text": "..."}
+#   event: done      data: {"response": "<full text>"}
+#   event: error     data: {"detail": "..."}   (LLM failure after the stream started)
+# Detection/retrieval errors are raised before the stream starts and keep their HTTP status.
+# The session is recorded once the stream completes; a client that disconnects cancels the LLM call.
+# -------------------------------
+
+async def _advice_events(messages, first_event, task, on_complete=None, cache=False):
+    yield format_sse("products", first_event)
+    chunks = []
+    try:
+        async for delta in get_llm_gateway().astream(messages, "advice", cache=cache, task=task):
+            chunks.append(delta)
+            yield format_sse("token", {"text": delta})
+    except HTTPException as e:
+        yield format_sse("error", {"detail": e.detail})
+        return
+    response_text = "".join(chunks)
+    yield format_sse("done", {"response": response_text})
+    if on_complete is not None:
+        try:
+            await run_in_threadpool(on_complete)
+        except Exception as e:
+            print(f"[AIHandler] Session tracking failed after stream: {e}")
+
+
+def _event_stream(events) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.post("/fashion-advisor-visual/stream")
+async def full_fashion_advisor_stream(
+    payload: FashionAdvisorInput,
+    user_id: str = Depends(get_user_id)  # Inject user_id from token
+):
+    """
+    Purpose: Streaming version of /ai/fashion-advisor-visual (text/event-stream).
+    Input: Base64 image (or uploaded image id) and user query
+    Output: SSE events: "products" (products + retrieval result + image_id), "token" per response chunk, then "done".
+    """
+    initializer = Initializer.get_instance()
+    k = 3
+
+    def prepare():
+        user_profile_message = _user_profile_message(initializer, user_id)
+        return ai_controller.prepare_visual_advice(
+            payload.image_base64, payload.user_query, k, user_profile_message, image_id=payload.image_id)
+
+    # Blocking detection/retrieval runs in the threadpool, off the event loop
+    messages, products, retrieval_result, image_id = await run_in_threadpool(prepare)
+    first_event = {"products": products, "retrieval": retrieval_result, "image_id": image_id}
+    track = lambda: _track_session(initializer, user_id, payload.user_query, payload.image_base64 or payload.image_id,
+                                   retrieval_result["retrieved_image_paths"])
+    return _event_stream(_advice_events(messages, first_event, "fashion_advisor_visual", track))
+
+
+@router.post("/response-generation-fasion-advisor/stream")
+async def response_generation_stream(
+    image: ImagePayload,
+    data: RetrievalOutput,
+    user_query: str = Query(...),
+    k: int = Query(5, description="Number of results per object"),
+    user_profile_message: dict = None
+):
+    """
+    Purpose: Streaming version of /ai/response-generation-fasion-advisor (text/event-stream).
+    Input: Same as /ai/response-generation-fasion-advisor
+    Output: SSE events: "products", "token" per response chunk, then "done".
+    """
+    def prepare():
+        image_url = ai_controller.prompt_image_url(image.image_base64, image.image_id)
+        return ai_controller.prepare_advice(
+            image_url, user_query,
+            data.retrieved_image_paths, data.detected_labels, data.similarity_scores,
+            [None] * len(data.retrieved_image_paths), k, user_profile_message
+        )
+
+    messages, products = await run_in_threadpool(prepare)
+    return _event_stream(_advice_events(messages, {"products": products}, "response_generation"))
+
+
+@router.post("/fashion-advisor-text-only/stream")
+async def fashion_advisor_text_only_stream(
+    user_query: str = Query(...),
+    k: int = Query(3, description="Number of top products to return"),
+    user_id: str = Depends(get_user_id)  # Get user_id from token if available
+):
+    """
+    Purpose: Streaming version of /ai/fashion-advisor-text-only (text/event-stream).
+    Input: user_query (string)
+    Output: SSE events: "products" (top k products), "token" per response chunk, then "done".
+    """
+    initializer = Initializer.get_instance()
+
+    def prepare():
+        user_profile_message = _user_profile_message(initializer, user_id)
+        return ai_controller.prepare_text_advice(user_query, k, user_profile_message)
+
+    messages, products = await run_in_threadpool(prepare)
+    track = lambda: _track_session(initializer, user_id, user_query, None, [p["name"] for p in products])
+    return _event_stream(_advice_events(messages, {"products": products}, "fashion_advisor_text_only", track,
+                                        cache=True))
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+from setup import Initializer
+from utils.response import standard_response
+
+router = APIRouter(prefix="/health", tags=["Health"])
+
+LOADING_RETRY_AFTER_SECONDS = "10"
+
+
+def require_models_ready():
+    """Router dependency: 503 (with Retry-After) while models are still loading."""
+    if Initializer.is_ready():
+        return
+    status = Initializer.start_loading().status()
+    if status["error"]:
+        raise HTTPException(status_code=503, detail=f"Models failed to load: {status['error']}")
+    raise HTTPException(
+        status_code=503,
+        detail="Models are still loading, please retry",
+        headers={"Retry-After": LOADING_RETRY_AFTER_SECONDS}
+    )
+
+
+@router.get("/live")
+def liveness():
+    """
+    Purpose: Liveness probe; the process is up and serving HTTP.
+    Input: None
+    Output: JSON {"status": "alive"}
+    """
+    return standard_response(code=200, message="Service is alive", data={"status": "alive"})
+
+
+@router.get("/ready")
+def readiness():
+    """
+    Purpose: Readiness probe; 200 only once every model and artifact is loaded and warmed up.
+    Input: None
+    Output: JSON with ready/loading/error flags and the startup timing breakdown (503 until ready).
+    """
+    status = Initializer.start_loading().status()
+    code = 200 if status["ready"] else 503
+    return JSONResponse(
+        status_code=code,
+        content=standard_response(
+            code=code,
+            message="Service is ready" if status["ready"] else "Service is not ready",
+            data=status
+        )
+    )
@@ -0,0 +1,100 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from typing import Optional
+import hmac
+import os
+from setup import Initializer
+from utils.response import standard_response
+from services.index_manifest import IndexManifestMismatch
+from api.handlers.health_handler import require_models_ready
+
+router = APIRouter(prefix="/ai/index", tags=["Index"], dependencies=[Depends(require_models_ready)])
+
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    # Fail closed: index maintenance is disabled until INDEX_ADMIN_TOKEN is configured
+    expected = os.getenv("INDEX_ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Index maintenance is disabled (INDEX_ADMIN_TOKEN is not set)")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@router.get("/status")
+def index_status():
+    """
+    Purpose: Describe the vector index version currently serving searches.
+    Input: None
+    Output: JSON with the version, base build version, vector count and category partitions.
+    """
+    manager = Initializer.get_instance().index_manager
+    return standard_response(code=200, message="Index status", data=manager.status())
+
+
+@router.post("/reload", dependencies=[Depends(require_admin_token)])
+def reload_index(force: bool = False):
+    """
+    Purpose: Revalidate image.faiss in the bucket and hot-swap it in if a new build was uploaded.
+    In-flight searches finish on the previous version.
+    Input: Query parameter force (bool, default False) to reload even when the version is unchanged.
+    Output: JSON with whether a new version was installed and the current index status,
+    or 409 if the new index and its manifest don't match (the current version keeps serving).
+    """
+    manager = Initializer.get_instance().index_manager
+    try:
+        reloaded = manager.reload(force=force)
+    except IndexManifestMismatch as e:
+        raise HTTPException(status_code=409, detail=f"Index not swapped, current version kept: {e}")
+    return standard_response(
+        code=200,
+        message="Index reloaded" if reloaded else "Index already up to date",
+        data={"reloaded": reloaded, **manager.status()}
+    )
+
+
+@router.post("/products/{product_id}", dependencies=[Depends(require_admin_token)])
+def index_product(product_id: str):
+    """
+    Purpose: Embed a product's image and add it to the live index, replacing its previous vectors.
+    Input: Path parameter product_id (str)
+    Output: JSON with the number of vectors added and the new index status, or 404 if the product is unknown.
+    """
+    initializer = Initializer.get_instance()
+    manager = initializer.index_manager
+    product = initializer.catalog.get_by_id(product_id)
+    refreshed = product is None
+    if refreshed:
+        # With INDEX_AUTO_UPDATE the refresh's listener indexes a new product right away
+        initializer.catalog.refresh()
+        product = initializer.catalog.get_by_id(product_id)
+    if product is None or not product.get("image"):
+        raise HTTPException(status_code=404, detail="Product not found or has no image")
+    added = 0
+    if refreshed:
+        snapshot = manager.current()
+        if snapshot.is_indexed(product["image"]):
+            added = sum(1 for indexed_id in snapshot.product_ids.values() if indexed_id == product_id)
+    if not added:
+        added = manager.upsert_products([product])
+    if not added:
+        raise HTTPException(status_code=502, detail="Could not download the product image")
+    return standard_response(
+        code=200,
+        message="Product indexed",
+        data={"added": added, **manager.status()}
+    )
+
+
+@router.delete("/products/{product_id}", dependencies=[Depends(require_admin_token)])
+def remove_product(product_id: str):
+    """
+    Purpose: Remove every vector of a product from the live index.
+    Input: Path parameter product_id (str)
+    Output: JSON with the number of vectors removed and the new index status.
+    """
+    manager = Initializer.get_instance().index_manager
+    removed = manager.remove_products([product_id])
+    return standard_response(
+        code=200,
+        message="Product removed from index" if removed else "Product was not indexed",
+        data={"removed": removed, **manager.status()}
+    )
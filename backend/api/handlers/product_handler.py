@@ -1,6 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Literal, Optional
 from controllers.products import product_controller
 from schemas.product_schema import ProductMetadata, StandardResponseWithMetadata, StandardResponseWithMetadataList
+from schemas.product_schema import StandardResponseWithSearchHits
+from api.handlers.health_handler import require_models_ready
 from utils.response import standard_response
 from fastapi import File, UploadFile, status
 import shutil
@@ -58,3 +61,40 @@ def get_all_products(page: int = 1):
         message="Successfully retrieved products",
         data=products
     )
+
+
+@router.get(
+    "/search",
+    response_model=StandardResponseWithSearchHits,
+    status_code=200,
+    dependencies=[Depends(require_models_ready)]
+)
+def search_products(
+    q: str = Query("", description="Free-text query"),
+    k: int = Query(10, ge=1, le=100, description="Number of results"),
+    category: Optional[str] = None,
+    brand: Optional[str] = None,
+    gender: Optional[str] = None,
+    mode: Literal["lexical", "hybrid"] = "lexical"
+):
+    """
+    Purpose: Search the product catalog in memory (no database round trip).
+    "lexical" ranks by BM25 over name, brand, category, description, material and gender;
+    "hybrid" fuses that with CLIP text-to-image similarity over the product images (lexical only
+    when the deployed model has no CLIP text tower).
+    Input: Query parameters q, k, optional exact-match filters category/brand/gender, mode
+    Output: JSON with the matching products, best first, each with its score.
+    Example Response:
+        {
+            "code": 200,
+            "message": "Successfully searched products",
+            "data": [ { ...product metadata..., "score": 7.41 } ]
+        }
+    """
+    filters = {"category": category, "brand": brand, "gender": gender}
+    hits = product_controller.search_products(q, k, filters, mode)
+    return standard_response(
+        code=200,
+        message="Successfully searched products",
+        data=hits
+    )
@@ -0,0 +1,304 @@
+"""
+Internal pipeline for the visual fashion advisor: detection -> retrieval -> response generation.
+
+The uploaded image is decoded once into an AdvisorContext; every stage reads and extends that
+context (PIL image, detections, retrieval groups with their product rows) instead of re-decoding
+base64 and re-validating Pydantic models between stages. The /ai handlers are thin wrappers.
+Decoded images, detections and crop embeddings live in the image-handle cache keyed by content
+hash, so clients can upload once (/ai/images) and refer to the image by id afterwards.
+"""
+from dataclasses import dataclass, field
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+import binascii
+import hashlib
+import os
+from fastapi import HTTPException, UploadFile
+from setup import Initializer
+from services.llm_gateway import get_llm_gateway
+from services import detection_service, retrieval_service
+from services.image_store import ImageArtifacts, decode_base64
+from utils.utils import translate_url
+from assets.prompt_template_setup import system_instruction_outfit_advisor, system_instruction_basic_qna
+from schemas.product_schema import ProductMetadata
+from services.prompt_builder import PromptBuilder, product_summary, ADVISOR_PRODUCT_FIELDS, TEXT_ONLY_PRODUCT_FIELDS
+
+# Category priority when picking the items shown to the advisor model
+ADVISOR_PRIORITY_ORDER = ["top", "bottom", "shoes", "hat", "outer", "dress", "bag"]
+# Prompt budgets (estimated tokens): the user's query, and product text in the text-only candidate list
+QUERY_TOKEN_BUDGET = 200
+TEXT_ONLY_FIELD_BUDGETS = {"description": 60}
+
+
+@dataclass
+class AdvisorContext:
+    artifacts: ImageArtifacts               # decoded image + cached detections/crop embeddings
+    detections: Optional[Dict] = None       # {"scores", "labels", "bboxes"}
+    groups: List[Dict] = field(default_factory=list)  # per-object retrieval groups (with "products")
+
+    @property
+    def image(self) -> Image.Image:
+        return self.artifacts.image
+
+    @property
+    def image_id(self) -> str:
+        return self.artifacts.image_id
+
+
+def store_image(image_base64: str) -> ImageArtifacts:
+    """Decode and cache an uploaded image (a no-op for bytes already in the cache)."""
+    try:
+        data = decode_base64(image_base64)
+        return Initializer.get_instance().image_cache.add(data)
+    except (binascii.Error, ValueError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+def store_upload(file: UploadFile) -> ImageArtifacts:
+    """
+    Cache a multipart upload. The body is read from the spooled upload in chunks (hashing as it
+    goes, enforcing the size cap) and JPEGs are draft-decoded near the model input size.
+    """
+    initializer = Initializer.get_instance()
+    digest, chunks, size = hashlib.sha256(), [], 0
+    file.file.seek(0)
+    while True:
+        chunk = file.file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > initializer.image_upload_max_bytes:
+            raise HTTPException(status_code=413, detail="Image upload too large")
+        digest.update(chunk)
+        chunks.append(chunk)
+    if not size:
+        raise HTTPException(status_code=400, detail="Empty image upload")
+    try:
+        return initializer.image_cache.add(
+            b"".join(chunks), min_side=initializer.image_decode_min_side, digest=digest.hexdigest())
+    except (ValueError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+
+
+def create_context(image_base64: Optional[str] = None, image_id: Optional[str] = None,
+                   file: Optional[UploadFile] = None) -> AdvisorContext:
+    """Pipeline context from an inline base64 image, a multipart upload or a previously uploaded image id."""
+    if file is not None:
+        artifacts = store_upload(file)
+    elif image_id:
+        artifacts = Initializer.get_instance().image_cache.get(image_id)
+        if artifacts is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired image_id, upload the image again")
+    elif image_base64:
+        artifacts = store_image(image_base64)
+    else:
+        raise HTTPException(status_code=422, detail="Provide either image_base64 or image_id")
+    return AdvisorContext(artifacts=artifacts)
+
+
+def detect(context: AdvisorContext) -> Dict:
+    """
+    Object detection (batched with concurrent requests), computed once per image.
+    Boxes are in the coordinates of the decoded image, which may be a reduced decode.
+    """
+    if context.artifacts.detections is None:
+        context.artifacts.detections = detection_service.detect_objects(context.image)
+    context.detections = context.artifacts.detections
+    return context.detections
+
+
+def _scale_boxes(bboxes: List[List[float]], scale_x: float, scale_y: float) -> List[List[float]]:
+    return [[x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y] for x0, y0, x1, y1 in bboxes]
+
+
+def _decode_scale(context: AdvisorContext) -> Tuple[float, float]:
+    """Original size / decoded size per axis (1.0 unless the image was draft-decoded)."""
+    width, height = context.image.size
+    original_width, original_height = context.artifacts.original_size
+    return original_width / width, original_height / height
+
+
+def detect_original(context: AdvisorContext) -> Dict:
+    """detect(), with the boxes mapped to the original image's pixel coordinates (what API clients see)."""
+    detections = detect(context)
+    scale_x, scale_y = _decode_scale(context)
+    return {**detections, "bboxes": _scale_boxes(detections["bboxes"], scale_x, scale_y)}
+
+
+def retrieve(context: AdvisorContext, k: int, detections: Optional[Dict] = None) -> List[Dict]:
+    """
+    Top-k catalog matches for every detected object, reusing the image's cached crop embeddings.
+    Client-supplied `detections` are in original image coordinates (as returned by detect_original).
+    """
+    if detections:
+        scale_x, scale_y = _decode_scale(context)
+        detections = {**detections, "bboxes": _scale_boxes(detections["bboxes"], 1 / scale_x, 1 / scale_y)}
+    detections = detections or context.detections or detect(context)
+    context.groups = retrieval_service.retrieve_similar_items(
+        context.artifacts.tensor, detections["bboxes"], detections["labels"], k,
+        embedding_cache=context.artifacts.crop_embeddings)
+    return context.groups
+
+
+def flatten_groups(groups: List[Dict]) -> Dict:
+    """The /ai/image-retrieval response: flat lists in detection order plus the per-object groups."""
+    retrieved_image_paths, detected_labels, scores, products = [], [], [], []
+    for group in groups:
+        retrieved_image_paths += group["retrieved_image_paths"]
+        detected_labels += [group["label"]] * len(group["retrieved_image_paths"])
+        scores += group["similarity_scores"]
+        products += group["products"]
+    return {
+        "retrieved_image_paths": retrieved_image_paths,
+        "detected_labels": detected_labels,
+        "similarity_scores": scores,
+        "products": products,
+        "objects": [{key: value for key, value in group.items() if key != "products"} for group in groups]
+    }
+
+
+def select_items(paths: List[str], labels: List[str], scores: List[float],
+                 products: List[Optional[Dict]], max_items: int) -> List[Tuple[str, str, float, Optional[Dict]]]:
+    """Best-scoring match per label, in category priority order, at most `max_items`."""
+    best_by_label = defaultdict(lambda: (None, -1))  # label -> (item, score)
+    for item in zip(paths, labels, scores, products):
+        if item[2] > best_by_label[item[1]][1]:
+            best_by_label[item[1]] = (item, item[2])
+
+    selected = []
+    for label in ADVISOR_PRIORITY_ORDER:
+        if label in best_by_label:
+            selected.append(best_by_label[label][0])
+        if len(selected) == max_items:
+            break
+    return selected
+
+
+def build_advisor_messages(user_query: str, image_url: str, selected: List[Tuple],
+                           user_profile_message: Optional[Dict] = None) -> Tuple[List[Dict], List[Dict]]:
+    """Prompt messages for the outfit advisor, and the product rows of the selected items."""
+    initializer = Initializer.get_instance()
+    prompt = PromptBuilder(system_instruction_outfit_advisor)
+    prompt.text(f"USER's QUERY: {user_query}", max_tokens=QUERY_TOKEN_BUDGET)
+    prompt.part(user_profile_message)
+    prompt.text("This is the user photo in his/her style wearing an outfit.")
+    prompt.image(image_url)
+
+    products = []
+    for i, (path, _, _, product) in enumerate(selected, start=1):
+        # Retrieval already resolved the product; only look it up for externally supplied results.
+        # Index paths are either raw bucket listings or already in the products table's form
+        product = product or initializer.catalog.get_by_vector_path(path)
+        if product is None:
+            raise ValueError(f"No product found for image path: {path}")
+        products.append(product)
+        # The table's image URL is translated exactly once (and is the thumbnail cache key)
+        path = product.get("image") or translate_url(path)
+
+        # Only the fields the advisor needs, with descriptions and reviews cut to their budgets
+        prompt.text(f"{i}. Extra Info on this image reference:\n{product_summary(product, ADVISOR_PRODUCT_FIELDS)}\n")
+
+        # Add public URL
+        if path.startswith(("http://", "https://")):
+            product_image_url = path
+        else:
+            supabase_url = initializer.database.url if hasattr(initializer.database, 'url') else os.getenv("SUPABASE_URL")
+            product_image_url = f"{supabase_url}/storage/v1/object/public/{initializer.bucket_images}/{path}"
+        # Compressed thumbnail from the disk cache when available
+        prompt.image(initializer.prompt_images.catalog_image_url(product_image_url))
+
+    print(f"[AIController] Advisor prompt: ~{prompt.estimated_tokens} tokens, {len(products)} products")
+    return prompt.messages(), products
+
+
+def prompt_image_url(image_base64: Optional[str] = None, image_id: Optional[str] = None) -> str:
+    """The user's photo as sent to the advisor model: downscaled and re-encoded (once per image)."""
+    context = create_context(image_base64, image_id)
+    return Initializer.get_instance().prompt_images.query_image_url(context.artifacts)
+
+
+def prepare_advice(image_url: str, user_query: str, paths: List[str], labels: List[str], scores: List[float],
+                   products: List[Optional[Dict]], k: int,
+                   user_profile_message: Optional[Dict] = None) -> Tuple[List[Dict], List[Dict]]:
+    """Pick the items to show and build the advisor prompt. Returns (messages, products to return)."""
+    initializer = Initializer.get_instance()
+    selected = select_items(paths, labels, scores, products, initializer.max_selected_items_mllm)
+    if not selected:
+        raise HTTPException(status_code=404, detail="No matching items found")
+    messages, selected_products = build_advisor_messages(user_query, image_url, selected, user_profile_message)
+    return messages, selected_products[:k]
+
+
+def generate_advice(image_url: str, user_query: str, paths: List[str], labels: List[str], scores: List[float],
+                    products: List[Optional[Dict]], k: int, user_profile_message: Optional[Dict] = None) -> Dict:
+    """Pick the items to show, prompt the advisor model and return {"response", "products"}."""
+    messages, selected_products = prepare_advice(image_url, user_query, paths, labels, scores, products, k,
+                                                 user_profile_message)
+    return {
+        "response": get_llm_gateway().complete(messages, "advice", task="response_generation"),
+        "products": selected_products
+    }
+
+
+def prepare_visual_advice(image_base64: Optional[str], user_query: str, k: int,
+                          user_profile_message: Optional[Dict] = None, image_id: Optional[str] = None,
+                          file: Optional[UploadFile] = None) -> Tuple[List[Dict], List[Dict], Dict, str]:
+    """
+    Detection, retrieval and prompt building on one decoded image.
+    Returns (advisor messages, products to return, flattened retrieval result, image id).
+    """
+    context = create_context(image_base64, image_id, file)
+    detect(context)
+    retrieval = flatten_groups(retrieve(context, k))
+    messages, products = prepare_advice(
+        Initializer.get_instance().prompt_images.query_image_url(context.artifacts), user_query,
+        retrieval["retrieved_image_paths"], retrieval["detected_labels"],
+        retrieval["similarity_scores"], retrieval["products"], k, user_profile_message
+    )
+    return messages, products, retrieval, context.image_id
+
+
+def run_visual_advisor(image_base64: Optional[str], user_query: str, k: int,
+                       user_profile_message: Optional[Dict] = None, image_id: Optional[str] = None,
+                       file: Optional[UploadFile] = None) -> Tuple[Dict, Dict, str]:
+    """
+    Full pipeline on one decoded image. Returns (advisor response, flattened retrieval result, image id).
+    """
+    messages, products, retrieval, image_id = prepare_visual_advice(
+        image_base64, user_query, k, user_profile_message, image_id, file)
+    response = get_llm_gateway().complete(messages, "advice", task="fashion_advisor_visual")
+    advice = {"response": response, "products": products}
+    return advice, retrieval, image_id
+
+
+def prepare_text_advice(user_query: str, k: int,
+                        user_profile_message: Optional[Dict] = None) -> Tuple[List[Dict], List[Dict]]:
+    """Candidate products and the prompt for the text-only advisor. Returns (messages, products)."""
+    products = [ProductMetadata(**item).dict() for item in select_products_for_query(user_query, k)]
+    prompt = PromptBuilder(system_instruction_basic_qna)
+    prompt.text(f"USER's QUERY: {user_query}", max_tokens=QUERY_TOKEN_BUDGET)
+    prompt.part(user_profile_message)
+    prompt.text("Here are some available products in our store:")
+    prompt.text("\n".join(
+        f"{i+1}. " + product_summary(p, TEXT_ONLY_PRODUCT_FIELDS, TEXT_ONLY_FIELD_BUDGETS).replace("\n", " | ")
+        for i, p in enumerate(products)
+    ))
+    return prompt.messages(), products
+
+
+def select_products_for_query(user_query: str, k: int) -> List[Dict]:
+    """
+    Top-k products for a text-only query: BM25 over the catalog fused with a CLIP
+    text-to-image search over the vector index. Lexical only when no CLIP text tower is
+    available (an ONNX export made without it).
+    """
+    try:
+        matches = retrieval_service.search_products(user_query, k, mode="hybrid")
+    except RuntimeError as e:
+        print(f"[Advisor] Text retrieval unavailable ({e}), using lexical search only")
+        matches = retrieval_service.search_products(user_query, k, mode="lexical")
+    return [product for product, _ in matches]
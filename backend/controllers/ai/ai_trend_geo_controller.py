@@ -1,12 +1,17 @@
 from services import trend_search_service, geo_service
+from services.llm_gateway import get_llm_gateway
 from typing import List, Dict
 from models.trend import WebSearchResponse, WebSearchResult
+from utils.utils import reverse_geocode
+from assets.prompt_template_setup import system_instruction_simplify_prompt, system_instruction_product_desc
+import asyncio
 import json
 from uagents.communication import send_sync_message
 from uagents_core.envelope import Envelope
 import os
 
 STORE_EXTRACTOR_AGENT_ADDRESS = os.getenv("STORE_EXTRACTOR_AGENT_ADDRESS", "test-agent://agent1qfdpqgj0q8qa6m7hzjzdhguu93gvwdpgg50vuskgmz2wu8p8p4ujww6zvpd")
+DEFAULT_USER_LOCATION = "San Francisco, CA"
 
 async def get_trendy_store_locations(product_metadata: dict, user_style_description: str, user_location: str) -> List[Dict]:
     """
@@ -16,10 +21,18 @@ async def get_trendy_store_locations(product_metadata: dict, user_style_descript
     stores = await trend_search_service.find_nearby_stores_with_metadata(
         product_metadata, user_style_description, user_location
     )
+    # 2-3. Extract the final store list and locate every store
+    return await extract_store_locations(stores)
+
+
+async def extract_store_locations(stores) -> List[Dict]:
+    """
+    Store search results -> [{"name", "address", "latitude", "longitude"}] via the store extractor agent,
+    with all stores geocoded concurrently.
+    """
     if isinstance(stores, str):
         stores = json.loads(stores)
 
-
     # 2. Use the store extractor agent to get the final list of stores and location
     from models.trend import StoreExtractionRequest, StoreExtractionResponse  # define these if not present
     req = StoreExtractionRequest(results=stores.get('results', []))
@@ -39,12 +52,14 @@ async def get_trendy_store_locations(product_metadata: dict, user_style_descript
     print('extracted_stores', extracted_stores)
     print('extracted_location', extracted_location)
 
-    # 3. Build output list using extracted stores and location
+    # 3. Build output list using extracted stores and location (lookups are independent, so they run together)
+    latlons = [None] * len(extracted_stores)
+    if extracted_location:
+        latlons = await asyncio.gather(*[
+            geo_service.get_lat_lon_async(f"{name}, {extracted_location}") for name in extracted_stores
+        ])
     results = []
-    for name in extracted_stores:
-        latlon = None
-        if extracted_location:
-            latlon = await geo_service.get_lat_lon_async(f"{name}, {extracted_location}")
+    for name, latlon in zip(extracted_stores, latlons):
         # Validate latlon
         if (
             isinstance(latlon, (tuple, list)) and len(latlon) == 2 and
@@ -60,4 +75,51 @@ async def get_trendy_store_locations(product_metadata: dict, user_style_descript
             "longitude": longitude
         })
     print("results", results)
-    return results 
\ No newline at end of file
+    return results
+
+
+def _query_messages(system_instruction: str, user_query: str) -> List[Dict]:
+    # Plain string content: the text-only models behind the "rewrite" route reject content parts
+    return [
+        {"role": "system", "content": system_instruction},
+        {"role": "user", "content": f"User Query: {user_query}"}
+    ]
+
+
+async def run_online_search_agent(user_query: str, user_location: str = DEFAULT_USER_LOCATION) -> List[Dict]:
+    """
+    Online search agent as a dependency graph; every step starts as soon as its inputs are ready:
+
+        simplify(query) ------------------------------+
+        describe(query) -> current trends(description) +-> store search -> store extraction -> geocoding
+        reverse geocode(location) --------------------+
+
+    The two LLM calls (both served from the response cache for repeated queries) and the blocking
+    HTTP calls run concurrently, so latency is roughly the longest branch rather than the sum.
+    """
+    gateway = get_llm_gateway()
+
+    async def current_trends(description_task):
+        description = await description_task
+        print(description)
+        return await asyncio.to_thread(trend_search_service.get_current_trends, description or "fashion")
+
+    simplified = asyncio.create_task(gateway.acomplete(
+        _query_messages(system_instruction_simplify_prompt, user_query), "rewrite",
+        cache=True, semantic_text=user_query, task="online_agent_simplify"))
+    description = asyncio.create_task(gateway.acomplete(
+        _query_messages(system_instruction_product_desc, user_query), "rewrite",
+        cache=True, semantic_text=user_query, task="online_agent_description"))
+    trends = asyncio.create_task(current_trends(description))
+    place = asyncio.create_task(asyncio.to_thread(reverse_geocode, user_location))
+    tasks = [simplified, description, trends, place]
+    try:
+        simplified_query, trend_analysis, place_name = await asyncio.gather(simplified, trends, place)
+        print(simplified_query)
+        stores = await trend_search_service.search_similar_products(
+            trend_analysis, user_location, simplified_query, place_name)
+        return await extract_store_locations(stores)
+    finally:
+        # On failure or client disconnect, stop the branches that are still running
+        for task in tasks:
+            task.cancel()
@@ -1,8 +1,21 @@
-from services import product_service
-from schemas.product_schema import ProductMetadata
+from typing import Dict, Optional
+from services import product_service, retrieval_service
+from schemas.product_schema import ProductMetadata, ProductSearchHit
 
 def retrieve_product_metadata(product_id: str) -> ProductMetadata:
     return product_service.get_product_metadata_from_supabase(product_id)
 
 def retrieve_all_products(page: int = 1, page_size: int = 6) -> list[ProductMetadata]:
-    return product_service.get_all_products_from_supabase(page, page_size)
\ No newline at end of file
+    return product_service.get_all_products_from_supabase(page, page_size)
+
+def search_products(query: str, k: int = 10, filters: Optional[Dict[str, str]] = None,
+                    mode: str = "lexical") -> list[ProductSearchHit]:
+    try:
+        matches = retrieval_service.search_products(query, k, filters, mode)
+    except RuntimeError as e:
+        if mode == "lexical":
+            raise
+        # No CLIP text tower (ONNX export made without it): hybrid degrades to lexical
+        print(f"[ProductSearch] Text retrieval unavailable ({e}), using lexical search only")
+        matches = retrieval_service.search_products(query, k, filters, "lexical")
+    return [ProductSearchHit(**product, score=score) for product, score in matches]
@@ -1,31 +1,12 @@
 import io
 import base64
 from PIL import Image
-from groq import Groq
-import os
-from dotenv import load_dotenv
+from services.llm_gateway import get_llm_gateway
 
-load_dotenv()
-
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-
-def groq_llama_completion(messages, token=1024):
-    completion = Groq(api_key=GROQ_API_KEY).chat.completions.create(
-        model="meta-llama/llama-4-scout-17b-16e-instruct",
-        messages=messages,
-        temperature=1,
-        max_completion_tokens=1024,
-        top_p=1,
-        stream=True,
-        stop=None,
-    )
-    # Stream the output
-    inference_result = ""
-    for chunk in completion:
-        chunk_inference = chunk.choices[0].delta.content or ""
-        inference_result += chunk_inference
-        print(chunk_inference, end="")
-    return inference_result
+def groq_llama_completion(messages, token=None, cache=False, task_class="advice"):
+    # Kept for existing imports; goes through the shared pooled client (services/llm_gateway.py),
+    # routed by task class (token=None uses the route's max tokens)
+    return get_llm_gateway().complete(messages, task_class, max_tokens=token, cache=cache)
 
 
 def compress_and_encode_image(image_path, max_size=(512, 512), quality=70):
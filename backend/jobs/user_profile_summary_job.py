@@ -1,5 +1,5 @@
 from db.supabase_client import supabase
-from function import groq_llama_completion
+from services.llm_gateway import get_llm_gateway
 from datetime import datetime
 import pytz
 
@@ -13,7 +13,7 @@ def summarize_user_sessions(sessions):
         {"role": "system", "content": "You are an assistant that summarizes a user's fashion interests and style based on their queries and recommendations."},
         {"role": "user", "content": f"Here are this user's recent sessions:\n{joined}\n\nSummarize what kind of person this user is, their style, and preferences in 2-3 sentences."}
     ]
-    return groq_llama_completion(messages, token=256)
+    return get_llm_gateway().complete(messages, "summary", task="user_profile_summary")
 
 def update_user_profiles():
     print("[UserProfileJob] Running user profile update job...")
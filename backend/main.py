@@ -4,8 +4,9 @@ from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from postgrest.exceptions import APIError
 from dotenv import load_dotenv
-from api.handlers import product_handler, ai_handler, user_handler, voice_handler as voi, ai_trend_geo_handler, auth_handler
+from api.handlers import product_handler, ai_handler, user_handler, voice_handler as voi, ai_trend_geo_handler, auth_handler, index_handler, health_handler
 from utils.response import standard_response
+from setup import Initializer
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
@@ -36,6 +37,17 @@ app.include_router(ai_handler.router)
 app.include_router(voi.router)
 app.include_router(ai_trend_geo_handler.router)
 app.include_router(auth_handler.router)
+app.include_router(index_handler.router)
+app.include_router(health_handler.router)
+
+# -------------------------------
+# Startup: load models in the background
+# -------------------------------
+
+@app.on_event("startup")
+def start_model_loading():
+    # Non-AI routes serve immediately; /health/ready reports when the AI routes can
+    Initializer.start_loading()
 
 # -------------------------------
 # 🌟 Global Exception Handlers
@@ -50,6 +62,7 @@ async def http_exception_handler(request: Request, exc: StarletteHTTPException):
             message=exc.detail,
             data=None
         ),
+        headers=getattr(exc, "headers", None),
     )
 
 @app.exception_handler(RequestValidationError)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 
 class DetectionItem(BaseModel):
@@ -9,5 +9,9 @@ class DetectionItem(BaseModel):
 
 
 class DetectionInput(BaseModel):
-    image_base64: str
-    items: DetectionItem
+    # Either the image itself or the id returned by POST /ai/images
+    image_base64: Optional[str] = None
+    image_id: Optional[str] = None
+    # Omitted items reuse the detections cached for the image
+    items: Optional[DetectionItem] = None
+
@@ -1,4 +1,7 @@
 from pydantic import BaseModel
+from typing import Optional
 
 class ImagePayload(BaseModel):
-    image_base64: str
\ No newline at end of file
+    # Either the image itself or the id returned by POST /ai/images
+    image_base64: Optional[str] = None
+    image_id: Optional[str] = None
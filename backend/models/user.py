@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
+from typing import Optional
 
 class User(BaseModel):
     id: str
@@ -17,7 +18,9 @@ class UserImage(BaseModel):
     uploaded_at: datetime
 
 class FashionAdvisorInput(BaseModel):
-    image_base64: str
+    # Either the image itself or the id returned by POST /ai/images
+    image_base64: Optional[str] = None
+    image_id: Optional[str] = None
     user_query: str
 
 class UserQuery(BaseModel):
@@ -28,3 +28,12 @@ class StandardResponseWithMetadataList(BaseModel):
     code: int
     message: str
     data: List[ProductMetadata]
+
+
+class ProductSearchHit(ProductMetadata):
+    score: float
+
+class StandardResponseWithSearchHits(BaseModel):
+    code: int
+    message: str
+    data: List[ProductSearchHit]
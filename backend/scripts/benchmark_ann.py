@@ -0,0 +1,115 @@
+"""
+Recall/latency benchmark for the FAISS index types in services.index_factory.
+
+Synthetic catalogs are grown from the real product embeddings in assets/image_database/image.faiss:
+each synthetic vector is a noisy copy of a perturbed catalog vector, so the data keeps the clustered
+structure of CLIP embeddings. Recall@k is measured against exact (flat) inner-product search.
+
+Run from the backend directory:
+    python -m scripts.benchmark_ann [--scales 10000,100000,1000000] [--index-types flat,ivf_flat,hnsw,...]
+"""
+from services.index_factory import INDEX_TYPES, build_index, configure_search, index_factory_string
+import numpy as np
+import argparse
+import faiss
+import json
+import time
+
+DEFAULT_SEED_INDEX = "assets/image_database/image.faiss"
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def synthetic_vectors(seed_vectors: np.ndarray, n: int, rng, chunk: int = 100_000,
+                      n_clusters: int = None, center_noise: float = 0.6, point_noise: float = 0.35) -> np.ndarray:
+    dim = seed_vectors.shape[1]
+    n_clusters = n_clusters or max(len(seed_vectors), n // 200)
+    # Cluster centres: perturbed copies of real catalog embeddings
+    centers = seed_vectors[rng.integers(0, len(seed_vectors), n_clusters)]
+    centers = normalize(centers + center_noise * rng.standard_normal((n_clusters, dim), dtype="float32") / np.sqrt(dim))
+    out = np.empty((n, dim), dtype="float32")
+    for start in range(0, n, chunk):
+        stop = min(n, start + chunk)
+        assignment = rng.integers(0, n_clusters, stop - start)
+        noise = point_noise * rng.standard_normal((stop - start, dim), dtype="float32") / np.sqrt(dim)
+        out[start:stop] = normalize(centers[assignment] + noise)
+    return out
+
+
+def recall_at_k(approx: np.ndarray, exact: np.ndarray) -> float:
+    k = exact.shape[1]
+    hits = sum(len(set(a[a >= 0]) & set(e)) for a, e in zip(approx, exact))
+    return hits / (exact.shape[0] * k)
+
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    seed_index = faiss.read_index(args.seed_index)
+    seed_vectors = seed_index.reconstruct_n(0, seed_index.ntotal)
+    index_types = args.index_types.split(",")
+    results = []
+
+    header = f"{'n':>9} {'index':<10} {'factory':<18} {'build s':>8} {'MB':>8} {'QPS':>9} {f'recall@{args.k}':>9}"
+    print(header)
+    print("-" * len(header))
+    for scale in [int(s) for s in args.scales.split(",")]:
+        database = synthetic_vectors(seed_vectors, scale, rng)
+        # Queries: real catalog vectors plus fresh samples from the same distribution
+        queries = normalize(np.vstack([
+            seed_vectors,
+            synthetic_vectors(seed_vectors, max(0, args.queries - len(seed_vectors)), rng)
+        ]))[:args.queries]
+
+        exact_index = faiss.IndexFlatIP(database.shape[1])
+        exact_index.add(database)
+        _, exact_ids = exact_index.search(queries, args.k)
+        del exact_index
+
+        for index_type in index_types:
+            start = time.perf_counter()
+            index = build_index(database, index_type)
+            build_seconds = time.perf_counter() - start
+            configure_search(index, nprobe=args.nprobe, ef_search=args.ef_search)
+            size_mb = faiss.serialize_index(index).nbytes / 1024 ** 2
+
+            index.search(queries[:10], args.k)  # warmup
+            start = time.perf_counter()
+            _, ids = index.search(queries, args.k)
+            qps = len(queries) / (time.perf_counter() - start)
+            recall = recall_at_k(ids, exact_ids)
+
+            factory = index_factory_string(index_type, scale, database.shape[1])
+            print(f"{scale:>9} {index_type:<10} {factory:<18} {build_seconds:>8.2f} {size_mb:>8.1f} {qps:>9.0f} {recall:>9.4f}")
+            results.append({
+                "n": scale, "index_type": index_type, "factory": factory,
+                "build_seconds": build_seconds, "memory_mb": size_mb, "qps": qps, f"recall@{args.k}": recall
+            })
+            del index
+        del database
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISS index type recall/latency benchmark")
+    parser.add_argument("--seed-index", default=DEFAULT_SEED_INDEX, help="Index holding the real catalog embeddings")
+    parser.add_argument("--scales", default="10000,100000,1000000")
+    parser.add_argument("--index-types", default=",".join(INDEX_TYPES))
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional JSON file for the results")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
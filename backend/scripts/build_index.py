@@ -0,0 +1,259 @@
+"""
+Offline catalog embedding and FAISS index builder.
+
+Streams product records (from Supabase or assets/image_database/database.json), embeds their images
+in batches on a process pool, checkpoints embeddings into a reusable .npy memmap, then atomically
+writes image.faiss plus image.manifest.<index hash>.json (vector id -> product). Re-running only embeds products
+that are new or whose image changed; --reindex-only rebuilds the index from the stored embeddings.
+
+Run from the backend directory:
+    python -m scripts.build_index --source supabase --index-type flat --workers 4 [--upload]
+    python -m scripts.build_index --source json --reindex-only --index-type hnsw
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from transformers import CLIPConfig, CLIPModel, CLIPProcessor
+from typing import Iterator, List
+from io import BytesIO
+from PIL import Image
+import multiprocessing
+import numpy as np
+import argparse
+import requests
+import hashlib
+import faiss
+import torch
+import json
+import time
+import os
+from services.inference_backend import create_inference_backend, run_image_embedding, CLIP_CHECKPOINT
+from services.index_factory import build_index, INDEX_TYPES
+from utils.artifact_cache import file_sha256
+from services.index_manifest import write_manifest, manifest_file, INDEX_FILE
+
+DEFAULT_JSON_SOURCE = "assets/image_database/database.json"
+SUPABASE_PAGE_SIZE = 1000
+
+_worker = {}
+
+
+# -------------------------------
+# Product record sources
+# -------------------------------
+
+def stream_json_records(path: str) -> Iterator[dict]:
+    with open(path) as f:
+        concept_dict = json.load(f)["concept_dict"]
+    for product_id, product in concept_dict.items():
+        yield {"product_id": product_id, "image": product["image"], "product": product}
+
+
+def stream_supabase_records() -> Iterator[dict]:
+    from db.supabase_client import supabase
+
+    offset = 0
+    while True:
+        page = (
+            supabase.table("products").select("*").order("id")
+            .range(offset, offset + SUPABASE_PAGE_SIZE - 1).execute().data or []
+        )
+        for product in page:
+            if product.get("image"):
+                yield {"product_id": product["id"], "image": product["image"], "product": product}
+        if len(page) < SUPABASE_PAGE_SIZE:
+            return
+        offset += SUPABASE_PAGE_SIZE
+
+
+# -------------------------------
+# Embedding workers
+# -------------------------------
+
+def _init_worker(backend_name: str, model_dir: str, quantized: bool, num_threads: int):
+    torch.set_num_threads(num_threads)
+    clip_model = CLIPModel.from_pretrained(CLIP_CHECKPOINT).eval() if backend_name == "torch" else None
+    _worker["processor"] = CLIPProcessor.from_pretrained(CLIP_CHECKPOINT)
+    _worker["backend"] = create_inference_backend(
+        backend_name, clip_model=clip_model, device="cpu",
+        model_dir=model_dir, quantized=quantized, num_threads=num_threads
+    )
+
+
+def _load_image(image_ref: str) -> Image.Image:
+    if image_ref.startswith(("http://", "https://")):
+        response = requests.get(image_ref, timeout=30)
+        response.raise_for_status()
+        return Image.open(BytesIO(response.content)).convert("RGB")
+    return Image.open(image_ref).convert("RGB")
+
+
+def _embed_batch(batch: List[tuple]):
+    rows, images, failed = [], [], []
+    for row, image_ref in batch:
+        try:
+            images.append(_load_image(image_ref))
+            rows.append(row)
+        except Exception as e:
+            failed.append((row, f"{image_ref}: {e}"))
+    features = run_image_embedding(_worker["backend"], _worker["processor"], images) if images else None
+    return rows, features, failed
+
+
+# -------------------------------
+# Checkpointed embedding store
+# -------------------------------
+
+def _record_key(record: dict) -> str:
+    return f"{record['product_id']}|{record['image']}"
+
+
+def _write_state(path: str, state: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def open_embedding_store(work_dir: str, keys: List[str], dim: int, model: str):
+    """
+    Open (or create) the embedding memmap for `keys`, carrying over every embedding already
+    computed for an unchanged key. Returns (embeddings memmap, done mask).
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    embeddings_path = os.path.join(work_dir, "embeddings.npy")
+    state_path = os.path.join(work_dir, "state.json")
+    state = None
+    if os.path.exists(state_path) and os.path.exists(embeddings_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        if state.get("model") != model or state.get("dim") != dim:
+            print("[Builder] Embedding model changed, re-embedding everything")
+            state = None
+
+    if state is not None and state["keys"] == keys:
+        return np.load(embeddings_path, mmap_mode="r+"), np.array(state["done"], dtype=bool)
+
+    next_path = os.path.join(work_dir, "embeddings.next.npy")
+    embeddings = np.lib.format.open_memmap(next_path, mode="w+", dtype="float32", shape=(len(keys), dim))
+    done = np.zeros(len(keys), dtype=bool)
+    if state is not None:
+        old_embeddings = np.load(embeddings_path, mmap_mode="r")
+        old_rows = {key: row for row, (key, old_done) in enumerate(zip(state["keys"], state["done"])) if old_done}
+        for row, key in enumerate(keys):
+            old_row = old_rows.get(key)
+            if old_row is not None:
+                embeddings[row] = old_embeddings[old_row]
+                done[row] = True
+        del old_embeddings
+        print(f"[Builder] Reusing {int(done.sum())}/{len(keys)} stored embeddings")
+    embeddings.flush()
+    os.replace(next_path, embeddings_path)
+    _write_state(state_path, {"model": model, "dim": dim, "keys": keys, "done": done.tolist()})
+    return np.load(embeddings_path, mmap_mode="r+"), done
+
+
+def embed_pending(records: List[dict], embeddings, done, args, model: str, dim: int):
+    state_path = os.path.join(args.work_dir, "state.json")
+    keys = [_record_key(r) for r in records]
+    pending = [(row, records[row]["image"]) for row in np.flatnonzero(~done).tolist()]
+    if not pending:
+        print("[Builder] All embeddings up to date")
+        return
+    batches = [pending[i:i + args.batch_size] for i in range(0, len(pending), args.batch_size)]
+    print(f"[Builder] Embedding {len(pending)} images in {len(batches)} batches on {args.workers} workers")
+
+    start = time.perf_counter()
+    completed, embedded = 0, 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.backend, args.model_dir, args.quantized, args.threads_per_worker)
+    ) as pool:
+        futures = [pool.submit(_embed_batch, batch) for batch in batches]
+        for future in as_completed(futures):
+            rows, features, failed = future.result()
+            if rows:
+                embeddings[rows] = features
+                done[rows] = True
+                embedded += len(rows)
+            for row, error in failed:
+                print(f"[Builder] Skipping {keys[row]}: {error}")
+            completed += 1
+            if completed % args.checkpoint_every == 0 or completed == len(batches):
+                embeddings.flush()
+                _write_state(state_path, {"model": model, "dim": dim, "keys": keys, "done": done.tolist()})
+                rate = embedded / max(1e-6, time.perf_counter() - start)
+                print(f"[Builder] Checkpoint {completed}/{len(batches)} batches ({rate:.1f} images/s)")
+
+
+def write_index(records: List[dict], embeddings, done, args, model: str, dim: int):
+    rows = np.flatnonzero(done)
+    vectors = np.ascontiguousarray(embeddings[rows], dtype="float32")
+    index = build_index(vectors, args.index_type)
+    version = hashlib.sha256(vectors.tobytes()).hexdigest()[:12]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    index_path = os.path.join(args.output_dir, INDEX_FILE)
+    tmp_index_path = f"{index_path}.{os.getpid()}.tmp"
+    faiss.write_index(index, tmp_index_path)
+    # The manifest is named after (and records) the hash of the exact index file it describes
+    index_sha256 = file_sha256(tmp_index_path)
+    manifest_path = os.path.join(args.output_dir, manifest_file(index_sha256))
+    write_manifest(
+        manifest_path,
+        [{"vector_id": i, "product_id": records[row]["product_id"], "image": records[row]["image"],
+          "product": records[row]["product"]} for i, row in enumerate(rows.tolist())],
+        index_type=args.index_type, dim=dim, model=model, version=version, index_sha256=index_sha256
+    )
+    os.replace(tmp_index_path, index_path)
+    print(f"[Builder] Wrote {index_path} ({index.ntotal} vectors, {args.index_type}) and {manifest_path}, version {version}")
+    return index_path, manifest_path
+
+
+def upload(paths: List[str], bucket: str = "faiss"):
+    """Upload in order; pass the manifest before the index so a half-finished upload is never served."""
+    from db.supabase_client import supabase
+
+    for path in paths:
+        with open(path, "rb") as f:
+            supabase.storage.from_(bucket).upload(os.path.basename(path), f.read(), {"upsert": "true"})
+        print(f"[Builder] Uploaded {os.path.basename(path)} to bucket {bucket}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the product image index")
+    parser.add_argument("--source", choices=["supabase", "json"], default="supabase")
+    parser.add_argument("--json-path", default=DEFAULT_JSON_SOURCE)
+    parser.add_argument("--work-dir", default="build/index_work", help="Embedding memmap and checkpoint state")
+    parser.add_argument("--output-dir", default="build/index")
+    parser.add_argument("--index-type", default="flat", choices=sorted(INDEX_TYPES))
+    parser.add_argument("--backend", default=os.getenv("INFERENCE_BACKEND", "torch"), choices=["torch", "onnx"])
+    parser.add_argument("--model-dir", default=os.getenv("ONNX_MODEL_DIR", "assets/onnx_models"))
+    parser.add_argument("--quantized", action="store_true", help="Use the int8 ONNX models")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--threads-per-worker", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="Batches between checkpoints")
+    parser.add_argument("--reindex-only", action="store_true", help="Skip embedding; rebuild from stored embeddings")
+    parser.add_argument("--upload", action="store_true", help="Upload the index and manifest to the Supabase faiss bucket")
+    args = parser.parse_args()
+
+    stream = stream_supabase_records() if args.source == "supabase" else stream_json_records(args.json_path)
+    records = list(stream)
+    print(f"[Builder] {len(records)} product records from {args.source}")
+
+    model = f"{CLIP_CHECKPOINT}:{args.backend}{':int8' if args.quantized else ''}"
+    dim = CLIPConfig.from_pretrained(CLIP_CHECKPOINT).projection_dim
+    embeddings, done = open_embedding_store(args.work_dir, [_record_key(r) for r in records], dim, model)
+    if not args.reindex_only:
+        embed_pending(records, embeddings, done, args, model, dim)
+    if not done.any():
+        raise SystemExit("[Builder] No embeddings available, nothing to index")
+
+    index_path, manifest_path = write_index(records, embeddings, done, args, model, dim)
+    if args.upload:
+        upload([manifest_path, index_path])
+
+
+if __name__ == "__main__":
+    main()
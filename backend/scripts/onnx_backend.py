@@ -0,0 +1,192 @@
+"""
+ONNX Runtime backend tooling for the detector and the CLIP image and text embedders.
+
+Run from the backend directory:
+    python -m scripts.onnx_backend export [--quantize]
+    python -m scripts.onnx_backend parity [--quantized]
+    python -m scripts.onnx_backend batch-parity [--backend onnx]
+    python -m scripts.onnx_backend benchmark [--backends torch,onnx,onnx-int8]
+
+Serve the exported models with INFERENCE_BACKEND=onnx (and ONNX_QUANTIZATION=int8 for the int8 copies).
+"""
+from transformers import CLIPModel, CLIPProcessor, YolosConfig, YolosForObjectDetection, YolosImageProcessor
+from PIL import Image
+import numpy as np
+import argparse
+import resource
+import time
+import os
+from services.inference_backend import (
+    TorchBackend, OnnxBackend, run_detection, run_image_embedding, export_onnx_models,
+    YOLOS_CHECKPOINT, CLIP_CHECKPOINT
+)
+
+DEFAULT_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "assets/onnx_models")
+DEFAULT_IMAGE_DIR = "assets/image_database"
+
+
+def load_sample_images(image_dir: str) -> list:
+    files = sorted(
+        f for f in os.listdir(image_dir) if f.lower().endswith((".png", ".jpg", ".jpeg"))
+    )
+    return [Image.open(os.path.join(image_dir, f)).convert("RGB") for f in files]
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except OSError:
+        # Peak RSS only (kilobytes on Linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_backend(name: str, model_dir: str):
+    if name == "torch":
+        return TorchBackend(
+            YolosForObjectDetection.from_pretrained(YOLOS_CHECKPOINT).eval(),
+            CLIPModel.from_pretrained(CLIP_CHECKPOINT).eval(),
+            "cpu"
+        )
+    return OnnxBackend(model_dir, quantized=(name == "onnx-int8"))
+
+
+def box_iou(a, b) -> float:
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def cmd_export(args):
+    paths = export_onnx_models(args.model_dir, quantize=args.quantize, opset=args.opset)
+    for key, path in paths.items():
+        print(f"[ONNX] {key}: {path} ({os.path.getsize(path) / 1024 ** 2:.1f} MB)")
+
+
+def cmd_parity(args):
+    yolo_processor = YolosImageProcessor.from_pretrained(YOLOS_CHECKPOINT)
+    clip_processor = CLIPProcessor.from_pretrained(CLIP_CHECKPOINT)
+    id2label = YolosConfig.from_pretrained(YOLOS_CHECKPOINT).id2label
+    reference = load_backend("torch", args.model_dir)
+    candidate = load_backend("onnx-int8" if args.quantized else "onnx", args.model_dir)
+    images = load_sample_images(args.image_dir)
+
+    # Embedding parity: cosine similarity between the two backends' normalised features
+    ref_features = run_image_embedding(reference, clip_processor, images)
+    cand_features = run_image_embedding(candidate, clip_processor, images)
+    cosine = (ref_features * cand_features).sum(axis=1)
+    print(f"[Parity] embedding cosine: min={cosine.min():.5f} mean={cosine.mean():.5f}")
+
+    # Detection parity: same labels, matching boxes
+    mismatches = 0
+    for i, image in enumerate(images):
+        ref = run_detection(reference, yolo_processor, id2label, [image])[0]
+        cand = run_detection(candidate, yolo_processor, id2label, [image])[0]
+        ious = [box_iou(a, b) for a, b in zip(ref["bboxes"], cand["bboxes"])]
+        if ref["labels"] != cand["labels"] or any(iou < args.min_iou for iou in ious):
+            mismatches += 1
+            print(f"[Parity] image {i}: torch={ref['labels']} onnx={cand['labels']} ious={[round(x, 3) for x in ious]}")
+    print(f"[Parity] detection mismatches: {mismatches}/{len(images)}")
+
+    passed = cosine.min() >= args.min_cosine and mismatches == 0
+    print(f"[Parity] {'PASS' if passed else 'FAIL'}")
+    if not passed:
+        raise SystemExit(1)
+
+
+def cmd_batch_parity(args):
+    """Detections of every image run in one batched call must match running it alone."""
+    yolo_processor = YolosImageProcessor.from_pretrained(YOLOS_CHECKPOINT)
+    id2label = YolosConfig.from_pretrained(YOLOS_CHECKPOINT).id2label
+    backend = load_backend(args.backend, args.model_dir)
+    images = load_sample_images(args.image_dir)
+    # Mixed sizes, plus downscaled copies so same-sized inputs actually share a forward pass
+    images += [image.resize((image.width // 2, image.height // 2)) for image in images]
+    images += [image.copy() for image in images]
+
+    batched = run_detection(backend, yolo_processor, id2label, images)
+    mismatches = 0
+    for i, (image, together) in enumerate(zip(images, batched)):
+        alone = run_detection(backend, yolo_processor, id2label, [image])[0]
+        ious = [box_iou(a, b) for a, b in zip(alone["bboxes"], together["bboxes"])]
+        score_diff = max((abs(a - b) for a, b in zip(alone["scores"], together["scores"])), default=0.0)
+        if alone["labels"] != together["labels"] or any(iou < args.min_iou for iou in ious) or score_diff > args.max_score_diff:
+            mismatches += 1
+            print(f"[BatchParity] image {i} {image.size}: alone={alone['labels']} batched={together['labels']} "
+                  f"ious={[round(x, 3) for x in ious]} max score diff={score_diff:.4f}")
+    print(f"[BatchParity] detection mismatches: {mismatches}/{len(images)}")
+    print(f"[BatchParity] {'PASS' if mismatches == 0 else 'FAIL'}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+def cmd_benchmark(args):
+    yolo_processor = YolosImageProcessor.from_pretrained(YOLOS_CHECKPOINT)
+    clip_processor = CLIPProcessor.from_pretrained(CLIP_CHECKPOINT)
+    id2label = YolosConfig.from_pretrained(YOLOS_CHECKPOINT).id2label
+    images = load_sample_images(args.image_dir)
+    crops = images[:args.crops]
+
+    print(f"{'backend':<10} {'load s':>7} {'rss MB':>8} {'detect p50':>11} {'detect p95':>11} {'embed p50':>10} {'embed p95':>10}")
+    for name in args.backends.split(","):
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        backend = load_backend(name, args.model_dir)
+        load_seconds = time.perf_counter() - start
+        rss_delta = current_rss_mb() - rss_before
+
+        timings = {"detect": [], "embed": []}
+        for i in range(args.warmup + args.iterations):
+            t0 = time.perf_counter()
+            run_detection(backend, yolo_processor, id2label, [images[i % len(images)]])
+            t1 = time.perf_counter()
+            run_image_embedding(backend, clip_processor, crops)
+            t2 = time.perf_counter()
+            if i >= args.warmup:
+                timings["detect"].append((t1 - t0) * 1000)
+                timings["embed"].append((t2 - t1) * 1000)
+
+        p = {key: np.percentile(values, [50, 95]) for key, values in timings.items()}
+        print(f"{name:<10} {load_seconds:>7.1f} {rss_delta:>8.0f} {p['detect'][0]:>9.1f}ms {p['detect'][1]:>9.1f}ms "
+              f"{p['embed'][0]:>8.1f}ms {p['embed'][1]:>8.1f}ms")
+        del backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX Runtime backend tooling")
+    parser.add_argument("--model-dir", default=DEFAULT_MODEL_DIR)
+    parser.add_argument("--image-dir", default=DEFAULT_IMAGE_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export = subparsers.add_parser("export", help="Export YOLOS and CLIP image tower to ONNX")
+    export.add_argument("--quantize", action="store_true", help="Also write dynamic int8 quantized models")
+    export.add_argument("--opset", type=int, default=17)
+    export.set_defaults(func=cmd_export)
+
+    parity = subparsers.add_parser("parity", help="Compare ONNX outputs against the PyTorch path")
+    parity.add_argument("--quantized", action="store_true")
+    parity.add_argument("--min-cosine", type=float, default=0.99)
+    parity.add_argument("--min-iou", type=float, default=0.9)
+    parity.set_defaults(func=cmd_parity)
+
+    batch_parity = subparsers.add_parser("batch-parity", help="Compare batched detections against single-image runs")
+    batch_parity.add_argument("--backend", default="torch", choices=["torch", "onnx", "onnx-int8"])
+    batch_parity.add_argument("--min-iou", type=float, default=0.99)
+    batch_parity.add_argument("--max-score-diff", type=float, default=1e-3)
+    batch_parity.set_defaults(func=cmd_batch_parity)
+
+    benchmark = subparsers.add_parser("benchmark", help="Latency and memory per backend")
+    benchmark.add_argument("--backends", default="torch,onnx,onnx-int8")
+    benchmark.add_argument("--iterations", type=int, default=20)
+    benchmark.add_argument("--warmup", type=int, default=3)
+    benchmark.add_argument("--crops", type=int, default=5, help="Crops per embedding batch")
+    benchmark.set_defaults(func=cmd_benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
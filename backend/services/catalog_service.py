@@ -0,0 +1,194 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from utils.utils import translate_url
+import threading
+
+CATALOG_PAGE_SIZE = 1000  # PostgREST max rows per request
+
+
+class ProductCatalog:
+    """
+    In-process snapshot of the `products` table, stored column-wise and indexed by
+    id and image path, so the retrieval path never queries Supabase.
+    Refreshed incrementally from an `updated_at` watermark, with periodic full reloads to pick up
+    deletions (and every change, for tables without `updated_at`). Listeners are told which rows
+    changed and which products were removed.
+    """
+
+    def __init__(self, database, table: str = "products"):
+        self.database = database
+        self.table = table
+        self._fields: List[str] = []
+        self._columns: Dict[str, list] = {}
+        self._row_by_image: Dict[str, int] = {}
+        self._row_by_id: Dict[str, int] = {}
+        self._listeners: List[Callable[[List[dict]], None]] = []
+        self._removal_listeners: List[Callable[[List[str]], None]] = []
+        self._warned_no_watermark = False
+        self._watermark: Optional[str] = None
+        self._seen_at_watermark: Set[Tuple[str, str]] = set()  # (id, updated_at) already reported at the watermark
+        self._lock = threading.Lock()
+        self._job_lock = threading.Lock()  # scheduled refreshes and reloads never overlap
+        self._scheduler = None
+
+    def __len__(self):
+        return len(self._row_by_id)
+
+    @property
+    def watermark(self) -> Optional[str]:
+        return self._watermark
+
+    def _fetch_pages(self, since: Optional[str] = None) -> List[dict]:
+        rows, offset = [], 0
+        while True:
+            query = self.database.table(self.table).select("*")
+            if since:
+                # gte: rows committed later with the same timestamp as the watermark are not skipped
+                query = query.gte("updated_at", since)
+            page = query.order("id").range(offset, offset + CATALOG_PAGE_SIZE - 1).execute().data or []
+            rows += page
+            if len(page) < CATALOG_PAGE_SIZE:
+                return rows
+            offset += CATALOG_PAGE_SIZE
+
+    def _upsert_rows(self, rows: List[dict]):
+        # Writes are ordered so that lock-free readers never see a row id before its columns exist
+        for product in rows:
+            for field in product:
+                if field not in self._columns:
+                    self._columns[field] = [None] * len(self._row_by_id)
+                    self._fields.append(field)
+            row = self._row_by_id.get(product["id"])
+            if row is None:
+                row = len(self._row_by_id)
+                for field in self._fields:
+                    self._columns[field].append(product.get(field))
+                self._row_by_id[product["id"]] = row
+            else:
+                old_image = self._columns["image"][row] if "image" in self._columns else None
+                if old_image is not None and self._row_by_image.get(old_image) == row:
+                    del self._row_by_image[old_image]
+                for field in self._fields:
+                    self._columns[field][row] = product.get(field)
+            if product.get("image"):
+                self._row_by_image[product["image"]] = row
+            updated_at = product.get("updated_at")
+            if updated_at and (self._watermark is None or updated_at > self._watermark):
+                self._watermark = updated_at
+                self._seen_at_watermark = set()
+            if updated_at and updated_at == self._watermark:
+                self._seen_at_watermark.add((product["id"], updated_at))
+
+    def load(self) -> int:
+        """
+        Full (paginated) load of the product table. After the first load, rows that differ from
+        the previous snapshot and products that disappeared are reported to the listeners.
+        Returns the number of changed and removed products.
+        """
+        rows = self._fetch_pages()
+        # Build a fresh snapshot and swap it in, so readers keep using the old one meanwhile
+        fresh = ProductCatalog(self.database, self.table)
+        fresh._upsert_rows(rows)
+        changed, removed = [], []
+        if self._row_by_id:
+            changed = [row for row in rows if self.get_by_id(row["id"]) != fresh.get_by_id(row["id"])]
+            removed = [product_id for product_id in self._row_by_id if product_id not in fresh._row_by_id]
+        with self._lock:
+            self._fields, self._columns = fresh._fields, fresh._columns
+            self._row_by_image, self._row_by_id = fresh._row_by_image, fresh._row_by_id
+            self._watermark = fresh._watermark
+            self._seen_at_watermark = fresh._seen_at_watermark
+        print(f"[Catalog] Loaded {len(self)} products (watermark {self._watermark}, "
+              f"{len(changed)} changed, {len(removed)} removed)")
+        self._notify(changed, removed)
+        return len(changed) + len(removed)
+
+    def refresh(self) -> int:
+        """Fetch only the rows changed since the watermark. Returns the number of changed rows."""
+        if self._watermark is None:
+            if self._row_by_id and not self._warned_no_watermark:
+                self._warned_no_watermark = True
+                print(f"[Catalog] {self.table} has no updated_at column: every refresh reloads the whole table")
+            return self.load()
+        since = self._watermark
+        rows = self._fetch_pages(since=since)
+        # gte returns the rows already seen at the watermark again; rows that merely share its timestamp are new
+        seen = self._seen_at_watermark
+        changed = [row for row in rows if (row["id"], row.get("updated_at")) not in seen]
+        if rows:
+            with self._lock:
+                self._upsert_rows(rows)
+        if changed:
+            print(f"[Catalog] Refreshed {len(changed)} products (watermark {self._watermark})")
+            self._notify(changed, [])
+        return len(changed)
+
+    def _notify(self, changed: List[dict], removed: List[str]):
+        for listeners, items in ((self._listeners, changed), (self._removal_listeners, removed)):
+            if not items:
+                continue
+            for listener in listeners:
+                try:
+                    listener(items)
+                except Exception as e:
+                    print(f"[Catalog] Change listener failed: {e}")
+
+    def add_listener(self, listener: Callable[[List[dict]], None],
+                     on_remove: Optional[Callable[[List[str]], None]] = None):
+        """
+        Call `listener(changed_rows)` after every refresh or reload that changed products, and
+        `on_remove(product_ids)` when a reload finds products deleted from the table.
+        """
+        self._listeners.append(listener)
+        if on_remove is not None:
+            self._removal_listeners.append(on_remove)
+
+    def start_auto_refresh(self, interval_seconds: int, full_reload_seconds: int = 0):
+        """
+        Incremental refresh every `interval_seconds`; a full reload every `full_reload_seconds`
+        (0 disables it) catches deleted rows, which never show up past the watermark.
+        """
+        if self._scheduler is not None or interval_seconds <= 0:
+            return
+        self._scheduler = BackgroundScheduler()
+        self._scheduler.add_job(self._safe_refresh, 'interval', seconds=interval_seconds)
+        if full_reload_seconds > 0 and self._watermark is not None:
+            self._scheduler.add_job(self._safe_load, 'interval', seconds=full_reload_seconds)
+        self._scheduler.start()
+
+    def _safe_refresh(self):
+        try:
+            with self._job_lock:
+                self.refresh()
+        except Exception as e:
+            print(f"[Catalog] Refresh failed: {e}")
+
+    def _safe_load(self):
+        try:
+            with self._job_lock:
+                self.load()
+        except Exception as e:
+            print(f"[Catalog] Reload failed: {e}")
+
+    def _row_to_dict(self, row: int) -> dict:
+        return {field: self._columns[field][row] for field in self._fields}
+
+    def get_by_id(self, product_id: str) -> Optional[dict]:
+        row = self._row_by_id.get(product_id)
+        return None if row is None else self._row_to_dict(row)
+
+    def get_by_image(self, image: str) -> Optional[dict]:
+        """Look up a product by its `image` column (already translated with utils.translate_url)."""
+        row = self._row_by_image.get(image)
+        return None if row is None else self._row_to_dict(row)
+
+    def get_by_vector_path(self, path: str) -> Optional[dict]:
+        """Look up the product behind an index vector's image path."""
+        # Manifest paths are stored as in the products table; bucket listings need translating
+        row = self._row_by_image.get(path)
+        if row is None:
+            row = self._row_by_image.get(translate_url(path))
+        return None if row is None else self._row_to_dict(row)
+
+    def all_products(self) -> List[dict]:
+        return [self._row_to_dict(row) for row in range(len(self._row_by_id))]
@@ -0,0 +1,50 @@
+from typing import List, Dict
+from PIL import Image
+import threading
+from setup import Initializer
+from services.inference_backend import run_detection
+from services.inference_batcher import MicroBatcher
+
+DETECTION_THRESHOLD = 0.85
+
+_detection_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def detect_batch(images: List[Image.Image]) -> List[Dict]:
+    """
+    Run YOLOS on a list of images, batching those with the same input size.
+    Returns one {"scores", "labels", "bboxes"} dict per image, in original pixel coordinates.
+    """
+    initializer = Initializer.get_instance()
+    if initializer.model_worker_pool is not None:
+        return initializer.model_worker_pool.detect(images, DETECTION_THRESHOLD)
+    return run_detection(
+        initializer.inference_backend,
+        initializer.yolo_image_processor,
+        initializer.yolo_id2label,
+        images,
+        threshold=DETECTION_THRESHOLD
+    )
+
+
+def get_detection_batcher() -> MicroBatcher:
+    global _detection_batcher
+    if _detection_batcher is None:
+        with _batcher_lock:
+            if _detection_batcher is None:
+                initializer = Initializer.get_instance()
+                _detection_batcher = MicroBatcher(
+                    "yolos-detection",
+                    detect_batch,
+                    max_batch_size=initializer.inference_max_batch_size,
+                    max_wait_ms=initializer.inference_max_wait_ms,
+                    max_queue_depth=initializer.inference_max_queue_depth,
+                    max_concurrent_batches=max(1, initializer.model_workers)
+                )
+    return _detection_batcher
+
+
+def detect_objects(image: Image.Image) -> Dict:
+    """Detect fashion objects in one image through the shared micro-batcher."""
+    return get_detection_batcher().run([image])[0]
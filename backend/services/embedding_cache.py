@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+import threading
+
+
+class CropEmbeddingCache:
+    """
+    Process-wide LRU cache of CLIP crop embeddings keyed by (model id, perceptual hash and colour
+    signature of the crop, see preprocessing.perceptual_hashes).
+    Re-submitted or near-identical photos (re-encoded, resized, the same selfie with a new question)
+    hash to the same keys, so their crops skip the CLIP forward pass entirely.
+    `max_items=0` disables the cache.
+    """
+
+    def __init__(self, max_items: int = 4096, model_id: str = ""):
+        self.max_items = max_items
+        self.model_id = model_id
+        self._entries: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_items > 0
+
+    def get_many(self, hashes: List[int]) -> List[Optional[np.ndarray]]:
+        """Cached embedding (or None) for every hash, counting hits and misses."""
+        found = []
+        with self._lock:
+            for crop_hash in hashes:
+                key = (self.model_id, crop_hash)
+                embedding = self._entries.get(key)
+                if embedding is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                found.append(embedding)
+        return found
+
+    def put_many(self, hashes: List[int], embeddings: np.ndarray):
+        if not self.enabled:
+            return
+        with self._lock:
+            for crop_hash, embedding in zip(hashes, embeddings):
+                key = (self.model_id, crop_hash)
+                # Copy the row so the cache doesn't keep whole batch outputs alive
+                self._entries[key] = np.array(embedding, dtype="float32")
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": len(self._entries),
+                "max_items": self.max_items,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
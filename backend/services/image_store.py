@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from io import BytesIO
+from PIL import Image
+from services.preprocessing import image_to_tensor
+import numpy as np
+import threading
+import torch
+import hashlib
+import base64
+import time
+
+
+def decode_image(data: bytes, min_side: Optional[int] = None) -> Tuple[Image.Image, str, Tuple[int, int]]:
+    """
+    Decode image bytes to RGB. With `min_side`, JPEGs are decoded at a reduced DCT scale
+    (1/2, 1/4, 1/8) that keeps both sides >= min_side, which is much cheaper than a full
+    decode of a phone photo. Returns (image, mime type, original size).
+    """
+    image = Image.open(BytesIO(data))
+    mime = Image.MIME.get(image.format, "image/jpeg")
+    original_size = image.size
+    if min_side and image.format == "JPEG":
+        image.draft("RGB", (min_side, min_side))
+    return image.convert("RGB"), mime, original_size
+
+
+class ImageArtifacts:
+    """
+    Everything derived from one uploaded image, keyed by the SHA-256 of its bytes and the decode scale:
+    the encoded bytes, the decoded pixels (PIL, plus a uint8 tensor for cropping),
+    detections, per-box crop embeddings and the compressed copy sent in LLM prompts.
+    Boxes (detections and crop keys) are in the coordinates of `image`, which may be
+    a reduced decode of the original (see decode_image), so the same bytes decoded with
+    another `min_side` are a separate entry.
+    """
+
+    def __init__(self, image_id: str, data: bytes, min_side: Optional[int] = None):
+        self.image_id = image_id
+        self.data = data
+        self.image, self.mime, self.original_size = decode_image(data, min_side)
+        self.detections: Optional[Dict] = None
+        self.crop_embeddings: Dict[Tuple[float, ...], np.ndarray] = {}
+        self.prompt_image: Optional[Tuple[str, int]] = None  # (data URL, encoded bytes), see services/prompt_images.py
+        self._tensor: Optional[torch.Tensor] = None
+        self.last_used = time.monotonic()
+
+    @property
+    def tensor(self) -> torch.Tensor:
+        """(3, H, W) uint8 view of the image, built on first use (benign race: both copies are equal)."""
+        if self._tensor is None:
+            self._tensor = image_to_tensor(self.image)
+        return self._tensor
+
+    @property
+    def nbytes(self) -> int:
+        width, height = self.image.size
+        pixels = width * height * 3 * (2 if self._tensor is not None else 1)
+        prompt_bytes = len(self.prompt_image[0]) if self.prompt_image is not None else 0
+        return len(self.data) + pixels + prompt_bytes + sum(e.nbytes for e in self.crop_embeddings.values())
+
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{base64.b64encode(self.data).decode('ascii')}"
+
+
+def image_id_for(data: bytes, min_side: Optional[int] = None, digest: Optional[str] = None) -> str:
+    """Handle of an image: the SHA-256 of its bytes, suffixed with the draft-decode size if any."""
+    digest = digest or hashlib.sha256(data).hexdigest()
+    return f"{digest}-d{min_side}" if min_side else digest
+
+
+def decode_base64(image_base64: str) -> bytes:
+    """Raw bytes of a (data-URL or plain) base64 image."""
+    return base64.b64decode(image_base64.split(",")[-1])
+
+
+class ImageArtifactCache:
+    """
+    Bounded LRU cache of ImageArtifacts with an idle TTL. Entries are per process:
+    with several uvicorn workers a handle is only known to the worker that received the upload.
+    """
+
+    def __init__(self, max_items: int = 256, max_bytes: int = 512 * 1024 ** 2, ttl_seconds: float = 900):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, ImageArtifacts]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image_id: str) -> Optional[ImageArtifacts]:
+        now = time.monotonic()
+        with self._lock:
+            artifacts = self._entries.get(image_id)
+            if artifacts is None or now - artifacts.last_used > self.ttl_seconds:
+                self._entries.pop(image_id, None)
+                self.misses += 1
+                return None
+            artifacts.last_used = now
+            self._entries.move_to_end(image_id)
+            self.hits += 1
+            return artifacts
+
+    def add(self, data: bytes, min_side: Optional[int] = None, digest: Optional[str] = None) -> ImageArtifacts:
+        """
+        Return the cached artifacts for these image bytes decoded with `min_side`, decoding and
+        caching them if new. `digest` (SHA-256 hex) may be passed when it was already computed
+        while receiving the bytes.
+        """
+        image_id = image_id_for(data, min_side, digest)
+        artifacts = self.get(image_id)
+        if artifacts is not None:
+            return artifacts
+        # Decode outside the lock; a concurrent upload of the same image just loses the race
+        artifacts = ImageArtifacts(image_id, data, min_side)
+        with self._lock:
+            artifacts = self._entries.setdefault(image_id, artifacts)
+            self._entries.move_to_end(image_id)
+            self._evict()
+        return artifacts
+
+    def _evict(self):
+        now = time.monotonic()
+        for image_id in [i for i, a in self._entries.items() if now - a.last_used > self.ttl_seconds]:
+            del self._entries[image_id]
+        total = sum(a.nbytes for a in self._entries.values())
+        # Always keep the most recent entry, even if it alone exceeds the byte budget
+        while len(self._entries) > 1 and (len(self._entries) > self.max_items or total > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            total -= evicted.nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "items": len(self._entries),
+                "bytes": sum(a.nbytes for a in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,119 @@
+from typing import Optional, Tuple
+import numpy as np
+import faiss
+
+# index type -> FAISS factory string; {nlist} and {pq_m} are filled in from the data size
+INDEX_TYPES = {
+    "flat": "Flat",
+    "sq8": "SQ8",
+    "ivf_flat": "IVF{nlist},Flat",
+    "ivf_sq8": "IVF{nlist},SQ8",
+    "ivf_pq": "IVF{nlist},PQ{pq_m}",
+    "hnsw": "HNSW32,Flat",
+    "hnsw_sq8": "HNSW32,SQ8",
+}
+
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+
+
+def index_factory_string(index_type: str, n_vectors: int, dim: int) -> str:
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}. Choose one of {sorted(INDEX_TYPES)}")
+    # ~4*sqrt(n) lists, but keep at least ~39 training points per list
+    nlist = int(max(1, min(4 * np.sqrt(n_vectors), n_vectors // 39)))
+    # PQ sub-quantizers must divide the dimension; aim for 16 dims per code byte
+    pq_m = next(m for m in (dim // 16, 48, 32, 16, 8, 4, 2, 1) if m > 0 and dim % m == 0)
+    return INDEX_TYPES[index_type].format(nlist=nlist, pq_m=pq_m)
+
+
+def build_index(vectors: np.ndarray, index_type: str = "flat",
+                metric: int = faiss.METRIC_INNER_PRODUCT, train_size: Optional[int] = None) -> faiss.Index:
+    """
+    Build (train + add) an index of the given type over `vectors`.
+    IVF indexes get a direct map so vectors can still be reconstructed by id.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n_vectors, dim = vectors.shape
+    index = faiss.index_factory(dim, index_factory_string(index_type, n_vectors, dim), metric)
+    if not index.is_trained:
+        train_size = min(n_vectors, train_size or 256 * 1024)
+        sample = vectors[np.random.default_rng(0).choice(n_vectors, train_size, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    configure_search(index)
+    return index
+
+
+def _extract_ivf(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def _unwrap_id_map(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def configure_search(index, nprobe: int = DEFAULT_NPROBE, ef_search: int = DEFAULT_EF_SEARCH):
+    """Apply query-time accuracy/speed knobs (IVF nprobe, HNSW efSearch); no-op for other types."""
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    hnsw = getattr(_unwrap_id_map(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
+    return index
+
+
+def search_params(index, selector=None) -> faiss.SearchParameters:
+    """
+    Per-call search parameters restricting `index` to `selector`. The parameter type must match
+    the underlying index and carries its current nprobe/efSearch (per-call values replace them).
+    """
+    inner = _unwrap_id_map(index)
+    ivf = _extract_ivf(inner)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def index_ids(index) -> np.ndarray:
+    """Ids of everything stored in `index`, without touching the vectors."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map).astype(np.int64)
+    return np.arange(index.ntotal, dtype=np.int64)
+
+
+def index_vectors(index) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (ids, vectors) of everything stored in `index`. Plain indexes use positions as ids;
+    IndexIDMap2 indexes return their explicit ids.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap2):
+        ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+        return ids, index.index.reconstruct_n(0, index.ntotal)
+    return np.arange(index.ntotal, dtype=np.int64), index.reconstruct_n(0, index.ntotal)
+
+
+def supports_remove(index) -> bool:
+    """Whether vectors can be removed in place (flat-code indexes); others must be rebuilt."""
+    return isinstance(_unwrap_id_map(index), faiss.IndexFlatCodes)
+
+
+def describe_index(index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return f"{type(index).__name__}({describe_index(index.index)})"
+    return f"{type(index).__name__}(ntotal={index.ntotal}, d={index.d})"
@@ -0,0 +1,298 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+from typing import Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from io import BytesIO
+from PIL import Image
+import numpy as np
+import threading
+import requests
+import faiss
+from utils.utils import translate_url
+from utils.artifact_cache import artifact_version, file_sha256
+from services.index_factory import configure_search, describe_index, index_vectors, supports_remove
+from services.index_factory import DEFAULT_NPROBE, DEFAULT_EF_SEARCH
+from services.vector_index import LayeredVectorIndex, VectorIndex
+
+UPDATE_BATCH_SIZE = 32  # product images downloaded and embedded per chunk
+DEFAULT_MAX_DELTA_SIZE = 10000  # added + removed vectors kept as layers before compacting
+
+
+class IndexSnapshot:
+    """
+    One immutable version of the searchable index. Searches take a reference to the current
+    snapshot and finish on it, even if a newer version is swapped in meanwhile.
+    """
+
+    def __init__(self, vector_index: LayeredVectorIndex, vector_paths: Dict[int, str], product_ids: Dict[int, str],
+                 version: str, base_version: str):
+        self.vector_index = vector_index
+        self.vector_paths = vector_paths  # vector id -> image path
+        self.product_ids = product_ids    # vector id -> product id, where known
+        self.version = version
+        self.base_version = base_version  # artifact this version was derived from
+        self.created_at = datetime.now(timezone.utc).isoformat()
+        self._indexed_images = None
+
+    @property
+    def ntotal(self) -> int:
+        return self.vector_index.ntotal
+
+    def is_indexed(self, image: str) -> bool:
+        if self._indexed_images is None:
+            paths = self.vector_paths.values()
+            self._indexed_images = set(paths) | {translate_url(path) for path in paths}
+        return image in self._indexed_images
+
+
+def _writable_copy(index) -> faiss.IndexIDMap2:
+    """Private in-memory copy of `index` with explicit vector ids (detached from any read-only mmap)."""
+    copy = faiss.deserialize_index(faiss.serialize_index(index))
+    if isinstance(copy, faiss.IndexIDMap2):
+        return copy
+    ids, vectors = index_vectors(copy)
+    copy.reset()
+    id_map = faiss.IndexIDMap2(copy)
+    id_map.add_with_ids(vectors, ids)
+    return id_map
+
+
+def _remove_ids(index: faiss.IndexIDMap2, ids: List[int]) -> faiss.IndexIDMap2:
+    ids = np.asarray(ids, dtype=np.int64)
+    if supports_remove(index):
+        index.remove_ids(ids)
+        return index
+    # IVF with an array direct map and HNSW cannot remove: re-add the survivors to the emptied, still-trained index
+    all_ids, vectors = index_vectors(index)
+    keep = ~np.isin(all_ids, ids)
+    index.reset()
+    index.add_with_ids(np.ascontiguousarray(vectors[keep]), all_ids[keep])
+    return index
+
+
+def _max_id(index) -> int:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap2):
+        ids = faiss.vector_to_array(index.id_map)
+        return int(ids.max()) if len(ids) else -1
+    return index.ntotal - 1
+
+
+def _download_image(url: str) -> Image.Image:
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+    return Image.open(BytesIO(response.content)).convert("RGB")
+
+
+class IndexManager:
+    """
+    Owns the live IndexSnapshot and publishes new versions with a single reference swap.
+    Product upserts/removals never touch the served, possibly mmap'd base index: added vectors go
+    to a small exact delta index and removed ones become tombstones (see LayeredVectorIndex), so an
+    update costs O(changes). Once more than `max_delta_size` vectors were added or removed, the
+    layers are compacted into a private id-mapped copy of the base. Reloads pick up a newly built
+    index from the bucket.
+    """
+
+    def __init__(self, catalog, fetch_index: Callable[[], str],
+                 load_index: Callable[[str], Tuple[faiss.Index, Dict[int, str]]],
+                 embed_images: Optional[Callable[[List[Image.Image]], np.ndarray]] = None,
+                 partition_by_category: bool = True, min_partition_size: int = 1,
+                 nprobe: int = DEFAULT_NPROBE, ef_search: int = DEFAULT_EF_SEARCH,
+                 max_delta_size: int = DEFAULT_MAX_DELTA_SIZE):
+        self.catalog = catalog
+        self.fetch_index = fetch_index
+        self.load_index = load_index
+        self.embed_images = embed_images
+        self.partition_by_category = partition_by_category
+        self.min_partition_size = min_partition_size
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.max_delta_size = max_delta_size
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._update_lock = threading.Lock()
+        self._next_id = 0
+        self._revision = 0
+        self._scheduler = None
+
+    def current(self) -> IndexSnapshot:
+        return self._snapshot
+
+    def _install(self, index, vector_paths: Dict[int, str], version: str, base_version: str,
+                 known_product_ids: Optional[Dict[int, str]] = None) -> IndexSnapshot:
+        configure_search(index, nprobe=self.nprobe, ef_search=self.ef_search)
+        known_product_ids = known_product_ids or {}
+        categories, product_ids = {}, {}
+        for vector_id, path in vector_paths.items():
+            product = self.catalog.get_by_vector_path(path)
+            if product is not None:
+                categories[vector_id] = product.get("category")
+            # Keep the product a vector was indexed for, even if the catalog has moved on
+            product_id = known_product_ids.get(vector_id) or (product or {}).get("id")
+            if product_id is not None:
+                product_ids[vector_id] = product_id
+
+        snapshot = IndexSnapshot(
+            LayeredVectorIndex(self._vector_index(index, categories)),
+            vector_paths, product_ids, version, base_version
+        )
+        self._next_id = max(self._next_id, _max_id(index) + 1)
+        if len(vector_paths) != index.ntotal:
+            print(f"[IndexManager] WARNING: {len(vector_paths)} image paths for {index.ntotal} vectors")
+        self._snapshot = snapshot
+        print(f"[IndexManager] Serving index version {version}: {describe_index(index)}")
+        return snapshot
+
+    def install(self, index, vector_paths: Dict[int, str], version: str) -> IndexSnapshot:
+        with self._update_lock:
+            self._revision = 0
+            return self._install(index, vector_paths, version, version)
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Revalidate the index artifact and swap in the new version if it changed.
+        Local incremental updates are dropped: a fresh build already includes those products.
+        If `load_index` rejects the artifact (e.g. IndexManifestMismatch while a build is still
+        uploading), the error propagates and the current snapshot keeps serving.
+        """
+        path = self.fetch_index()
+        version = artifact_version(path) or file_sha256(path)[:12]
+        current = self._snapshot
+        if not force and current is not None and current.base_version == version:
+            return False
+        with self._update_lock:
+            index, vector_paths = self.load_index(path)
+            self._revision = 0
+            self._install(index, vector_paths, version, version)
+        return True
+
+    def _vector_index(self, index, categories: Dict[int, Optional[str]]) -> VectorIndex:
+        return VectorIndex(index, categories if self.partition_by_category else {}, self.min_partition_size)
+
+    def _apply(self, snapshot: IndexSnapshot, vectors: np.ndarray, paths: List[str], product_ids: List[str],
+               categories: List[Optional[str]], remove_ids: List[int]) -> IndexSnapshot:
+        layers = snapshot.vector_index
+        removed = set(remove_ids)
+        new_ids = np.arange(self._next_id, self._next_id + len(paths), dtype=np.int64)
+        self._next_id += len(paths)
+
+        # Rebuild only the delta layer: its surviving vectors plus the new ones
+        if layers.delta is not None:
+            delta_ids, delta_vectors = index_vectors(layers.delta.index)
+            keep = ~np.isin(delta_ids, remove_ids)
+            delta_ids, delta_vectors = delta_ids[keep], delta_vectors[keep]
+        else:
+            delta_ids, delta_vectors = np.zeros(0, dtype=np.int64), np.zeros((0, layers.index.d), dtype="float32")
+        delta_ids = np.concatenate([delta_ids, new_ids])
+        delta_vectors = np.ascontiguousarray(np.vstack([delta_vectors, vectors]), dtype="float32")
+        delta_categories = {i: c for i, c in layers.delta_categories.items() if i not in removed}
+        delta_categories.update(zip(new_ids.tolist(), categories))
+        in_delta = set(layers.delta_categories)
+        tombstones = set(layers.removed.tolist()) | {i for i in removed if i not in in_delta}
+
+        vector_paths = {i: path for i, path in snapshot.vector_paths.items() if i not in removed}
+        vector_paths.update(zip(new_ids.tolist(), paths))
+        known_product_ids = {i: pid for i, pid in snapshot.product_ids.items() if i not in removed}
+        known_product_ids.update(zip(new_ids.tolist(), product_ids))
+        self._revision += 1
+        version = f"{snapshot.base_version}+r{self._revision}"
+
+        if len(delta_ids) + len(tombstones) > self.max_delta_size:
+            # Compact: one full copy of the base with the layers folded in, partitions rebuilt
+            index = _writable_copy(layers.index)
+            if tombstones:
+                index = _remove_ids(index, sorted(tombstones))
+            if len(delta_ids):
+                index.add_with_ids(delta_vectors, delta_ids)
+            print(f"[IndexManager] Compacting {len(delta_ids)} added and {len(tombstones)} removed vectors")
+            return self._install(index, vector_paths, version, snapshot.base_version, known_product_ids)
+
+        delta = None
+        if len(delta_ids):
+            flat = faiss.IndexIDMap2(faiss.IndexFlat(layers.index.d, layers.index.metric_type))
+            flat.add_with_ids(delta_vectors, delta_ids)
+            delta = self._vector_index(flat, delta_categories)
+        new_snapshot = IndexSnapshot(
+            LayeredVectorIndex(layers.base, delta, delta_categories, tombstones),
+            vector_paths, known_product_ids, version, snapshot.base_version
+        )
+        self._snapshot = new_snapshot
+        print(f"[IndexManager] Serving index version {version}: {new_snapshot.vector_index.delta_size} added, "
+              f"{len(tombstones)} removed since the base")
+        return new_snapshot
+
+    def upsert_products(self, products: List[dict]) -> int:
+        """(Re-)embed the products' images and index them, replacing their previous vectors."""
+        if self.embed_images is None:
+            raise RuntimeError("IndexManager has no image embedder configured")
+        vectors, paths, product_ids, categories = [], [], [], []
+        for start in range(0, len(products), UPDATE_BATCH_SIZE):
+            images = []
+            for product in products[start:start + UPDATE_BATCH_SIZE]:
+                try:
+                    images.append(_download_image(product["image"]))
+                except Exception as e:
+                    print(f"[IndexManager] Skipping product {product.get('id')}: {e}")
+                    continue
+                paths.append(product["image"])
+                product_ids.append(product["id"])
+                categories.append(product.get("category"))
+            if images:
+                vectors.append(self.embed_images(images))
+        if not paths:
+            return 0
+
+        with self._update_lock:
+            snapshot = self._snapshot
+            updated = set(product_ids)
+            stale = [i for i, pid in snapshot.product_ids.items() if pid in updated]
+            self._apply(snapshot, np.vstack(vectors), paths, product_ids, categories, stale)
+        return len(paths)
+
+    def remove_products(self, product_ids: List[str]) -> int:
+        """Drop every vector of the given products. Returns the number of vectors removed."""
+        removed = set(product_ids)
+        with self._update_lock:
+            snapshot = self._snapshot
+            stale = [i for i, pid in snapshot.product_ids.items() if pid in removed]
+            if stale:
+                self._apply(snapshot, np.zeros((0, snapshot.vector_index.index.d), dtype="float32"), [], [], [], stale)
+        return len(stale)
+
+    def on_products_changed(self, products: List[dict]):
+        """Catalog listener: index products whose current image has no vector yet."""
+        snapshot = self._snapshot
+        if snapshot is None or self.embed_images is None:
+            return
+        pending = [p for p in products if p.get("image") and not snapshot.is_indexed(p["image"])]
+        if pending:
+            print(f"[IndexManager] Indexing {len(pending)} new or re-imaged products")
+            self.upsert_products(pending)
+
+    def start_watch(self, interval_seconds: int):
+        """Poll the index artifact (ETag revalidation) and hot-swap new builds."""
+        if self._scheduler is not None or interval_seconds <= 0:
+            return
+        self._scheduler = BackgroundScheduler()
+        self._scheduler.add_job(self._safe_reload, 'interval', seconds=interval_seconds)
+        self._scheduler.start()
+
+    def _safe_reload(self):
+        try:
+            self.reload()
+        except Exception as e:
+            print(f"[IndexManager] Reload failed: {e}")
+
+    def status(self) -> dict:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"version": None}
+        return {
+            "version": snapshot.version,
+            "base_version": snapshot.base_version,
+            "created_at": snapshot.created_at,
+            "index": describe_index(snapshot.vector_index.index),
+            "vectors": snapshot.ntotal,
+            "delta_vectors": snapshot.vector_index.delta_size,
+            "removed_vectors": len(snapshot.vector_index.removed),
+            "partitions": snapshot.vector_index.partition_sizes()
+        }
@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+import json
+import os
+
+INDEX_FILE = "image.faiss"
+
+
+class IndexManifestMismatch(ValueError):
+    pass
+
+
+def manifest_file(index_sha256: str) -> str:
+    """
+    Name of the manifest of the index file with this SHA-256. Manifests are content-addressed, so
+    the builder uploads the manifest before the index and a served index never pairs with another
+    build's id map.
+    """
+    return f"image.manifest.{index_sha256[:12]}.json"
+
+
+def write_manifest(path: str, vectors: List[dict], index_type: str, dim: int, model: str, version: str,
+                   index_sha256: str):
+    """
+    Atomically write the id -> product manifest that accompanies a built index.
+    `vectors[i]` describes FAISS vector id i: {"product_id", "image", "product"}.
+    """
+    manifest = {
+        "version": version,
+        "index_sha256": index_sha256,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "index_type": index_type,
+        "model": model,
+        "dim": dim,
+        "count": len(vectors),
+        "vectors": vectors
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def manifest_image_paths(manifest: dict) -> List[str]:
+    """Image path of every vector id, in index order."""
+    return [vector["image"] for vector in manifest["vectors"]]
+
+
+def verify_manifest(manifest: dict, index_sha256: str, ntotal: int):
+    """Raise IndexManifestMismatch unless the manifest was written for this index file."""
+    if manifest.get("index_sha256") != index_sha256:
+        raise IndexManifestMismatch(
+            f"Manifest {manifest.get('version')} belongs to index {manifest.get('index_sha256')}, not {index_sha256}")
+    if manifest.get("count") != ntotal or len(manifest.get("vectors", [])) != ntotal:
+        raise IndexManifestMismatch(f"Manifest lists {manifest.get('count')} vectors, the index has {ntotal}")
@@ -0,0 +1,246 @@
+from transformers.models.yolos.modeling_yolos import YolosObjectDetectionOutput
+from collections import defaultdict
+from typing import Dict, List
+from PIL import Image
+import numpy as np
+import inspect
+import torch
+import os
+from services.preprocessing import ClipInputSpec, preprocess_images, normalize
+
+YOLOS_CHECKPOINT = 'yainage90/fashion-object-detection-yolos-tiny'
+CLIP_CHECKPOINT = 'openai/clip-vit-large-patch14-336'
+
+YOLOS_ONNX_FILE = "yolos_detector.onnx"
+CLIP_IMAGE_ONNX_FILE = "clip_image_embedder.onnx"
+CLIP_TEXT_ONNX_FILE = "clip_text_embedder.onnx"
+CLIP_MAX_TEXT_TOKENS = 77
+INT8_SUFFIX = ".int8"
+
+
+class TorchBackend:
+    """Eager PyTorch inference (the default)."""
+    name = "torch"
+
+    def __init__(self, yolo_model, clip_model, device):
+        self.yolo_model = yolo_model
+        self.clip_model = clip_model
+        self.device = device
+
+    def detect(self, pixel_values: torch.Tensor) -> YolosObjectDetectionOutput:
+        with torch.no_grad():
+            return self.yolo_model(pixel_values=pixel_values.to(self.device))
+
+    def embed_images(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Returns un-normalised CLIP image features."""
+        with torch.no_grad():
+            return self.clip_model.get_image_features(pixel_values.to(self.device)).cpu()
+
+    def embed_texts(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """Returns un-normalised CLIP text features (same space as the image features)."""
+        with torch.no_grad():
+            return self.clip_model.get_text_features(
+                input_ids=input_ids.to(self.device), attention_mask=attention_mask.to(self.device)).cpu()
+
+
+class OnnxBackend:
+    """ONNX Runtime CPU inference over models exported with `export_onnx_models`."""
+    name = "onnx"
+
+    def __init__(self, model_dir: str, quantized: bool = False, num_threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        paths = onnx_model_paths(model_dir, quantized)
+        for key in ("detector", "image_embedder"):
+            if not os.path.exists(paths[key]):
+                raise FileNotFoundError(f"ONNX model not found: {paths[key]}. Run `python -m scripts.onnx_backend export` first.")
+        self.quantized = quantized
+        self.detector = ort.InferenceSession(paths["detector"], options, providers=["CPUExecutionProvider"])
+        self.image_embedder = ort.InferenceSession(paths["image_embedder"], options, providers=["CPUExecutionProvider"])
+        # Exports made before text retrieval existed have no text tower; text search is then unavailable
+        self.text_embedder = None
+        if os.path.exists(paths["text_embedder"]):
+            self.text_embedder = ort.InferenceSession(paths["text_embedder"], options, providers=["CPUExecutionProvider"])
+
+    def detect(self, pixel_values: torch.Tensor) -> YolosObjectDetectionOutput:
+        logits, pred_boxes = self.detector.run(None, {"pixel_values": pixel_values.cpu().numpy()})
+        return YolosObjectDetectionOutput(logits=torch.from_numpy(logits), pred_boxes=torch.from_numpy(pred_boxes))
+
+    def embed_images(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        (features,) = self.image_embedder.run(None, {"pixel_values": pixel_values.cpu().numpy()})
+        return torch.from_numpy(features)
+
+    def embed_texts(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        if self.text_embedder is None:
+            raise RuntimeError("No CLIP text model in the ONNX export; re-run `python -m scripts.onnx_backend export`")
+        (features,) = self.text_embedder.run(None, {
+            "input_ids": input_ids.cpu().numpy().astype(np.int64),
+            "attention_mask": attention_mask.cpu().numpy().astype(np.int64)
+        })
+        return torch.from_numpy(features)
+
+
+def run_detection(backend, processor, id2label: Dict[int, str], images: List[Image.Image],
+                  threshold: float = 0.85) -> List[Dict]:
+    """
+    Run the detector on a list of images, one forward pass per preprocessed input size.
+    YOLOS takes no pixel mask, so zero padding would change an image's detections depending on
+    what it was batched with; only same-sized inputs (e.g. photos with the same aspect ratio)
+    share a pass. Returns one {"scores", "labels", "bboxes"} dict per image, in original pixel coordinates.
+    """
+    pixel_values = [
+        processor(images=image, return_tensors="pt", do_pad=False)["pixel_values"][0]
+        for image in images
+    ]
+    rows_by_shape = defaultdict(list)
+    for i, p in enumerate(pixel_values):
+        rows_by_shape[tuple(p.shape)].append(i)
+
+    results = [None] * len(images)
+    for rows in rows_by_shape.values():
+        outputs = backend.detect(torch.stack([pixel_values[i] for i in rows]))
+        target_sizes = torch.tensor([[images[i].size[1], images[i].size[0]] for i in rows])
+        detections = processor.post_process_object_detection(outputs, threshold=threshold, target_sizes=target_sizes)
+        for i, result in zip(rows, detections):
+            # One bulk tensor -> list conversion per field instead of an .item() call per element
+            results[i] = {
+                "scores": result["scores"].tolist(),
+                "labels": [id2label[label] for label in result["labels"].tolist()],
+                "bboxes": result["boxes"].tolist()
+            }
+    return results
+
+
+def run_pixel_embedding(backend, spec: ClipInputSpec, crops: torch.Tensor) -> np.ndarray:
+    """
+    Embed uint8 (N, 3, h, w) crops from services.preprocessing in one forward pass;
+    returns L2-normalised float32 features.
+    """
+    features = backend.embed_images(normalize(crops, spec))
+    features = features / features.norm(p=2, dim=-1, keepdim=True)
+    return np.ascontiguousarray(features.numpy(), dtype="float32")
+
+
+def run_image_embedding(backend, processor, images: List[Image.Image]) -> np.ndarray:
+    """Embed whole images with CLIP in one forward pass; returns L2-normalised float32 features."""
+    spec = ClipInputSpec.from_processor(processor)
+    return run_pixel_embedding(backend, spec, preprocess_images(images, spec))
+
+
+def run_text_embedding(backend, tokenizer, texts: List[str]) -> np.ndarray:
+    """Embed texts with the CLIP text tower; returns L2-normalised float32 features comparable to image features."""
+    inputs = tokenizer(texts, padding=True, truncation=True, max_length=CLIP_MAX_TEXT_TOKENS, return_tensors="pt")
+    features = backend.embed_texts(inputs["input_ids"], inputs["attention_mask"])
+    features = features / features.norm(p=2, dim=-1, keepdim=True)
+    return np.ascontiguousarray(features.numpy(), dtype="float32")
+
+
+def onnx_model_paths(model_dir: str, quantized: bool = False) -> Dict[str, str]:
+    suffix = INT8_SUFFIX if quantized else ""
+    return {
+        "detector": os.path.join(model_dir, YOLOS_ONNX_FILE.replace(".onnx", f"{suffix}.onnx")),
+        "image_embedder": os.path.join(model_dir, CLIP_IMAGE_ONNX_FILE.replace(".onnx", f"{suffix}.onnx")),
+        "text_embedder": os.path.join(model_dir, CLIP_TEXT_ONNX_FILE.replace(".onnx", f"{suffix}.onnx")),
+    }
+
+
+def create_inference_backend(backend_name: str, yolo_model=None, clip_model=None, device=None,
+                             model_dir: str = None, quantized: bool = False, num_threads: int = 0):
+    if backend_name == "torch":
+        return TorchBackend(yolo_model, clip_model, device)
+    if backend_name == "onnx":
+        return OnnxBackend(model_dir, quantized=quantized, num_threads=num_threads)
+    raise ValueError(f"Unknown inference backend: {backend_name}")
+
+
+class _YolosExportWrapper(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        outputs = self.model(pixel_values=pixel_values)
+        return outputs.logits, outputs.pred_boxes
+
+
+class _ClipImageExportWrapper(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+
+class _ClipTextExportWrapper(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+
+def _export(module, sample, path, output_names, dynamic_axes, opset, input_names=("pixel_values",)):
+    # Newer torch defaults to the dynamo exporter; the TorchScript exporter handles YOLOS' dynamic resolution
+    kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(
+        module, sample if isinstance(sample, tuple) else (sample,), path,
+        input_names=list(input_names),
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+        **kwargs
+    )
+
+
+def export_onnx_models(output_dir: str, yolo_model=None, clip_model=None,
+                       quantize: bool = False, opset: int = 17) -> Dict[str, str]:
+    """
+    Export the YOLOS detector and the CLIP image and text towers to ONNX (dynamic batch, resolution
+    and text length), optionally writing dynamically int8-quantized copies next to them.
+    """
+    from transformers import CLIPModel, YolosForObjectDetection
+
+    os.makedirs(output_dir, exist_ok=True)
+    yolo_model = yolo_model or YolosForObjectDetection.from_pretrained(YOLOS_CHECKPOINT)
+    clip_model = clip_model or CLIPModel.from_pretrained(CLIP_CHECKPOINT)
+    yolo_model = yolo_model.to("cpu").eval()
+    clip_model = clip_model.to("cpu").eval()
+    paths = onnx_model_paths(output_dir)
+
+    clip_size = clip_model.config.vision_config.image_size
+    with torch.no_grad():
+        _export(
+            _YolosExportWrapper(yolo_model), torch.randn(1, 3, 512, 768), paths["detector"],
+            ["logits", "pred_boxes"],
+            {"pixel_values": {0: "batch", 2: "height", 3: "width"}, "logits": {0: "batch"}, "pred_boxes": {0: "batch"}},
+            opset
+        )
+        _export(
+            _ClipImageExportWrapper(clip_model), torch.randn(1, 3, clip_size, clip_size), paths["image_embedder"],
+            ["image_embeds"],
+            {"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset
+        )
+        text_sample = torch.ones(1, 8, dtype=torch.int64)
+        _export(
+            _ClipTextExportWrapper(clip_model), (text_sample, text_sample), paths["text_embedder"],
+            ["text_embeds"],
+            {"input_ids": {0: "batch", 1: "tokens"}, "attention_mask": {0: "batch", 1: "tokens"},
+             "text_embeds": {0: "batch"}},
+            opset,
+            input_names=("input_ids", "attention_mask")
+        )
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantized_paths = onnx_model_paths(output_dir, quantized=True)
+        for key, path in paths.items():
+            quantize_dynamic(path, quantized_paths[key], weight_type=QuantType.QInt8)
+        paths.update({f"{key}_int8": path for key, path in quantized_paths.items()})
+    return paths
@@ -0,0 +1,107 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Sequence
+from fastapi import HTTPException
+import threading
+import queue
+import time
+
+
+class MicroBatcher:
+    """
+    Cross-request dynamic micro-batching for model inference.
+    Jobs submitted by concurrent requests are collected for up to `max_wait_ms`
+    (or until `max_batch_size` inputs are pending) and run as one batch on a single
+    worker thread, so the models never compete for torch intra-op threads.
+    With `max_concurrent_batches` > 1 (one per model-worker process) that many batches
+    run at once; new jobs keep coalescing while every slot is busy.
+    A job is a list of inputs; its future resolves to the matching slice of the batch output.
+    """
+
+    def __init__(self, name: str, process_batch: Callable[[List], Sequence],
+                 max_batch_size: int = 8, max_wait_ms: float = 5.0, max_queue_depth: int = 64,
+                 max_concurrent_batches: int = 1):
+        self.name = name
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+        self.max_queue_depth = max_queue_depth
+        self._queue = queue.Queue(maxsize=max_queue_depth)
+        self._carry = None  # job that did not fit into the previous batch
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self._slots = threading.Semaphore(self.max_concurrent_batches)
+        self._executor = None
+        if self.max_concurrent_batches > 1:
+            self._executor = ThreadPoolExecutor(self.max_concurrent_batches, thread_name_prefix=f"{name}-batch")
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, items: List) -> Future:
+        future = Future()
+        if not items:
+            future.set_result([])
+            return future
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((list(items), future))
+        except queue.Full:
+            raise HTTPException(status_code=503, detail=f"{self.name} inference queue is full, please retry")
+        return future
+
+    def run(self, items: List) -> Sequence:
+        """Blocking helper: submit a job and wait for its results."""
+        return self.submit(items).result()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f"{self.name}-batcher", daemon=True)
+                self._thread.start()
+
+    def _next_job(self, timeout=None):
+        if self._carry is not None:
+            job, self._carry = self._carry, None
+            return job
+        return self._queue.get(timeout=timeout)
+
+    def _loop(self):
+        while True:
+            # Wait for a free slot first, so jobs pile up (and batch) while all slots are busy
+            self._slots.acquire()
+            jobs = [self._next_job()]
+            size = len(jobs[0][0])
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._next_job(timeout=remaining)
+                except queue.Empty:
+                    break
+                if size + len(job[0]) > self.max_batch_size:
+                    self._carry = job
+                    break
+                jobs.append(job)
+                size += len(job[0])
+            if self._executor is None:
+                self._run_batch(jobs)
+            else:
+                self._executor.submit(self._run_batch, jobs)
+
+    def _run_batch(self, jobs):
+        items = [item for job_items, _ in jobs for item in job_items]
+        try:
+            outputs = self.process_batch(items)
+        except Exception as e:
+            for _, future in jobs:
+                future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        offset = 0
+        for job_items, future in jobs:
+            future.set_result(outputs[offset:offset + len(job_items)])
+            offset += len(job_items)
@@ -0,0 +1,185 @@
+"""
+Response cache for LLM calls that call sites opt into (LLMGateway `cache=True`).
+
+Two tiers:
+- exact: keyed by a hash of the normalised request (model, sampling parameters, messages with the
+  whitespace of their text collapsed and case folded), so trivially different spellings of a prompt
+  share an entry. Image parts and other non-text fields are hashed verbatim (base64 is case-sensitive);
+- semantic (off by default, `similarity_threshold=0`): entries in the same namespace (everything
+  except the last message) whose query text embeds within `similarity_threshold` cosine similarity
+  of the new query are reused. Only call sites whose last message is derived from the query text
+  alone should use it, and only with a threshold validated for the encoder: CLIP text embeddings
+  of attribute variants ("black blazer" / "navy blazer") are often above 0.95.
+
+Entries expire after `ttl_seconds` and are evicted least-recently-used beyond `max_items`.
+Concurrent identical requests are coalesced onto the first one's upstream future.
+`max_items=0` disables the cache.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import threading
+import hashlib
+import json
+import time
+import re
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Request fields that don't change the response
+_UNKEYED_FIELDS = ("timeout", "stream")
+
+
+def _normalize_text(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", text).strip().casefold()
+
+
+def _normalize_message(message: dict) -> dict:
+    # Only text is folded: string content and the text of "text" parts
+    content = message.get("content")
+    if isinstance(content, str):
+        content = _normalize_text(content)
+    elif isinstance(content, list):
+        content = [
+            dict(part, text=_normalize_text(part["text"]))
+            if isinstance(part, dict) and part.get("type") == "text" and isinstance(part.get("text"), str) else part
+            for part in content
+        ]
+    return dict(message, content=content)
+
+
+def _normalize(request: dict) -> dict:
+    return dict(request, messages=[_normalize_message(message) for message in request.get("messages", [])])
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(_normalize(value), sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def request_keys(request: dict) -> Tuple[str, str]:
+    """(exact key, semantic namespace) of a chat completion request."""
+    keyed = {field: value for field, value in request.items() if field not in _UNKEYED_FIELDS}
+    namespace = dict(keyed, messages=keyed["messages"][:-1])
+    return _digest(keyed), _digest(namespace)
+
+
+class LLMResponseCache:
+    def __init__(self, max_items: int = 1024, ttl_seconds: float = 3600.0, similarity_threshold: float = 0.0,
+                 embed: Optional[Callable[[List[str]], np.ndarray]] = None):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed  # texts -> L2-normalised embeddings; set once a text encoder is loaded
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()         # key -> (expires at, namespace, embedding, response)
+        self._namespaces: Dict[str, "OrderedDict[str, np.ndarray]"] = {}  # namespace -> {key: query embedding}
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_items > 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.enabled and self.embed is not None and self.similarity_threshold > 0
+
+    def embed_query(self, text: Optional[str]) -> Optional[np.ndarray]:
+        """Embedding of the query text for the semantic tier, or None when it is unavailable."""
+        if not text or not self.semantic_enabled:
+            return None
+        try:
+            return np.asarray(self.embed([text]), dtype="float32")[0]
+        except Exception as e:
+            print(f"[LLMCache] Query embedding failed, using the exact tier only: {e}")
+            return None
+
+    def _drop(self, key: str):
+        _, namespace, embedding, _ = self._entries.pop(key)
+        if embedding is not None:
+            keys = self._namespaces[namespace]
+            keys.pop(key, None)
+            if not keys:
+                del self._namespaces[namespace]
+
+    def _live(self, key: str, now: float):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[3]
+
+    def get(self, key: str, namespace: str, embedding: Optional[np.ndarray] = None) -> Optional[str]:
+        """Cached response for the exact key, else for the most similar query in the namespace."""
+        now = time.monotonic()
+        with self._lock:
+            response = self._live(key, now)
+            if response is not None:
+                self.hits += 1
+                return response
+            candidates = self._namespaces.get(namespace)
+            if embedding is not None and candidates:
+                keys = list(candidates)
+                similarities = np.stack([candidates[candidate] for candidate in keys]) @ embedding
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    response = self._live(keys[best], now)
+                    if response is not None:
+                        self.semantic_hits += 1
+                        return response
+            self.misses += 1
+            return None
+
+    def put(self, key: str, namespace: str, response: str, embedding: Optional[np.ndarray] = None):
+        if not self.enabled or not response:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, namespace, embedding, response)
+            if embedding is not None:
+                self._namespaces.setdefault(namespace, OrderedDict())[key] = embedding
+            while len(self._entries) > self.max_items:
+                self._drop(next(iter(self._entries)))
+
+    def join(self, key: str, namespace: str, start: Callable[[], Future],
+             embedding: Optional[np.ndarray] = None) -> Future:
+        """
+        The in-flight upstream future for this key, started with `start()` if there is none.
+        A successful result is stored in the cache when the future completes.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            future = start()
+            self._inflight[key] = future
+
+        def finish(done: Future):
+            with self._lock:
+                self._inflight.pop(key, None)
+            if not done.cancelled() and done.exception() is None:
+                self.put(key, namespace, done.result(), embedding)
+
+        future.add_done_callback(finish)
+        return future
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "items": len(self._entries),
+                "max_items": self.max_items,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,360 @@
+"""
+Shared gateway to the Groq chat API.
+
+One AsyncGroq client over a pooled keep-alive httpx connection pool serves every LLM call in the
+process, so requests stop paying for a new client, connection and TLS handshake each time. The
+client lives on a private event-loop thread; sync callers (handlers running in the threadpool,
+the profile jobs) and async callers both submit to that loop, and cancelling the caller (client
+disconnect, task cancel, timeout) cancels the in-flight request there.
+
+Every call has a token budget, a per-attempt timeout and retries with exponential backoff and
+full jitter on connection errors, timeouts, 429s and 5xx. Failures surface as HTTPException
+(502 failed, 503 rate limited, 504 timed out).
+
+Call sites can opt into the response cache (services/llm_cache.py) with `cache=True`, and into
+its semantic tier by also passing the query text the last message was built from. Every call
+names its `task` (call site); prompt/completion token histograms are kept per task.
+
+Calls are routed by task class: each call site declares what kind of work it asks for
+("selection", "rewrite", "summary", "advice") and the class's route picks the model, the default
+completion budget and the temperature. Cheap, near-deterministic work goes to a small fast model;
+only user-facing advice uses the large multimodal one. Routes are configured with
+LLM_ROUTE_<CLASS>_MODEL / _MAX_TOKENS / _TEMPERATURE.
+"""
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, replace
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from fastapi import HTTPException
+from groq import AsyncGroq
+from services.llm_cache import LLMResponseCache, request_keys
+from services.llm_metrics import LLMUsageMetrics
+from services.prompt_builder import estimate_message_tokens, estimate_tokens
+import groq
+import httpx
+import asyncio
+import threading
+import random
+import queue
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_LLM_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+SMALL_LLM_MODEL = "llama-3.1-8b-instant"
+
+
+@dataclass(frozen=True)
+class TaskRoute:
+    model: str
+    max_tokens: int
+    temperature: float
+
+
+# Task class -> route. selection: pick indices/ids from a list; rewrite: short query rewrites and
+# descriptions; summary: background summaries; advice: the user-facing (multimodal) answer.
+DEFAULT_TASK_ROUTES = {
+    "selection": TaskRoute(SMALL_LLM_MODEL, 64, 0.0),
+    "rewrite": TaskRoute(SMALL_LLM_MODEL, 256, 0.2),
+    "summary": TaskRoute(SMALL_LLM_MODEL, 256, 0.3),
+    "advice": TaskRoute(DEFAULT_LLM_MODEL, 1024, 1.0),
+}
+DEFAULT_TASK_CLASS = "advice"
+
+
+def task_routes_from_env() -> Dict[str, TaskRoute]:
+    """DEFAULT_TASK_ROUTES with LLM_ROUTE_<CLASS>_* overrides (LLM_MODEL still sets the advice model)."""
+    routes = dict(DEFAULT_TASK_ROUTES, advice=replace(DEFAULT_TASK_ROUTES["advice"],
+                                                      model=os.getenv("LLM_MODEL", DEFAULT_LLM_MODEL)))
+    for task_class, route in routes.items():
+        prefix = f"LLM_ROUTE_{task_class.upper()}_"
+        routes[task_class] = TaskRoute(
+            model=os.getenv(prefix + "MODEL", route.model),
+            max_tokens=int(os.getenv(prefix + "MAX_TOKENS", route.max_tokens)),
+            temperature=float(os.getenv(prefix + "TEMPERATURE", route.temperature))
+        )
+    return routes
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, groq.APIConnectionError, groq.RateLimitError)):
+        return True
+    return isinstance(error, groq.APIStatusError) and error.status_code >= 500
+
+
+def _to_http_error(error: Exception) -> HTTPException:
+    if isinstance(error, HTTPException):
+        return error
+    if isinstance(error, (asyncio.TimeoutError, FutureTimeoutError, groq.APITimeoutError)):
+        return HTTPException(status_code=504, detail="LLM request timed out")
+    if isinstance(error, groq.RateLimitError):
+        return HTTPException(status_code=503, detail="LLM rate limit reached, please retry",
+                             headers={"Retry-After": error.response.headers.get("retry-after", "5")})
+    return HTTPException(status_code=502, detail=f"LLM request failed: {error}")
+
+
+class LLMGateway:
+    def __init__(self, routes: Optional[Dict[str, TaskRoute]] = None, timeout_seconds: float = 30.0, max_retries: int = 2,
+                 backoff_seconds: float = 0.5, max_backoff_seconds: float = 8.0, max_connections: int = 20,
+                 api_key: Optional[str] = None, cache: Optional[LLMResponseCache] = None):
+        self.routes = routes or dict(DEFAULT_TASK_ROUTES)
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.cache = cache or LLMResponseCache(max_items=0)
+        self.metrics = LLMUsageMetrics()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-gateway", daemon=True)
+        self._thread.start()
+        self._client = asyncio.run_coroutine_threadsafe(
+            self._create_client(api_key or os.getenv("GROQ_API_KEY"), max_connections), self._loop).result()
+
+    @classmethod
+    def from_env(cls) -> "LLMGateway":
+        return cls(
+            routes=task_routes_from_env(),
+            timeout_seconds=float(os.getenv("LLM_TIMEOUT_SECONDS", 30)),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", 2)),
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", 20)),
+            cache=LLMResponseCache(
+                max_items=int(os.getenv("LLM_CACHE_SIZE", 1024)),
+                ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", 3600)),
+                similarity_threshold=float(os.getenv("LLM_CACHE_SIMILARITY", 0))  # semantic tier is opt-in
+            )
+        )
+
+    async def _create_client(self, api_key: str, max_connections: int) -> AsyncGroq:
+        # Created on the gateway loop, which owns the connection pool; retries are done here, not by the SDK
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(self.timeout_seconds, connect=5.0)
+        )
+        return AsyncGroq(api_key=api_key, http_client=http_client, max_retries=0)
+
+    def route(self, task_class: str) -> TaskRoute:
+        if task_class not in self.routes:
+            raise ValueError(f"Unknown LLM task class: {task_class} (expected one of {sorted(self.routes)})")
+        return self.routes[task_class]
+
+    def _request(self, messages: List[Dict], task_class: str, max_tokens: Optional[int], timeout: Optional[float],
+                 stream: bool, params: dict) -> dict:
+        route = self.route(task_class)
+        request = {
+            "model": route.model,
+            "messages": messages,
+            "temperature": route.temperature,
+            "top_p": 1,
+            "max_completion_tokens": max_tokens or route.max_tokens,
+            "stream": stream,
+            "timeout": timeout or self.timeout_seconds,
+        }
+        request.update(params)
+        return request
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = None
+        if isinstance(error, groq.APIStatusError):
+            retry_after = error.response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff_seconds)
+            except ValueError:
+                pass
+        # Full jitter: concurrent callers that failed together don't retry together
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+
+    # -------------------------------
+    # Coroutines running on the gateway loop
+    # -------------------------------
+
+    def _record_usage(self, task: str, request: dict, text: str, usage=None):
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or estimate_message_tokens(request["messages"])
+        completion_tokens = getattr(usage, "completion_tokens", None) or estimate_tokens(text)
+        self.metrics.record(task, prompt_tokens, completion_tokens)
+
+    async def _complete(self, request: dict, task: str) -> str:
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await asyncio.wait_for(self._client.chat.completions.create(**request), request["timeout"])
+                text = response.choices[0].message.content or ""
+                self._record_usage(task, request, text, getattr(response, "usage", None))
+                return text
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                print(f"[LLMGateway] Attempt {attempt + 1} failed ({type(e).__name__}), retrying")
+                await asyncio.sleep(self._backoff(attempt, e))
+
+    async def _stream(self, request: dict, task: str, emit):
+        emitted = False
+        for attempt in range(self.max_retries + 1):
+            try:
+                stream = await asyncio.wait_for(self._client.chat.completions.create(**request), request["timeout"])
+                chunks, usage = [], None
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        emitted = True
+                        chunks.append(delta)
+                        emit(("delta", delta))
+                    # Groq reports usage on the final chunk
+                    usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+                self._record_usage(task, request, "".join(chunks), usage)
+                emit(("done", None))
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Only retry before the first token; a partial answer can't be replayed transparently
+                if emitted or attempt == self.max_retries or not _is_retryable(e):
+                    emit(("error", e))
+                    return
+                print(f"[LLMGateway] Stream attempt {attempt + 1} failed ({type(e).__name__}), retrying")
+                await asyncio.sleep(self._backoff(attempt, e))
+
+    def _deadline(self, timeout: Optional[float]) -> float:
+        # Upper bound for a caller waiting on the gateway loop: every attempt plus its backoff
+        return (timeout or self.timeout_seconds) * (self.max_retries + 1) + self.max_backoff_seconds * self.max_retries
+
+    def _shared_completion(self, request: dict, task: str, keys: Tuple[str, str], embedding) -> Future:
+        # Identical concurrent requests wait on one upstream call, which fills the cache when done
+        return self.cache.join(keys[0], keys[1],
+                               lambda: asyncio.run_coroutine_threadsafe(self._complete(request, task), self._loop),
+                               embedding)
+
+    # -------------------------------
+    # Public interface
+    # -------------------------------
+
+    def complete(self, messages: List[Dict], task_class: str = DEFAULT_TASK_CLASS, max_tokens: Optional[int] = None,
+                 timeout: Optional[float] = None, cache: bool = False, semantic_text: Optional[str] = None,
+                 task: str = "default", **params) -> str:
+        """
+        Blocking chat completion routed by `task_class` (max_tokens defaults to the route's budget);
+        returns the full response text. With `cache`, a cached response is
+        returned when there is one (`semantic_text`: the query the last message was built from).
+        """
+        request = self._request(messages, task_class, max_tokens, timeout, False, params)
+        if cache and self.cache.enabled:
+            keys = request_keys(request)
+            embedding = self.cache.embed_query(semantic_text)
+            cached = self.cache.get(*keys, embedding)
+            if cached is not None:
+                return cached
+            future = self._shared_completion(request, task, keys, embedding)
+            try:
+                return future.result(self._deadline(timeout))
+            except Exception as e:
+                # Not cancelled: other callers may be waiting on the same request
+                raise _to_http_error(e)
+        future = asyncio.run_coroutine_threadsafe(self._complete(request, task), self._loop)
+        try:
+            return future.result(self._deadline(timeout))
+        except Exception as e:
+            future.cancel()
+            raise _to_http_error(e)
+
+    async def acomplete(self, messages: List[Dict], task_class: str = DEFAULT_TASK_CLASS, max_tokens: Optional[int] = None,
+                        timeout: Optional[float] = None, cache: bool = False, semantic_text: Optional[str] = None,
+                        task: str = "default", **params) -> str:
+        """
+        Async chat completion; cancelling the awaiting task cancels the request (unless it is shared
+        with other callers through the cache). `cache` and `semantic_text` as in complete().
+        """
+        request = self._request(messages, task_class, max_tokens, timeout, False, params)
+        if cache and self.cache.enabled:
+            keys = request_keys(request)
+            embedding = None
+            if semantic_text and self.cache.semantic_enabled:
+                # The text encoder is blocking; keep it off the caller's event loop
+                embedding = await asyncio.get_running_loop().run_in_executor(None, self.cache.embed_query, semantic_text)
+            cached = self.cache.get(*keys, embedding)
+            if cached is not None:
+                return cached
+            future = self._shared_completion(request, task, keys, embedding)
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                raise _to_http_error(e)
+        future = asyncio.run_coroutine_threadsafe(self._complete(request, task), self._loop)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            raise _to_http_error(e)
+
+    async def astream(self, messages: List[Dict], task_class: str = DEFAULT_TASK_CLASS, max_tokens: Optional[int] = None,
+                      timeout: Optional[float] = None, cache: bool = False, task: str = "default",
+                      **params) -> AsyncIterator[str]:
+        """
+        Async iterator over response text deltas; closing it early cancels the request.
+        With `cache`, a cached response is yielded as one delta, and a completed stream is cached.
+        """
+        request = self._request(messages, task_class, max_tokens, timeout, True, params)
+        keys = request_keys(request) if cache and self.cache.enabled else None
+        if keys is not None:
+            cached = self.cache.get(*keys)
+            if cached is not None:
+                yield cached
+                return
+        chunks = []
+        deltas = asyncio.Queue()
+        caller_loop = asyncio.get_running_loop()
+        future = asyncio.run_coroutine_threadsafe(
+            self._stream(request, task, lambda item: caller_loop.call_soon_threadsafe(deltas.put_nowait, item)), self._loop)
+        try:
+            while True:
+                kind, value = await deltas.get()
+                if kind == "done":
+                    if keys is not None:
+                        self.cache.put(*keys, "".join(chunks))
+                    return
+                if kind == "error":
+                    raise _to_http_error(value)
+                if keys is not None:
+                    chunks.append(value)
+                yield value
+        finally:
+            future.cancel()
+
+    def stream(self, messages: List[Dict], task_class: str = DEFAULT_TASK_CLASS, max_tokens: Optional[int] = None,
+               timeout: Optional[float] = None, task: str = "default", **params) -> Iterator[str]:
+        """Blocking iterator over response text deltas."""
+        request = self._request(messages, task_class, max_tokens, timeout, True, params)
+        deltas = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._stream(request, task, deltas.put), self._loop)
+        try:
+            while True:
+                try:
+                    kind, value = deltas.get(timeout=self._deadline(timeout))
+                except queue.Empty:
+                    raise _to_http_error(asyncio.TimeoutError())
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise _to_http_error(value)
+                yield value
+        finally:
+            future.cancel()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._client.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def get_llm_gateway() -> LLMGateway:
+    """The process-wide gateway, created on first use from LLM_* environment variables."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway.from_env()
+    return _gateway
@@ -0,0 +1,71 @@
+"""
+Prompt and completion token histograms per LLM task (call site), recorded by the gateway.
+Counts come from the API usage when it is returned, otherwise from the prompt builder's estimate.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Optional
+import threading
+
+# Upper bucket bounds in tokens; larger values go to the overflow bucket
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+class TokenHistogram:
+    def __init__(self, buckets=TOKEN_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, tokens: int):
+        self.counts[bisect_left(self.buckets, tokens)] += 1
+        self.count += 1
+        self.total += tokens
+        self.max = max(self.max, tokens)
+
+    def quantile(self, q: float) -> Optional[int]:
+        """Upper bound of the bucket holding the q-quantile (the max for the overflow bucket)."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 1) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+            "buckets": {
+                f"le_{bound}": count for bound, count in zip(list(self.buckets) + ["inf"], self.counts)
+            }
+        }
+
+
+class LLMUsageMetrics:
+    def __init__(self):
+        self._prompt: Dict[str, TokenHistogram] = defaultdict(TokenHistogram)
+        self._completion: Dict[str, TokenHistogram] = defaultdict(TokenHistogram)
+        self._lock = threading.Lock()
+
+    def record(self, task: str, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            self._prompt[task].observe(prompt_tokens)
+            self._completion[task].observe(completion_tokens)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                task: {
+                    "prompt_tokens": self._prompt[task].summary(),
+                    "completion_tokens": self._completion[task].summary()
+                }
+                for task in sorted(self._prompt)
+            }
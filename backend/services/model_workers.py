@@ -0,0 +1,245 @@
+"""
+Model-worker processes for YOLOS and CLIP.
+
+Inference (pre-processing, forward pass, post-processing) runs in a pool of spawned processes,
+each with its own pinned torch thread budget, so it never holds the API process's GIL and
+light routes stay responsive while the vision endpoints are saturated. Decoded images (and
+uint8 CLIP crops) are handed over through one shared-memory block per batch; only a small
+handle is pickled.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, List, Union
+from PIL import Image
+import multiprocessing
+import numpy as np
+import threading
+import torch
+import time
+import os
+from services.inference_backend import create_inference_backend, run_detection, run_pixel_embedding, run_text_embedding
+from services.inference_backend import YOLOS_CHECKPOINT, CLIP_CHECKPOINT
+from services.preprocessing import ClipInputSpec, preprocess_images
+
+WORKER_READY_TIMEOUT_SECONDS = 900
+
+_worker = {}
+
+
+# -------------------------------
+# Shared-memory image transport
+# -------------------------------
+
+class SharedImageBatch:
+    """
+    uint8 arrays (RGB images as HWC, or CHW crops) packed into one shared-memory block. `handle`
+    is what workers receive: (block name, [(offset, shape), ...]). The creating process unlinks
+    the block on close.
+    """
+
+    def __init__(self, images: List[Union[Image.Image, np.ndarray]]):
+        arrays = [
+            np.ascontiguousarray(image, dtype=np.uint8) if isinstance(image, np.ndarray)
+            else np.asarray(image.convert("RGB"), dtype=np.uint8)
+            for image in images
+        ]
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, sum(a.nbytes for a in arrays)))
+        layout, offset = [], 0
+        for array in arrays:
+            np.ndarray(array.shape, np.uint8, buffer=self._shm.buf, offset=offset)[:] = array
+            layout.append((offset, array.shape))
+            offset += array.nbytes
+        self.handle = (self._shm.name, layout)
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attach(handle) -> List[np.ndarray]:
+    name, layout = handle
+    # Workers are children of the API process and share its resource tracker, which
+    # forgets the block when the API process unlinks it
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return [np.ndarray(shape, np.uint8, buffer=shm.buf, offset=offset).copy() for offset, shape in layout]
+    finally:
+        shm.close()
+
+
+# -------------------------------
+# Worker process side
+# -------------------------------
+
+def _pin_worker(worker_index: int, num_threads: int, pin_cpus: bool):
+    cpus = []
+    if pin_cpus and hasattr(os, "sched_setaffinity"):
+        available = sorted(os.sched_getaffinity(0))
+        start = (worker_index * num_threads) % len(available)
+        cpus = [available[(start + i) % len(available)] for i in range(min(num_threads, len(available)))]
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    return cpus
+
+
+def _init_worker(backend_name: str, model_dir: str, quantized: bool, num_threads: int, pin_cpus: bool,
+                 worker_counter, ready_counter):
+    from transformers import CLIPModel, CLIPProcessor
+    from transformers import YolosImageProcessor, YolosForObjectDetection, YolosConfig
+
+    with worker_counter.get_lock():
+        worker_index = worker_counter.value
+        worker_counter.value += 1
+    cpus = _pin_worker(worker_index, num_threads, pin_cpus)
+
+    clip_processor = CLIPProcessor.from_pretrained(CLIP_CHECKPOINT)
+    use_torch_weights = backend_name == "torch"
+    yolo_model = YolosForObjectDetection.from_pretrained(YOLOS_CHECKPOINT).eval() if use_torch_weights else None
+    clip_model = CLIPModel.from_pretrained(CLIP_CHECKPOINT).eval() if use_torch_weights else None
+    _worker.update(
+        index=worker_index,
+        cpus=cpus,
+        yolo_image_processor=YolosImageProcessor.from_pretrained(YOLOS_CHECKPOINT),
+        yolo_id2label=YolosConfig.from_pretrained(YOLOS_CHECKPOINT).id2label,
+        clip_input=ClipInputSpec.from_processor(clip_processor),
+        clip_tokenizer=clip_processor.tokenizer,
+        backend=create_inference_backend(
+            backend_name, yolo_model=yolo_model, clip_model=clip_model, device=torch.device("cpu"),
+            model_dir=model_dir, quantized=quantized, num_threads=num_threads
+        )
+    )
+    # Warm up before reporting in, so the pool is only "started" once every worker can serve
+    blank = Image.new("RGB", (512, 512), (127, 127, 127))
+    _detect([blank], threshold=1.0)
+    _embed(preprocess_images([blank], _worker["clip_input"]))
+    try:
+        _embed_text_task(["warmup"])
+    except RuntimeError as e:
+        print(f"[ModelWorker {worker_index}] Text retrieval unavailable: {e}")
+    print(f"[ModelWorker {worker_index}] pid {os.getpid()} ready ({num_threads} threads, cpus {cpus or 'any'})")
+    with ready_counter.get_lock():
+        ready_counter.value += 1
+
+
+def _detect(images: List[Image.Image], threshold: float) -> List[Dict]:
+    return run_detection(
+        _worker["backend"], _worker["yolo_image_processor"], _worker["yolo_id2label"], images, threshold=threshold
+    )
+
+
+def _embed(crops: torch.Tensor) -> np.ndarray:
+    return run_pixel_embedding(_worker["backend"], _worker["clip_input"], crops)
+
+
+def _embed_text_task(texts: List[str]) -> np.ndarray:
+    return run_text_embedding(_worker["backend"], _worker["clip_tokenizer"], texts)
+
+
+def _detect_task(handle, threshold: float) -> List[Dict]:
+    return _detect([Image.fromarray(array) for array in _attach(handle)], threshold)
+
+
+def _embed_task(handle) -> np.ndarray:
+    return _embed(torch.from_numpy(np.stack(_attach(handle))))
+
+
+def _worker_pid() -> int:
+    return os.getpid()
+
+
+# -------------------------------
+# API process side
+# -------------------------------
+
+class ModelWorkerPool:
+    """Pool of spawned model-worker processes; `detect` / `embed` block until the batch is done."""
+
+    def __init__(self, num_workers: int, threads_per_worker: int = 0, backend_name: str = "torch",
+                 model_dir: str = None, quantized: bool = False, pin_cpus: bool = True):
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        self.backend_name = backend_name
+        self.model_dir = model_dir
+        self.quantized = quantized
+        self.pin_cpus = pin_cpus
+        self._context = multiprocessing.get_context("spawn")
+        self._worker_counter = self._context.Value("i", 0)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._restart_lock = threading.Lock()
+
+    def start(self):
+        """Spawn every worker and wait until all of them have loaded and warmed up their models."""
+        with self._lock:
+            ready_counter = self._context.Value("i", 0)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=self._context,
+                initializer=_init_worker,
+                initargs=(self.backend_name, self.model_dir, self.quantized, self.threads_per_worker,
+                          self.pin_cpus, self._worker_counter, ready_counter)
+            )
+            # One pending task per worker makes the executor spawn all of them now
+            futures = [self._executor.submit(_worker_pid) for _ in range(self.num_workers)]
+            deadline = time.monotonic() + WORKER_READY_TIMEOUT_SECONDS
+            while ready_counter.value < self.num_workers:
+                failed = [f for f in futures if f.done() and f.exception() is not None]
+                if failed:
+                    # A worker failed to load its models: surface the error instead of waiting
+                    raise failed[0].exception()
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Model workers not ready after {WORKER_READY_TIMEOUT_SECONDS}s")
+                time.sleep(0.1)
+            for future in futures:
+                future.result()
+        print(f"[ModelWorkerPool] {self.num_workers} workers x {self.threads_per_worker} threads ({self.backend_name})")
+        return self
+
+    def _submit(self, task, images: List[Image.Image], *args):
+        with SharedImageBatch(images) as batch:
+            executor = self._executor
+            try:
+                return executor.submit(task, batch.handle, *args).result()
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed): replace the pool and retry the batch once
+                self._restart(executor)
+                return self._executor.submit(task, batch.handle, *args).result()
+
+    def _restart(self, broken_executor):
+        with self._restart_lock:
+            if self._executor is not broken_executor:
+                return  # another batch already restarted it
+            print("[ModelWorkerPool] Worker pool broken, restarting")
+            broken_executor.shutdown(wait=False, cancel_futures=True)
+            self.start()
+
+    def detect(self, images: List[Image.Image], threshold: float) -> List[Dict]:
+        if not images:
+            return []
+        return self._submit(_detect_task, images, threshold)
+
+    def embed(self, crops: torch.Tensor) -> np.ndarray:
+        """Embed uint8 (N, 3, h, w) crops from services.preprocessing."""
+        return self._submit(_embed_task, list(crops.numpy()))
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        # Texts are tiny; they are pickled rather than put in shared memory
+        executor = self._executor
+        try:
+            return executor.submit(_embed_text_task, texts).result()
+        except BrokenProcessPool:
+            self._restart(executor)
+            return self._executor.submit(_embed_text_task, texts).result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
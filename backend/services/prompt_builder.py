@@ -0,0 +1,130 @@
+"""
+Token-budgeted prompt building.
+
+Prompts used to embed every column of each product row (including the full reviews list) as
+`key: value` lines, so their size grew with whatever the catalog held. Here each prompt projects
+only the fields it needs and every variable-length section has a token budget: descriptions and
+reviews are cut at a word boundary, the review list stops when its budget is spent.
+
+Token counts are estimates (about 4 characters per token for English text, a flat cost per image);
+exact counts come back in the API usage and are recorded by the gateway (services/llm_metrics.py).
+"""
+from typing import Dict, Iterable, List, Optional
+import math
+
+CHARS_PER_TOKEN = 4
+IMAGE_TOKEN_ESTIMATE = 600   # a downscaled photo (see services/prompt_images.py)
+MESSAGE_TOKEN_OVERHEAD = 4   # role and separators
+
+# Product fields shown to the advisor model, in prompt order
+ADVISOR_PRODUCT_FIELDS = ("name", "brand", "category", "gender", "material_info", "description", "reviews")
+# Product fields in the text-only candidate list
+TEXT_ONLY_PRODUCT_FIELDS = ("name", "brand", "category", "description")
+# Per-field token budgets; fields not listed are short and kept whole
+FIELD_TOKEN_BUDGETS = {
+    "description": 120,
+    "material_info": 40,
+    "reviews": 120,
+}
+REVIEW_TOKEN_BUDGET = 40     # per review comment
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def estimate_message_tokens(messages: List[Dict]) -> int:
+    """Estimated prompt tokens of chat messages (string or multi-part content)."""
+    total = 0
+    for message in messages:
+        total += MESSAGE_TOKEN_OVERHEAD
+        content = message.get("content")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                total += IMAGE_TOKEN_ESTIMATE
+            else:
+                total += estimate_tokens(part.get("text"))
+    return total
+
+
+def truncate_to_tokens(text: Optional[str], max_tokens: int) -> str:
+    """The text cut at a word boundary to about max_tokens, with an ellipsis when shortened."""
+    text = " ".join(str(text or "").split())
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0] or text[:max_chars]
+    return cut.rstrip(",.;:") + "..."
+
+
+def format_reviews(reviews: Optional[Iterable], max_tokens: int) -> str:
+    """Reviews as "rating/5: comment" items until the budget is spent."""
+    items, used = [], 0
+    for review in reviews or []:
+        if not isinstance(review, dict):
+            review = getattr(review, "dict", lambda: {"comment": str(review)})()
+        rating = review.get("rating")
+        item = f"{rating}/5: " if rating is not None else ""
+        item += truncate_to_tokens(review.get("comment"), REVIEW_TOKEN_BUDGET)
+        cost = estimate_tokens(item) + 1
+        if used + cost > max_tokens:
+            break
+        items.append(item)
+        used += cost
+    return "; ".join(items)
+
+
+def product_summary(product: Dict, fields: Iterable[str] = ADVISOR_PRODUCT_FIELDS,
+                    budgets: Dict[str, int] = FIELD_TOKEN_BUDGETS) -> str:
+    """`field: value` lines of the projected fields, empty ones skipped, long ones truncated."""
+    lines = []
+    for field in fields:
+        value = product.get(field)
+        if field == "reviews":
+            value = format_reviews(value, budgets.get(field, FIELD_TOKEN_BUDGETS["reviews"]))
+        elif field in budgets:
+            value = truncate_to_tokens(value, budgets[field])
+        if value:
+            lines.append(f"{field}: {value}")
+    return "\n".join(lines)
+
+
+class PromptBuilder:
+    """
+    Accumulates the content parts of a single-turn multimodal prompt and keeps a running
+    token estimate. `max_tokens` on a text part truncates it to that budget.
+    """
+
+    def __init__(self, system_instruction: str):
+        self.system_instruction = system_instruction
+        self.content: List[Dict] = []
+        self.estimated_tokens = 2 * MESSAGE_TOKEN_OVERHEAD + estimate_tokens(system_instruction)
+
+    def text(self, text: str, max_tokens: Optional[int] = None) -> "PromptBuilder":
+        if max_tokens is not None:
+            text = truncate_to_tokens(text, max_tokens)
+        if text:
+            self.content.append({"type": "text", "text": text})
+            self.estimated_tokens += estimate_tokens(text)
+        return self
+
+    def part(self, part: Optional[Dict]) -> "PromptBuilder":
+        """A prepared content part (e.g. the user profile message)."""
+        if part:
+            self.content.append(part)
+            self.estimated_tokens += IMAGE_TOKEN_ESTIMATE if part.get("type") == "image_url" else estimate_tokens(part.get("text"))
+        return self
+
+    def image(self, url: str) -> "PromptBuilder":
+        self.content.append({"type": "image_url", "image_url": {"url": url}})
+        self.estimated_tokens += IMAGE_TOKEN_ESTIMATE
+        return self
+
+    def messages(self) -> List[Dict]:
+        return [
+            {"role": "system", "content": self.system_instruction},
+            {"role": "user", "content": self.content}
+        ]
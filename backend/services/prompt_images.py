@@ -0,0 +1,224 @@
+"""
+Image preparation for multimodal LLM prompts.
+
+The advisor prompt carries the user's photo and one reference image per selected product. Sent
+as-is they are multi-MB uploads per request (full-size photos as base64, full-size catalog
+images fetched by the provider), and vision-token cost grows with resolution. This stage:
+
+- downsizes the query image to `max_side` and re-encodes it as JPEG at `quality` (done once per
+  image handle, the result is kept on the ImageArtifacts);
+- serves catalog images as small JPEG thumbnails from a disk cache. Thumbnails are precomputed in
+  the background (whole catalog at startup, then changed products); an image without a thumbnail
+  yet falls back to its public URL and is queued.
+
+Byte counts before/after are kept for /ai/cache-stats.
+"""
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+from io import BytesIO
+from PIL import Image
+import threading
+import requests
+import hashlib
+import base64
+import queue
+import json
+import os
+
+
+def encode_jpeg(image: Image.Image, max_side: int, quality: int) -> bytes:
+    """RGB JPEG bytes of the image, downscaled (never upscaled) to fit max_side x max_side."""
+    image = image.convert("RGB")
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def jpeg_data_url(data: bytes) -> str:
+    return f"data:image/jpeg;base64,{base64.b64encode(data).decode('ascii')}"
+
+
+class CatalogThumbnailCache:
+    """
+    Disk cache of catalog image thumbnails, one JPEG per (image URL, size, quality), with a small
+    in-memory LRU of the hottest files. Writes are atomic, so several workers can share the directory.
+    """
+
+    def __init__(self, cache_dir: str, max_side: int = 384, quality: int = 75, memory_items: int = 256):
+        self.cache_dir = cache_dir
+        self.max_side = max_side
+        self.quality = quality
+        self.memory_items = memory_items
+        os.makedirs(cache_dir, exist_ok=True)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (thumbnail, original size)
+        self._pending = set()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.bytes_served = 0
+        self.bytes_saved = 0
+
+    def _key(self, url: str) -> str:
+        return hashlib.sha256(f"{url}|{self.max_side}|{self.quality}".encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        # Thumbnail and the original's size (for the bytes-saved count)
+        base = os.path.join(self.cache_dir, key)
+        return f"{base}.jpg", f"{base}.json"
+
+    def get(self, url: str) -> Optional[bytes]:
+        """Thumbnail bytes, or None (the image is then queued for generation)."""
+        key = self._key(url)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None:
+            thumbnail_path, meta_path = self._paths(key)
+            try:
+                with open(thumbnail_path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                with self._lock:
+                    self.misses += 1
+                self.schedule([url])
+                return None
+            try:
+                with open(meta_path) as f:
+                    original_size = json.load(f).get("original_bytes") or len(data)
+            except (OSError, ValueError):
+                original_size = len(data)
+            entry = (data, original_size)
+            with self._lock:
+                self._memory[key] = entry
+                while len(self._memory) > self.memory_items:
+                    self._memory.popitem(last=False)
+        data, original_size = entry
+        with self._lock:
+            self.hits += 1
+            self.bytes_served += len(data)
+            self.bytes_saved += max(original_size - len(data), 0)
+        return data
+
+    def contains(self, url: str) -> bool:
+        return os.path.exists(self._paths(self._key(url))[0])
+
+    def generate(self, url: str):
+        """Download one catalog image and write its thumbnail."""
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        data = encode_jpeg(Image.open(BytesIO(response.content)), self.max_side, self.quality)
+        thumbnail_path, meta_path = self._paths(self._key(url))
+        for path, content, mode in ((meta_path, json.dumps({"url": url, "original_bytes": len(response.content)}), "w"),
+                                    (thumbnail_path, data, "wb")):
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, mode) as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self.generated += 1
+
+    def schedule(self, urls: Iterable[str]):
+        """Queue thumbnail generation for images that don't have one yet (background thread)."""
+        queued = 0
+        with self._lock:
+            for url in urls:
+                if url and url not in self._pending:
+                    self._pending.add(url)
+                    self._queue.put(url)
+                    queued += 1
+            if queued and self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="thumbnail-cache", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            url = self._queue.get()
+            try:
+                if not self.contains(url):
+                    self.generate(url)
+            except Exception as e:
+                print(f"[ThumbnailCache] Skipping {url}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(url)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "generated": self.generated,
+                "pending": len(self._pending),
+                "bytes_served": self.bytes_served,
+                "bytes_saved": self.bytes_saved
+            }
+
+
+class PromptImagePreparer:
+    """
+    Prepares the images of multimodal prompts (see module docstring). `enabled=False` passes
+    images through unchanged: the original upload and public catalog URLs.
+    """
+
+    def __init__(self, enabled: bool = True, max_side: int = 768, quality: int = 80,
+                 thumbnails: Optional[CatalogThumbnailCache] = None):
+        self.enabled = enabled
+        self.max_side = max_side
+        self.quality = quality
+        self.thumbnails = thumbnails
+        self._lock = threading.Lock()
+        self.query_images = 0
+        self.query_bytes_in = 0
+        self.query_bytes_out = 0
+
+    def query_image_url(self, artifacts) -> str:
+        """Data URL of the user's photo for the prompt, compressed once per image handle."""
+        if not self.enabled:
+            return artifacts.data_url()
+        if artifacts.prompt_image is None:
+            data = encode_jpeg(artifacts.image, self.max_side, self.quality)
+            if len(data) >= len(artifacts.data):
+                # Already small: keep the original encoding
+                artifacts.prompt_image = (artifacts.data_url(), len(artifacts.data))
+            else:
+                artifacts.prompt_image = (jpeg_data_url(data), len(data))
+            print(f"[PromptImages] Query image {len(artifacts.data) / 1024:.0f} KB -> "
+                  f"{artifacts.prompt_image[1] / 1024:.0f} KB")
+        url, nbytes = artifacts.prompt_image
+        with self._lock:
+            self.query_images += 1
+            self.query_bytes_in += len(artifacts.data)
+            self.query_bytes_out += nbytes
+        return url
+
+    def catalog_image_url(self, public_url: str) -> str:
+        """Thumbnail data URL of a catalog image if cached, else its public URL."""
+        if not self.enabled or self.thumbnails is None:
+            return public_url
+        data = self.thumbnails.get(public_url)
+        return public_url if data is None else jpeg_data_url(data)
+
+    def schedule_thumbnails(self, public_urls: Iterable[str]):
+        if self.enabled and self.thumbnails is not None:
+            self.thumbnails.schedule(public_urls)
+
+    def stats(self) -> dict:
+        with self._lock:
+            query = {
+                "images": self.query_images,
+                "bytes_in": self.query_bytes_in,
+                "bytes_out": self.query_bytes_out,
+                "bytes_saved": self.query_bytes_in - self.query_bytes_out
+            }
+        return {
+            "enabled": self.enabled,
+            "query_images": query,
+            "catalog_thumbnails": self.thumbnails.stats() if self.thumbnails is not None else None
+        }
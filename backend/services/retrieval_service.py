@@ -0,0 +1,193 @@
+from typing import List, Dict, Optional, Tuple, Union
+from PIL import Image
+import numpy as np
+import threading
+from setup import Initializer
+from services.inference_backend import run_pixel_embedding, run_text_embedding
+from services.preprocessing import image_to_tensor, crop_boxes, perceptual_hashes
+import torch
+from services.inference_batcher import MicroBatcher
+from services.index_manager import IndexSnapshot
+from services.search_index import fuse_rankings, matches_filters
+
+_embedding_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def embed_image_crops(crops: List[torch.Tensor]) -> np.ndarray:
+    """
+    Embed every uint8 (3, h, w) crop (services.preprocessing) with CLIP in a single batched forward pass.
+    Returns an L2-normalised float32 matrix of shape (len(crops), embed_dim).
+    """
+    initializer = Initializer.get_instance()
+    if not crops:
+        return np.zeros((0, initializer.embed_dim), dtype="float32")
+    crops = torch.stack(crops)
+    if initializer.model_worker_pool is not None:
+        return initializer.model_worker_pool.embed(crops)
+    return run_pixel_embedding(initializer.inference_backend, initializer.clip_input, crops)
+
+
+def get_embedding_batcher() -> MicroBatcher:
+    global _embedding_batcher
+    if _embedding_batcher is None:
+        with _batcher_lock:
+            if _embedding_batcher is None:
+                initializer = Initializer.get_instance()
+                _embedding_batcher = MicroBatcher(
+                    "clip-embedding",
+                    embed_image_crops,
+                    max_batch_size=initializer.inference_max_embed_batch_size,
+                    max_wait_ms=initializer.inference_max_wait_ms,
+                    max_queue_depth=initializer.inference_max_queue_depth,
+                    max_concurrent_batches=max(1, initializer.model_workers)
+                )
+    return _embedding_batcher
+
+
+def embed_crops(crops: torch.Tensor) -> np.ndarray:
+    """
+    Embed uint8 (N, 3, h, w) crops; crops whose perceptual hash is in the crop embedding cache
+    skip CLIP, the rest share forward passes with concurrent requests through the micro-batcher.
+    """
+    cache = Initializer.get_instance().crop_embedding_cache
+    if not cache.enabled:
+        return get_embedding_batcher().run(list(crops))
+    hashes = perceptual_hashes(crops)
+    embedded = cache.get_many(hashes)
+    missing = [i for i, embedding in enumerate(embedded) if embedding is None]
+    if missing:
+        features = get_embedding_batcher().run([crops[i] for i in missing])
+        cache.put_many([hashes[i] for i in missing], features)
+        for i, embedding in zip(missing, features):
+            embedded[i] = embedding
+    return np.ascontiguousarray(np.stack(embedded), dtype="float32")
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """L2-normalised CLIP text features, in the same space as the image index."""
+    initializer = Initializer.get_instance()
+    if initializer.model_worker_pool is not None:
+        return initializer.model_worker_pool.embed_texts(texts)
+    return run_text_embedding(initializer.inference_backend, initializer.clip_tokenizer, texts)
+
+
+def search_similar(features: np.ndarray, k: int, labels: List[str] = None,
+                   snapshot: IndexSnapshot = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search the whole query matrix against the vector index; with `labels`, each row only
+    searches its own category partition (falling back to the global index).
+    Returns (distances, vector ids), each of shape (n_queries, k).
+    """
+    snapshot = snapshot or Initializer.get_instance().index_manager.current()
+    return snapshot.vector_index.search(features, k, labels)
+
+
+def embed_boxes(image: Union[Image.Image, torch.Tensor], bboxes: List[List[float]],
+                cache: Optional[Dict] = None) -> np.ndarray:
+    """
+    Embed the crop of every box; with `cache` (box -> embedding, e.g. an image handle's),
+    only boxes not embedded before are cropped and sent to CLIP. `image` may already be a
+    (3, H, W) uint8 tensor (ImageArtifacts.tensor).
+    """
+    keys = [tuple(round(float(v), 2) for v in box) for box in bboxes]
+    missing = [i for i, key in enumerate(keys) if cache is None or key not in cache]
+    if missing:
+        # Crop and resize on the image tensor
+        pixels = image if isinstance(image, torch.Tensor) else image_to_tensor(image)
+        crops = crop_boxes(pixels, [bboxes[i] for i in missing], Initializer.get_instance().clip_input)
+        embedded = embed_crops(crops)
+        if cache is None:
+            return embedded
+        for i, embedding in zip(missing, embedded):
+            cache[keys[i]] = embedding
+    return np.ascontiguousarray(np.stack([cache[key] for key in keys]), dtype="float32")
+
+
+def retrieve_similar_items(image: Union[Image.Image, torch.Tensor], bboxes: List[List[float]], labels: List[str], k: int,
+                           embedding_cache: Optional[Dict] = None) -> List[Dict]:
+    """
+    Crop every detected object, embed all crops at once and return the top-k matches per object.
+    Each group is {"label": str, "retrieved_image_paths": [...], "similarity_scores": [...], "products": [...]},
+    with product rows resolved from the in-memory catalog (None when a vector has no product).
+    """
+    initializer = Initializer.get_instance()
+    if not bboxes:
+        return []
+    features = embed_boxes(image, bboxes, embedding_cache)
+
+    # Resolve ids against the same index version that produced them, even if a new one is swapped in
+    snapshot = initializer.index_manager.current()
+    dists, indexes = search_similar(features, k, labels, snapshot)
+
+    groups = []
+    for label, dist_row, index_row in zip(labels, dists.tolist(), indexes.tolist()):
+        paths, scores, products = [], [], []
+        for dist_, index_ in zip(dist_row, index_row):
+            # FAISS pads with -1 when the index holds fewer than k vectors
+            if index_ < 0:
+                continue
+            path = snapshot.vector_paths.get(index_)
+            if path is None:
+                continue
+            paths.append(path)
+            scores.append(round(dist_, 4))
+            products.append(initializer.catalog.get_by_vector_path(path))
+        groups.append({
+            "label": label,
+            "retrieved_image_paths": paths,
+            "similarity_scores": scores,
+            "products": products
+        })
+    return groups
+
+
+def search_products_by_text(query: str, k: int, oversample: int = 4) -> List[Tuple[Dict, float]]:
+    """
+    Top-k catalog products for a free-text query: the CLIP text embedding of the query searched
+    against the image index (cross-modal). A product with several images counts once, at its
+    best score; `oversample` * k vectors are searched to leave room for that.
+    Returns [(product row, similarity score), ...], best first.
+    """
+    initializer = Initializer.get_instance()
+    snapshot = initializer.index_manager.current()
+    features = embed_texts([query])
+    dists, indexes = search_similar(features, k * oversample, snapshot=snapshot)
+
+    results, seen = [], set()
+    for dist_, index_ in zip(dists[0].tolist(), indexes[0].tolist()):
+        path = snapshot.vector_paths.get(index_) if index_ >= 0 else None
+        product = initializer.catalog.get_by_vector_path(path) if path else None
+        if product is None or product["id"] in seen:
+            continue
+        seen.add(product["id"])
+        results.append((product, round(dist_, 4)))
+        if len(results) == k:
+            break
+    return results
+
+
+def search_products(query: str, k: int = 10, filters: Optional[Dict[str, str]] = None,
+                    mode: str = "lexical", vector_weight: float = 1.0) -> List[Tuple[Dict, float]]:
+    """
+    Catalog search without touching Supabase. "lexical" ranks by BM25 over the product text
+    fields; "hybrid" fuses that ranking with CLIP text-to-image results (reciprocal rank fusion,
+    the vector list weighted by `vector_weight`). Filters are exact matches on category, brand
+    and gender. Returns [(product row, score), ...], best first.
+    """
+    initializer = Initializer.get_instance()
+    # Fetch deeper lists than k so fusion can promote items found by both rankings
+    depth = k if mode == "lexical" else max(2 * k, 20)
+    lexical = initializer.search_index.search(query, depth, filters)
+    if mode == "lexical":
+        ranked = lexical
+    else:
+        vector = [product["id"] for product, _ in search_products_by_text(query, depth) if matches_filters(product, filters)]
+        ranked = fuse_rankings([[product_id for product_id, _ in lexical], vector], [1.0, vector_weight], k)
+
+    results = []
+    for product_id, score in ranked[:k]:
+        product = initializer.catalog.get_by_id(product_id)
+        if product is not None:
+            results.append((product, score))
+    return results
@@ -0,0 +1,214 @@
+"""
+In-process lexical search over the product catalog.
+
+A BM25F-style inverted index over name, brand, category, description, material_info and gender
+(per-field weights), with exact-match filters on category, brand and gender. It is built from the
+in-memory ProductCatalog and kept current from the catalog's change listener, so searches never
+touch Supabase. Every update recompiles the postings into per-term numpy arrays of precomputed
+BM25 impacts, so a query is a handful of vectorised adds over a dense score array and answers in
+well under a millisecond. `fuse_rankings` combines lexical results with vector (CLIP) results by weighted
+reciprocal rank fusion, which needs no score calibration between the two.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import heapq
+import math
+import re
+import threading
+
+# Field -> weight of its term frequencies
+SEARCH_FIELDS = {
+    "name": 3.0,
+    "brand": 2.0,
+    "category": 2.0,
+    "description": 1.0,
+    "material_info": 1.0,
+    "gender": 1.0,
+}
+FILTER_FIELDS = ("category", "brand", "gender")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from i in is it me my of on or some something that the this to want with you your".split()
+)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase alphanumeric tokens without stopwords; a trailing plural "s" is dropped."""
+    tokens = []
+    for token in _TOKEN_RE.findall(str(text or "").lower()):
+        if token in _STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _normalize_value(value) -> Optional[str]:
+    return str(value).strip().lower() if value else None
+
+
+def matches_filters(product: dict, filters: Optional[Dict[str, str]]) -> bool:
+    """Same exact-match semantics as ProductSearchIndex.search filters, for results from elsewhere."""
+    return all(
+        value is None or _normalize_value(product.get(field)) == _normalize_value(value)
+        for field, value in (filters or {}).items()
+    )
+
+
+class _CompiledIndex:
+    """Immutable, array-based snapshot of the postings that searches read without locking."""
+
+    def __init__(self, doc_ids: List[str], terms: Dict[str, tuple], filters: Dict[str, Dict[str, np.ndarray]]):
+        self.doc_ids = doc_ids
+        self.terms = terms        # term -> (doc rows, idf * BM25 term weight per row)
+        self.filters = filters    # field -> value -> doc rows
+
+    def allowed_mask(self, filters: Optional[Dict[str, str]]) -> Optional[np.ndarray]:
+        mask = None
+        for field, value in (filters or {}).items():
+            if value is None or field not in self.filters:
+                continue
+            field_mask = np.zeros(len(self.doc_ids), dtype=bool)
+            rows = self.filters[field].get(_normalize_value(value))
+            if rows is not None:
+                field_mask[rows] = True
+            mask = field_mask if mask is None else mask & field_mask
+        return mask
+
+
+class ProductSearchIndex:
+    def __init__(self, fields: Dict[str, float] = None):
+        self.fields = fields or SEARCH_FIELDS
+        self._postings: Dict[str, Dict[str, float]] = defaultdict(dict)  # term -> {product id: weighted tf}
+        self._doc_terms: Dict[str, Dict[str, float]] = {}                 # product id -> {term: weighted tf}
+        self._doc_length: Dict[str, float] = {}
+        self._total_length = 0.0
+        self._filters: Dict[str, Dict[str, set]] = {field: defaultdict(set) for field in FILTER_FIELDS}
+        self._doc_filters: Dict[str, Dict[str, Optional[str]]] = {}
+        self._lock = threading.Lock()
+        self._compiled = _CompiledIndex([], {}, {})
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    @classmethod
+    def from_products(cls, products: Iterable[dict]) -> "ProductSearchIndex":
+        index = cls()
+        index.upsert(products)
+        return index
+
+    def _remove(self, product_id: str):
+        terms = self._doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_length.pop(product_id)
+        for field, value in self._doc_filters.pop(product_id).items():
+            if value is not None:
+                self._filters[field][value].discard(product_id)
+
+    def upsert(self, products: Iterable[dict]):
+        """Index (or re-index) products; also usable as a ProductCatalog change listener."""
+        with self._lock:
+            for product in products:
+                product_id = product["id"]
+                self._remove(product_id)
+                terms = defaultdict(float)
+                for field, weight in self.fields.items():
+                    for token in tokenize(product.get(field)):
+                        terms[token] += weight
+                self._doc_terms[product_id] = dict(terms)
+                for term, tf in terms.items():
+                    self._postings[term][product_id] = tf
+                length = sum(terms.values())
+                self._doc_length[product_id] = length
+                self._total_length += length
+                values = {field: _normalize_value(product.get(field)) for field in FILTER_FIELDS}
+                self._doc_filters[product_id] = values
+                for field, value in values.items():
+                    if value is not None:
+                        self._filters[field][value].add(product_id)
+            self._compile()
+
+    def remove(self, product_ids: Iterable[str]):
+        with self._lock:
+            for product_id in product_ids:
+                self._remove(product_id)
+            self._compile()
+
+    def _compile(self):
+        # BM25 term weights depend on the average document length, so recompute them all
+        doc_ids = sorted(self._doc_terms)
+        row_of = {product_id: row for row, product_id in enumerate(doc_ids)}
+        n_docs = len(doc_ids)
+        avg_length = self._total_length / n_docs if n_docs else 1.0
+        lengths = np.array([self._doc_length[product_id] for product_id in doc_ids], dtype=np.float32)
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(avg_length, 1e-6))
+        terms = {}
+        for term, postings in self._postings.items():
+            rows = np.fromiter((row_of[product_id] for product_id in postings), dtype=np.int64, count=len(postings))
+            tfs = np.fromiter(postings.values(), dtype=np.float32, count=len(postings))
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            terms[term] = (rows, (idf * tfs * (BM25_K1 + 1) / (tfs + norms[rows])).astype(np.float32))
+        filters = {
+            field: {
+                value: np.fromiter((row_of[product_id] for product_id in ids), dtype=np.int64, count=len(ids))
+                for value, ids in values.items() if ids
+            }
+            for field, values in self._filters.items()
+        }
+        self._compiled = _CompiledIndex(doc_ids, terms, filters)
+
+    def search(self, query: str, k: int = 10, filters: Optional[Dict[str, str]] = None) -> List[Tuple[str, float]]:
+        """
+        BM25 top-k over the indexed fields, restricted to products matching every filter
+        (e.g. {"category": "shoes"}). Returns [(product id, score), ...], best first.
+        An empty query returns filtered products with score 0.
+        """
+        compiled = self._compiled  # swapped atomically by writers
+        mask = compiled.allowed_mask(filters)
+        terms = set(tokenize(query))
+        if not terms:
+            rows = np.arange(len(compiled.doc_ids)) if mask is None else np.flatnonzero(mask)
+            return [(compiled.doc_ids[row], 0.0) for row in rows[:k]]
+
+        scores = np.zeros(len(compiled.doc_ids), dtype=np.float32)
+        for term in terms:
+            if term in compiled.terms:
+                rows, weights = compiled.terms[term]
+                scores[rows] += weights  # rows are unique within a term
+        if mask is not None:
+            scores[~mask] = 0
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(compiled.doc_ids[row], round(float(scores[row]), 4)) for row in matched]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"products": len(self._doc_terms), "terms": len(self._postings)}
+
+
+def fuse_rankings(rankings: List[List[str]], weights: Optional[List[float]] = None, k: int = 10) -> List[Tuple[str, float]]:
+    """
+    Weighted reciprocal rank fusion of several ranked id lists (e.g. BM25 and CLIP results):
+    score(id) = sum_i weight_i / (RRF_K + rank_i(id)). Returns [(id, fused score), ...], best first.
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] += weight / (RRF_K + rank)
+    return [(item, round(score, 6)) for item, score in heapq.nlargest(k, scores.items(), key=lambda entry: entry[1])]
@@ -7,6 +7,7 @@ from typing import List, Dict
 from uagents_core.envelope import Envelope
 from uagents.communication import send_sync_message
 import json
+import asyncio
 from uagents_core.identity import Identity
 
 # Load environment variables
@@ -53,15 +54,19 @@ def get_current_trends(style: str) -> dict:
 class Response:
     text: str
 
-async def search_similar_products(trend_keywords: str, location: str, style_description: str = "") -> WebSearchResponse:
+async def search_similar_products(trend_keywords: str, location: str, style_description: str = "",
+                                  place=None) -> WebSearchResponse:
     """
     Use Tavily agent to search for stores selling similar products near the user's location.
+    `place` is reverse_geocode(location) when the caller already has it.
     Returns a list of dicts with store info.
     """
     # This is a placeholder for Tavily agent integration.
     # In production, use uagents or HTTP API as per your infra.
     # Here, we simulate a web search with requests (replace with agent call if needed).
-    QUERY = f"stores near {reverse_geocode(location)} selling products matching: {trend_keywords['analysis']}. User is looking for: {style_description}"
+    if place is None:
+        place = await asyncio.to_thread(reverse_geocode, location)
+    QUERY = f"stores near {place} selling products matching: {trend_keywords['analysis']}. User is looking for: {style_description}"
     print('QUERY', QUERY)
     print("--------------------------------\n")
     # agent1q2pm7q68sxus5jtwge6x9x6eqlp2f2tqh54fqtc9y4e89fnlyeps5mah6wh
@@ -84,10 +89,14 @@ async def find_nearby_stores_with_metadata(product_metadata: dict, user_style_de
     """
     Main function: Given product metadata, user style description, and user location, returns a list of store dicts (name, address, etc) near the user selling similar, on-trend products.
     """
-    # 1. Get current trends for the style
+    # 1. Get current trends for the style, while reverse-geocoding the location (both blocking HTTP calls,
+    # run off the event loop)
     style = product_metadata.get("title") or product_metadata.get("description") or "fashion"
-    trend_analysis = get_current_trends(style)
+    trend_analysis, place = await asyncio.gather(
+        asyncio.to_thread(get_current_trends, style),
+        asyncio.to_thread(reverse_geocode, user_location)
+    )
     # 2. Search for similar products/stores using Tavily
-    stores = await search_similar_products(trend_analysis, user_location, user_style_description)
+    stores = await search_similar_products(trend_analysis, user_location, user_style_description, place)
     # 3. Return store dicts (with name, address, etc)
     return stores 
\ No newline at end of file
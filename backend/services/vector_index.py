@@ -0,0 +1,173 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import faiss
+from services.index_factory import index_ids, search_params
+
+# Detector labels -> product categories they should be matched against
+LABEL_CATEGORIES = {
+    "bottom": ["bottom", "skirt"],
+}
+
+
+class VectorIndex:
+    """
+    The global FAISS index plus one id selector per product category.
+    Each query searches only its label's partition (the global index restricted to the
+    partition's ids, so no vectors are copied and an mmap'd index stays shared); queries whose
+    partition is missing or smaller than `min_partition_size` search the whole index.
+    Returned ids are always global vector ids.
+    """
+
+    def __init__(self, index, vector_categories: Dict[int, Optional[str]], min_partition_size: int = 1):
+        self.index = index
+        self.min_partition_size = min_partition_size
+        self.partitions: Dict[str, Tuple[faiss.IDSelector, np.ndarray]] = {}
+        self._build_partitions(vector_categories)
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def _build_partitions(self, vector_categories: Dict[int, Optional[str]]):
+        if not any(vector_categories.values()):
+            return
+        ids_by_category: Dict[str, List[int]] = {}
+        for vector_id in index_ids(self.index).tolist():
+            category = vector_categories.get(vector_id)
+            if category:
+                ids_by_category.setdefault(category.lower(), []).append(vector_id)
+        for category, ids in ids_by_category.items():
+            self.partitions[category] = self._id_partition(ids)
+        # Labels spanning several categories get one merged partition
+        for label, categories in LABEL_CATEGORIES.items():
+            ids = [i for c in categories for i in ids_by_category.get(c, [])]
+            if ids and len(categories) > 1:
+                self.partitions[f"label:{label}"] = self._id_partition(ids)
+        print(f"[VectorIndex] Partitions: { {c: len(ids) for c, (_, ids) in self.partitions.items()} }")
+
+    @staticmethod
+    def _id_partition(ids: List[int]):
+        ids = np.array(ids, dtype=np.int64)
+        # The selector must stay referenced for as long as searches may use it
+        return faiss.IDSelectorBatch(ids), ids
+
+    def _partition_for(self, label: Optional[str], min_size: int):
+        if not label:
+            return None
+        label = label.lower()
+        partition = self.partitions.get(f"label:{label}") or self.partitions.get(label)
+        if partition is None or len(partition[1]) < min_size:
+            return None
+        return partition
+
+    def partition_size(self, label: Optional[str]) -> int:
+        partition = self._partition_for(label, 0)
+        return 0 if partition is None else len(partition[1])
+
+    def search(self, features: np.ndarray, k: int, labels: Optional[List[str]] = None,
+               exclude: Optional[faiss.IDSelector] = None, strict: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search every query row; with `labels`, row i only searches labels[i]'s partition.
+        `exclude` selects the ids that may be returned (e.g. everything but removed vectors).
+        With `strict`, a labelled row without a partition gets no results instead of searching
+        the whole index, and partition sizes are not checked (the caller already decided).
+        Returns (distances, global ids) of shape (n_queries, k), padded with -1 ids.
+        """
+        k = max(1, min(k, self.index.ntotal))
+        if not labels and exclude is None:
+            return self.index.search(features, k)
+
+        dists = np.full((features.shape[0], k), -np.inf, dtype="float32")
+        indexes = np.full((features.shape[0], k), -1, dtype="int64")
+        rows_by_partition: Dict[int, Tuple[tuple, List[int]]] = {}
+        global_rows = []
+        min_size = 0 if strict else max(self.min_partition_size, k)
+        for row, label in enumerate(labels or [None] * features.shape[0]):
+            partition = self._partition_for(label, min_size)
+            if partition is not None:
+                rows_by_partition.setdefault(id(partition[0]), (partition, []))[1].append(row)
+            elif not (strict and label):
+                global_rows.append(row)
+
+        # One search call per partition touched by this request, plus one for the fallbacks
+        for (selector, _), rows in rows_by_partition.values():
+            if exclude is not None:
+                selector = faiss.IDSelectorAnd(selector, exclude)
+            D, I = self.index.search(features[rows], k, params=search_params(self.index, selector))
+            dists[rows] = D
+            indexes[rows] = I
+        if global_rows:
+            params = search_params(self.index, exclude) if exclude is not None else None
+            D, I = self.index.search(features[global_rows], k, params=params)
+            dists[global_rows] = D
+            indexes[global_rows] = I
+        return dists, indexes
+
+
+def merge_results(results: List[Tuple[np.ndarray, np.ndarray]], k: int, metric_type: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k of several (distances, ids) results for the same queries, -1 ids last."""
+    dists = np.hstack([D for D, _ in results])
+    indexes = np.hstack([I for _, I in results])
+    scores = -dists if metric_type == faiss.METRIC_INNER_PRODUCT else dists
+    order = np.argsort(np.where(indexes >= 0, scores, np.inf), axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(dists, order, axis=1), np.take_along_axis(indexes, order, axis=1)
+
+
+class LayeredVectorIndex:
+    """
+    A base VectorIndex that is never mutated (it may be the shared mmap'd build) plus the changes
+    made since: `delta`, a small exact VectorIndex of the vectors added, and `removed`, the base
+    ids that were deleted or replaced (filtered out at search time). Publishing a change costs
+    O(size of the changes); IndexManager folds the layers into a new base once they grow.
+    """
+
+    def __init__(self, base: VectorIndex, delta: Optional[VectorIndex] = None,
+                 delta_categories: Optional[Dict[int, Optional[str]]] = None, removed: Iterable[int] = ()):
+        self.base = base
+        self.delta = delta
+        self.delta_categories = delta_categories or {}  # delta vector id -> category, for the next delta
+        self.removed = np.array(sorted(removed), dtype=np.int64)
+        self._removed_selector = None
+        self._exclude = None
+        if len(self.removed):
+            # Both selectors must stay referenced: IDSelectorNot keeps a raw pointer
+            self._removed_selector = faiss.IDSelectorBatch(self.removed)
+            self._exclude = faiss.IDSelectorNot(self._removed_selector)
+
+    @property
+    def index(self):
+        """The base FAISS index."""
+        return self.base.index
+
+    @property
+    def delta_size(self) -> int:
+        return self.delta.ntotal if self.delta is not None else 0
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal - len(self.removed) + self.delta_size
+
+    def partition_size(self, label: Optional[str]) -> int:
+        return self.base.partition_size(label) + (self.delta.partition_size(label) if self.delta is not None else 0)
+
+    def partition_sizes(self) -> Dict[str, int]:
+        sizes = {}
+        for vector_index, removed in ((self.base, self.removed), (self.delta, None)):
+            for name, (_, ids) in (vector_index.partitions.items() if vector_index is not None else ()):
+                live = len(ids) - (int(np.isin(ids, removed).sum()) if removed is not None and len(removed) else 0)
+                sizes[name] = sizes.get(name, 0) + live
+        return sizes
+
+    def search(self, features: np.ndarray, k: int, labels: Optional[List[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Same contract as VectorIndex.search, over the base and delta layers together."""
+        if self.delta is None and self._exclude is None:
+            return self.base.search(features, k, labels)
+        k = max(1, min(k, self.ntotal))
+        if labels:
+            # Decide the partition fallback on the combined sizes, then search both layers the same way
+            min_size = max(self.base.min_partition_size, k)
+            labels = [label if self.partition_size(label) >= min_size else None for label in labels]
+        results = [self.base.search(features, k, labels, exclude=self._exclude, strict=True)]
+        if self.delta_size:
+            results.append(self.delta.search(features, k, labels, strict=True))
+        return merge_results(results, k, self.base.index.metric_type)
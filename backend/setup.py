@@ -1,21 +1,40 @@
-from transformers import CLIPModel, CLIPProcessor
-from transformers import YolosImageProcessor, YolosForObjectDetection
+from transformers import CLIPModel, CLIPProcessor, CLIPImageProcessor
+from transformers import YolosImageProcessor, YolosForObjectDetection, YolosConfig
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import Query
 from dotenv import load_dotenv
-from groq import Groq
+from PIL import Image
 import numpy as np
+import threading
 import faiss
 import torch
 import json
 import torch
+import time
 import os
 from db.supabase_client import supabase
+from utils.artifact_cache import fetch_artifact, read_faiss_index, artifact_version, artifact_sha256, file_sha256
+from services.catalog_service import ProductCatalog
+from services.search_index import ProductSearchIndex
+from services.index_manifest import read_manifest, manifest_image_paths, manifest_file, verify_manifest, IndexManifestMismatch
+from services.index_factory import build_index, DEFAULT_NPROBE, DEFAULT_EF_SEARCH
+from services.index_manager import IndexManager, DEFAULT_MAX_DELTA_SIZE
+from services.inference_backend import create_inference_backend, run_detection, run_image_embedding, run_text_embedding
+from services.inference_backend import YOLOS_CHECKPOINT, CLIP_CHECKPOINT
+from services.model_workers import ModelWorkerPool
+from services.image_store import ImageArtifactCache
+from services.llm_gateway import get_llm_gateway
+from services.embedding_cache import CropEmbeddingCache
+from services.preprocessing import ClipInputSpec, preprocess_images
+from services.prompt_images import PromptImagePreparer, CatalogThumbnailCache
+from utils.artifact_cache import ARTIFACT_CACHE_DIR
 import requests
 load_dotenv()
 
 
 class Initializer:
     _instance = None
+    _instance_lock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
@@ -27,66 +46,327 @@ class Initializer:
         if self._initialized:
             return
 
-        # INITIALIZE VALUES
+        # INITIALIZE VALUES - configuration only; models and artifacts are loaded by load()
         self.device = torch.device(
             "cuda" if torch.cuda.is_available() else "cpu")
         self.max_selected_items_mllm = 5
         self.embed_dim = 768
+        self.warmup_image_size = int(os.getenv("WARMUP_IMAGE_SIZE", 512))
 
-        # Download image.faiss from Supabase Storage if not present
-        SUPABASE_URL = os.getenv("SUPABASE_URL")
-        SUPABASE_BUCKET_IMAGES = "product-images"   
-        SUPABASE_BUCKET_FAISS = "faiss"
-        faiss_response = supabase.storage.from_(SUPABASE_BUCKET_FAISS).get_public_url('image.faiss')
-        image_response = supabase.storage.from_(SUPABASE_BUCKET_IMAGES).list()
-
-        faiss_url = faiss_response
-        local_faiss_path = "/tmp/image.faiss"
-        if not os.path.exists(local_faiss_path):
-            r = requests.get(faiss_url)
-            r.raise_for_status()
-            with open(local_faiss_path, "wb") as f:
-                f.write(r.content)
-        self.index_path = faiss_response  # Supabase Storage URL for reference
-        self.index = faiss.read_index(local_faiss_path)
+        # MICRO-BATCHING - cross-request inference scheduler
+        self.inference_max_batch_size = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", 8))
+        self.inference_max_embed_batch_size = int(os.getenv("INFERENCE_MAX_EMBED_BATCH_SIZE", 32))
+        self.inference_max_wait_ms = float(os.getenv("INFERENCE_MAX_WAIT_MS", 5))
+        self.inference_max_queue_depth = int(os.getenv("INFERENCE_MAX_QUEUE_DEPTH", 64))
 
+        # FAISS INDEX - image.faiss (+ manifest) in the Supabase faiss bucket, cached locally
+        self.supabase_url = os.getenv("SUPABASE_URL")
+        self.bucket_images = "product-images"
+        self.bucket_faiss = "faiss"
+        self.index_path = supabase.storage.from_(self.bucket_faiss).get_public_url('image.faiss')  # Supabase Storage URL for reference
+        self.faiss_mmap = os.getenv("FAISS_MMAP", "true").lower() == "true"
+        # Optionally re-index the downloaded vectors into an ANN index type (see scripts/benchmark_ann.py)
+        self.faiss_index_type = os.getenv("FAISS_INDEX_TYPE", "")
+
+        # INFERENCE BACKEND - "torch" (eager fp32) or "onnx" (ONNX Runtime, optionally int8)
+        self.inference_backend_name = os.getenv("INFERENCE_BACKEND", "torch").lower()
+        self.onnx_model_dir = os.getenv("ONNX_MODEL_DIR", "assets/onnx_models")
+        self.onnx_quantized = os.getenv("ONNX_QUANTIZATION", "none").lower() == "int8"
+        self.onnx_num_threads = int(os.getenv("ONNX_NUM_THREADS", 0))
+        self.ckpt = YOLOS_CHECKPOINT
+        self.clip_model_id = CLIP_CHECKPOINT
+
+        # MODEL WORKERS - run YOLOS/CLIP in separate processes (0 = in the API process)
+        self.model_workers = int(os.getenv("MODEL_WORKERS", 0))
+        self.model_worker_threads = int(os.getenv("MODEL_WORKER_THREADS", 0))
+        self.model_worker_pin_cpus = os.getenv("MODEL_WORKER_PIN_CPUS", "true").lower() == "true"
+        self.model_worker_pool = None
+        self.yolo_model = None
+        self.clip_model = None
+        self.inference_backend = None
+
+        # IMAGE HANDLES - upload-once images with their detections and crop embeddings
+        self.image_cache = ImageArtifactCache(
+            max_items=int(os.getenv("IMAGE_CACHE_MAX_ITEMS", 256)),
+            max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", 512)) * 1024 ** 2,
+            ttl_seconds=float(os.getenv("IMAGE_CACHE_TTL_SECONDS", 900))
+        )
+        # CROP EMBEDDINGS - perceptual-hash keyed, shared by all requests (0 disables)
+        self.crop_embedding_cache = CropEmbeddingCache(
+            max_items=int(os.getenv("CROP_EMBEDDING_CACHE_SIZE", 4096)),
+            # int8 ONNX embeddings differ slightly from fp32 ones, so they don't share entries
+            model_id=f"{self.clip_model_id}:{self.inference_backend_name}{':int8' if self.onnx_quantized else ''}"
+        )
+        # Binary uploads: size cap, and the smallest side JPEGs are draft-decoded down to
+        # (YOLOS resizes to an 800px shortest edge anyway)
+        self.image_upload_max_bytes = int(os.getenv("IMAGE_UPLOAD_MAX_MB", 20)) * 1024 ** 2
+        self.image_decode_min_side = int(os.getenv("IMAGE_DECODE_MIN_SIDE", 800))
+        # PROMPT IMAGES - downscaled query photo and cached catalog thumbnails for the advisor LLM
+        self.prompt_images = PromptImagePreparer(
+            enabled=os.getenv("PROMPT_IMAGE_COMPRESSION", "true").lower() == "true",
+            max_side=int(os.getenv("PROMPT_IMAGE_MAX_SIDE", 768)),
+            quality=int(os.getenv("PROMPT_IMAGE_QUALITY", 80)),
+            thumbnails=CatalogThumbnailCache(
+                os.getenv("PROMPT_THUMBNAIL_DIR", os.path.join(ARTIFACT_CACHE_DIR, "thumbnails")),
+                max_side=int(os.getenv("PROMPT_THUMBNAIL_SIDE", 384)),
+                quality=int(os.getenv("PROMPT_THUMBNAIL_QUALITY", 75))
+            )
+        )
+
+        # Set self.database to the Supabase client for later table queries
         self.database = supabase
 
-        # Fetch image paths from Supabase Storage (bucket: product-images)
-        image_files = [
-            f["name"] for f in image_response if f["name"].lower().endswith((".png", ".jpg", ".jpeg"))
-        ]
-        self.image_paths = [
-            f"{SUPABASE_URL}/storage/v1/object/public/{SUPABASE_BUCKET_IMAGES}/{file_name}"
-            for file_name in image_files
-        ]
+        self.startup_timings = {}
+        self.load_error = None
+        self._ready = threading.Event()
+        self._load_lock = threading.Lock()
+        self._loading_thread = None
 
+        # INITIALIZE
+        self._initialized = True
+
+    # -------------------------------
+    # Startup: parallel loading, warmup, readiness
+    # -------------------------------
+
+    def _timed(self, stage: str, fn):
+        start = time.perf_counter()
+        result = fn()
+        self.startup_timings[stage] = round(time.perf_counter() - start, 3)
+        print(f"[Initializer] {stage} ready in {self.startup_timings[stage]:.2f}s")
+        return result
+
+    def _load_catalog(self):
+        # PRODUCT CATALOG - in-memory snapshot of the products table
+        self.catalog = ProductCatalog(supabase)
+        self.catalog.load()
+        # PRODUCT SEARCH - BM25 over the catalog's text fields, kept current from catalog refreshes
+        self.search_index = ProductSearchIndex.from_products(self.catalog.all_products())
+        self.catalog.add_listener(self.search_index.upsert, on_remove=self.search_index.remove)
+        # PROMPT THUMBNAILS - generated in the background for images without one on disk yet
+        if os.getenv("PROMPT_THUMBNAIL_PRECOMPUTE", "true").lower() == "true":
+            self.prompt_images.schedule_thumbnails(p.get("image") for p in self.catalog.all_products())
+            self.catalog.add_listener(lambda products: self.prompt_images.schedule_thumbnails(p.get("image") for p in products))
+
+    def _load_index_artifact(self):
+        path = self._fetch_index()
+        index, vector_paths = self._load_index(path)
+        return index, vector_paths, artifact_version(path) or file_sha256(path)[:12]
+
+    def _load_detector(self):
         # LOAD YOLO MODEL - object detector
-        self.ckpt = 'yainage90/fashion-object-detection-yolos-tiny'
         self.yolo_image_processor = YolosImageProcessor.from_pretrained(
             self.ckpt)
-        self.yolo_model = YolosForObjectDetection.from_pretrained(
-            self.ckpt).to(self.device)
+        self.yolo_model = None
+        if self.inference_backend_name == "torch":
+            self.yolo_model = YolosForObjectDetection.from_pretrained(
+                self.ckpt).to(self.device)
+        self.yolo_id2label = YolosConfig.from_pretrained(self.ckpt).id2label
 
+    def _load_embedder(self):
         # LOAD CLIP VIT LARGE - image embedding
-        self.clip_model_id = 'openai/clip-vit-large-patch14-336'
-        self.clip_model = CLIPModel.from_pretrained(
-            self.clip_model_id).to(self.device)
+        self.clip_model = None
+        if self.inference_backend_name == "torch":
+            self.clip_model = CLIPModel.from_pretrained(
+                self.clip_model_id).to(self.device)
         self.feature_extractor = CLIPProcessor.from_pretrained(
             self.clip_model_id)
+        self.clip_input = ClipInputSpec.from_processor(self.feature_extractor)
+        self.clip_tokenizer = self.feature_extractor.tokenizer
 
-        # LOAD GROQ CLIENT
-        self.client_groq = Groq()
+    def _start_model_workers(self):
+        # The API process still crops and resizes for CLIP, so it needs the input settings
+        self.clip_input = ClipInputSpec.from_processor(CLIPImageProcessor.from_pretrained(self.clip_model_id))
+        self.model_worker_pool = ModelWorkerPool(
+            self.model_workers,
+            threads_per_worker=self.model_worker_threads,
+            backend_name=self.inference_backend_name,
+            model_dir=self.onnx_model_dir,
+            quantized=self.onnx_quantized,
+            pin_cpus=self.model_worker_pin_cpus
+        ).start()
 
-        # Set self.database to the Supabase client for later table queries
-        self.database = supabase
+    def _load_llm_client(self):
+        # LLM GATEWAY - one pooled Groq client shared by every LLM call
+        self.llm = get_llm_gateway()
+        # Semantic tier of the LLM response cache: CLIP text embeddings of the query (used once models are ready)
+        from services.retrieval_service import embed_texts
+        self.llm.cache.embed = embed_texts
 
-        # INITIALIZE
-        self._initialized = True
+    def load(self):
+        """
+        Load every model and artifact, with independent stages running concurrently,
+        then warm up inference. Marks the instance ready when done.
+        """
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=5, thread_name_prefix="initializer") as pool:
+            stages = {
+                "catalog": pool.submit(self._timed, "catalog", self._load_catalog),
+                "index": pool.submit(self._timed, "index", self._load_index_artifact),
+                "llm_client": pool.submit(self._timed, "llm_client", self._load_llm_client),
+            }
+            if self.model_workers > 0:
+                # The API process only does request I/O; workers load (and warm up) the models
+                stages["model_workers"] = pool.submit(self._timed, "model_workers", self._start_model_workers)
+            else:
+                stages["detector"] = pool.submit(self._timed, "detector", self._load_detector)
+                stages["embedder"] = pool.submit(self._timed, "embedder", self._load_embedder)
+            for future in stages.values():
+                future.result()
+
+        # VECTOR INDEX - versioned snapshots with per-category partitions, incremental product
+        # updates and zero-downtime reloads of new builds (services/index_manager.py)
+        self.index_manager = IndexManager(
+            self.catalog,
+            fetch_index=self._fetch_index,
+            load_index=self._load_index,
+            embed_images=self._embed_catalog_images,
+            partition_by_category=os.getenv("RETRIEVAL_PARTITION_BY_CATEGORY", "true").lower() == "true",
+            min_partition_size=int(os.getenv("RETRIEVAL_MIN_PARTITION_SIZE", 1)),
+            nprobe=int(os.getenv("FAISS_NPROBE", DEFAULT_NPROBE)),
+            ef_search=int(os.getenv("FAISS_EF_SEARCH", DEFAULT_EF_SEARCH)),
+            max_delta_size=int(os.getenv("INDEX_MAX_DELTA_SIZE", DEFAULT_MAX_DELTA_SIZE))
+        )
+        self._timed("index_install", lambda: self.index_manager.install(*stages["index"].result()))
+
+        if self.model_worker_pool is None:
+            self.inference_backend = self._timed("inference_backend", lambda: create_inference_backend(
+                self.inference_backend_name,
+                yolo_model=self.yolo_model,
+                clip_model=self.clip_model,
+                device=self.device,
+                model_dir=self.onnx_model_dir,
+                quantized=self.onnx_quantized,
+                num_threads=self.onnx_num_threads
+            ))
+        self._timed("warmup", self.warmup)
+
+        if os.getenv("INDEX_AUTO_UPDATE", "true").lower() == "true":
+            self.catalog.add_listener(self.index_manager.on_products_changed, on_remove=self.index_manager.remove_products)
+        self.catalog.start_auto_refresh(
+            int(os.getenv("CATALOG_REFRESH_SECONDS", 60)),
+            full_reload_seconds=int(os.getenv("CATALOG_FULL_RELOAD_SECONDS", 3600))
+        )
+        self.index_manager.start_watch(int(os.getenv("INDEX_WATCH_SECONDS", 0)))
+
+        self.startup_timings["total"] = round(time.perf_counter() - start, 3)
+        print(f"[Initializer] Startup timings (s): {self.startup_timings}")
+        self._ready.set()
+
+    def warmup(self):
+        """One detection, embedding and search pass, so the first request doesn't pay for lazy init."""
+        image = Image.new("RGB", (self.warmup_image_size, self.warmup_image_size), (127, 127, 127))
+        if self.model_worker_pool is not None:
+            # Workers warm up their own models on start; this exercises the shared-memory path
+            self.model_worker_pool.detect([image], threshold=1.0)
+            features = self.model_worker_pool.embed(preprocess_images([image], self.clip_input))
+        else:
+            run_detection(self.inference_backend, self.yolo_image_processor, self.yolo_id2label, [image])
+            features = run_image_embedding(self.inference_backend, self.feature_extractor, [image])
+            try:
+                run_text_embedding(self.inference_backend, self.clip_tokenizer, ["warmup"])
+            except RuntimeError as e:
+                print(f"[Initializer] Text retrieval unavailable: {e}")
+        self.index_manager.current().vector_index.search(features, 1)
+
+    @classmethod
+    def start_loading(cls):
+        """Start load() on a background thread (once). Returns immediately."""
+        with cls._instance_lock:
+            instance = cls()
+        with instance._load_lock:
+            if instance._loading_thread is None:
+                instance._loading_thread = threading.Thread(
+                    target=instance._load_in_background, name="initializer-load", daemon=True)
+                instance._loading_thread.start()
+        return instance
+
+    def _load_in_background(self):
+        try:
+            self.load()
+        except Exception as e:
+            self.load_error = f"{type(e).__name__}: {e}"
+            print(f"[Initializer] Startup failed: {self.load_error}")
+            self._ready.set()
+
+    @classmethod
+    def is_ready(cls) -> bool:
+        with cls._instance_lock:
+            instance = cls()
+        return instance._ready.is_set() and instance.load_error is None
+
+    def status(self) -> dict:
+        return {
+            "ready": self._ready.is_set() and self.load_error is None,
+            "loading": self._loading_thread is not None and not self._ready.is_set(),
+            "error": self.load_error,
+            "startup_timings": dict(self.startup_timings)
+        }
+
+    def _fetch_index(self) -> str:
+        # Checksummed local cache, revalidated against the bucket's ETag
+        return fetch_artifact(self.index_path, "image.faiss")
+
+    def _load_index(self, path: str):
+        """
+        The index at `path` and the image path of every vector id. Raises IndexManifestMismatch
+        (so a reload keeps the current snapshot) when the id map was not built for this index file.
+        """
+        index = read_faiss_index(path, mmap=self.faiss_mmap)
+        # Image path of every vector id: the builder's manifest for this exact index file
+        # (scripts/build_index.py), falling back to listing the product-images bucket page by page
+        image_paths = self._manifest_image_paths(self.bucket_faiss, artifact_sha256(path), index.ntotal)
+        if image_paths is None:
+            image_paths = self._list_bucket_image_paths(self.supabase_url, self.bucket_images)
+        if len(image_paths) != index.ntotal:
+            raise IndexManifestMismatch(f"{len(image_paths)} image paths for {index.ntotal} vectors")
+
+        if self.faiss_index_type not in ("", "flat") and isinstance(faiss.downcast_index(index), faiss.IndexFlat):
+            print(f"[Initializer] Building {self.faiss_index_type} index in memory; prefer building it offline")
+            index = build_index(index.reconstruct_n(0, index.ntotal), self.faiss_index_type, index.metric_type)
+        return index, dict(enumerate(image_paths))
+
+    def _embed_catalog_images(self, images):
+        # Imported here: the retrieval service imports this module
+        from services.retrieval_service import get_embedding_batcher
+        return get_embedding_batcher().run(list(preprocess_images(images, self.clip_input)))
+
+    def _manifest_image_paths(self, bucket: str, index_sha256: str, ntotal: int):
+        name = manifest_file(index_sha256)
+        manifest_url = supabase.storage.from_(bucket).get_public_url(name)
+        try:
+            manifest = read_manifest(fetch_artifact(manifest_url, name))
+        except requests.RequestException as e:
+            print(f"[Initializer] No index manifest available for {name} ({e})")
+            return None
+        if manifest is None:
+            return None
+        verify_manifest(manifest, index_sha256, ntotal)
+        print(f"[Initializer] Index manifest version {manifest.get('version')} ({manifest.get('count')} vectors)")
+        return manifest_image_paths(manifest)
+
+    def _list_bucket_image_paths(self, supabase_url: str, bucket: str, page_size: int = 100):
+        image_files, offset = [], 0
+        while True:
+            page = supabase.storage.from_(bucket).list(
+                options={"limit": page_size, "offset": offset, "sortBy": {"column": "name", "order": "asc"}})
+            image_files += [f["name"] for f in page if f["name"].lower().endswith((".png", ".jpg", ".jpeg"))]
+            if len(page) < page_size:
+                break
+            offset += page_size
+        return [
+            f"{supabase_url}/storage/v1/object/public/{bucket}/{file_name}"
+            for file_name in image_files
+        ]
 
     def __getattr__(self, name):
         return getattr(self._instance, name)
 
     @classmethod
     def get_instance(cls):
-        return cls()
+        """The loaded singleton; starts loading if needed and blocks until it is ready."""
+        instance = cls.start_loading()
+        instance._ready.wait()
+        if instance.load_error is not None:
+            raise RuntimeError(f"Initializer failed to load: {instance.load_error}")
+        return instance
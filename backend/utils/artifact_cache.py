@@ -0,0 +1,189 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import tempfile
+import hashlib
+import requests
+import faiss
+import json
+import re
+import os
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX platforms: no cross-process download lock
+    fcntl = None
+
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", "/tmp/fashion-ai-artifacts")
+CHUNK_SIZE = 1024 * 1024
+
+
+class ArtifactChecksumError(IOError):
+    pass
+
+
+@contextmanager
+def _file_lock(lock_path: str):
+    # Serialises downloads between uvicorn workers starting on the same host
+    with open(lock_path, "w") as lock_file:
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_meta(meta_path: str):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json_atomic(path: str, data: dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_valid(path: str, meta: dict) -> bool:
+    if not meta or not os.path.exists(path):
+        return False
+    stat = os.stat(path)
+    if stat.st_size != meta.get("size"):
+        return False
+    # Untouched since we wrote it: skip re-hashing a potentially multi-GB file
+    if stat.st_mtime_ns == meta.get("mtime_ns"):
+        return True
+    return file_sha256(path) == meta.get("sha256")
+
+
+def _same_remote_version(response, meta: dict) -> bool:
+    # For servers that ignore conditional request headers
+    etag = response.headers.get("ETag")
+    if etag:
+        return etag == meta.get("etag")
+    last_modified = response.headers.get("Last-Modified")
+    return last_modified is not None and last_modified == meta.get("last_modified")
+
+
+def _download(response, path: str, url: str) -> dict:
+    directory, name = os.path.split(path)
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{name}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                sha256.update(chunk)
+                md5.update(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+        size = os.path.getsize(tmp_path)
+        expected_size = response.headers.get("Content-Length")
+        encoded = response.headers.get("Content-Encoding", "identity") != "identity"
+        if expected_size is not None and not encoded and int(expected_size) != size:
+            raise ArtifactChecksumError(f"Truncated download of {url}: {size} of {expected_size} bytes")
+        # Object stores usually expose the MD5 of single-part uploads as the ETag
+        etag = response.headers.get("ETag")
+        etag_value = (etag or "").strip('"')
+        if re.fullmatch(r"[0-9a-f]{32}", etag_value) and etag_value != md5.hexdigest():
+            raise ArtifactChecksumError(f"Checksum mismatch for {url}: ETag {etag_value}, got {md5.hexdigest()}")
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return {
+        "url": url,
+        "etag": etag,
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": sha256.hexdigest(),
+        "version": sha256.hexdigest()[:12],
+        "size": size,
+        "mtime_ns": os.stat(path).st_mtime_ns,
+        "fetched_at": datetime.now(timezone.utc).isoformat()
+    }
+
+
+def fetch_artifact(url: str, name: str, cache_dir: str = ARTIFACT_CACHE_DIR, timeout: float = 60) -> str:
+    """
+    Return a local path to the artifact at `url`, downloading it only when the cached copy is missing,
+    corrupt or stale (ETag revalidation). Downloads are checksummed and atomically replace the old file,
+    so readers (and existing mmaps) never see a partial file. Falls back to a valid cached copy when
+    the remote cannot be reached.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, name)
+    meta_path = f"{path}.meta.json"
+
+    with _file_lock(f"{path}.lock"):
+        meta = _read_meta(meta_path)
+        valid = _is_valid(path, meta)
+        headers = {}
+        if valid and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        elif valid and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304:
+                    print(f"[ArtifactCache] {name} is up to date (version {meta['version']})")
+                    return path
+                response.raise_for_status()
+                if valid and _same_remote_version(response, meta):
+                    print(f"[ArtifactCache] {name} is up to date (version {meta['version']})")
+                    return path
+                meta = _download(response, path, url)
+        except requests.RequestException as e:
+            if not valid:
+                raise
+            print(f"[ArtifactCache] Could not revalidate {name} ({e}), using cached version {meta['version']}")
+            return path
+
+        _write_json_atomic(meta_path, meta)
+        print(f"[ArtifactCache] Downloaded {name} version {meta['version']} ({meta['size']} bytes)")
+    return path
+
+
+def artifact_version(path: str):
+    """Version (content hash prefix) of a cached artifact, or None if it has no metadata."""
+    meta = _read_meta(f"{path}.meta.json")
+    return meta.get("version") if meta else None
+
+
+def artifact_sha256(path: str) -> str:
+    """SHA-256 of a cached artifact, from its metadata when present (hashing the file otherwise)."""
+    meta = _read_meta(f"{path}.meta.json")
+    return (meta or {}).get("sha256") or file_sha256(path)
+
+
+def read_faiss_index(path: str, mmap: bool = True):
+    """
+    Load a FAISS index. With mmap the vectors stay in the page cache and are shared
+    by every worker process on the host instead of being copied into each one.
+
+    Read-only contract: an mmap'd index is a view over the file and must never be mutated.
+    add/add_with_ids/remove_ids/reset/train on it abort the whole process with a C++ assertion
+    ("cannot be performed on a viewed vector"), not a Python exception. Search it only, and
+    apply changes to a private copy (services/index_manager.py does this).
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    return faiss.read_index(path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
@@ -0,0 +1,9 @@
+import json
+
+# Disable proxy buffering (nginx) so every event reaches the client as soon as it is sent
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def format_sse(event: str, data) -> str:
+    """One server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -1,8 +1,9 @@
 import requests
+import re
 
 def translate_url(url):
-    # Add an extra slash after 'product-images' if not present
-    url = url.replace('product-images/', 'product-images//')
+    # Add an extra slash after 'product-images' if not present (already translated paths are unchanged)
+    url = re.sub(r'product-images/(?!/)', 'product-images//', url)
     # Encode spaces as %20
     url = url.replace(' ', '%20')
     return url